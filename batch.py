@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional, Tuple
+
+from rate_limit import BATCH, request_priority
+from resilience import is_transient
+
+logger = logging.getLogger("vocAIyze.Batch")
+
+RECORD_TYPES = ("generate", "analyze", "transcribe", "synthesize")
+
+
+class Checkpoint:
+    """
+    Progress of a batch job, small enough to rewrite after every record
+
+    Records are identified by input line number. Everything up to high_water is
+    done except the lines in retry, which failed for transient reasons and are
+    run again on resume. Lines above high_water that finished out of order are
+    kept in done until the gap below them closes; only records still in flight
+    can hold it open, so the set stays within the concurrency limit.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.high_water = 0
+        self.done = set()
+        self.retry = set()
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            self.high_water = state["high_water"]
+            self.done = set(state["done"])
+            self.retry = set(state.get("retry", []))
+            logger.info(f"Resuming batch after line {self.high_water} "
+                        f"(+{len(self.done)} completed out of order, {len(self.retry)} to retry)")
+
+    def is_done(self, line_no: int) -> bool:
+        return (line_no <= self.high_water or line_no in self.done) and line_no not in self.retry
+
+    def mark(self, line_no: int, retry: bool = False):
+        """Record a finished line; retry=True if it failed transiently and should run again"""
+        if retry:
+            self.retry.add(line_no)
+        else:
+            self.retry.discard(line_no)
+        if line_no > self.high_water:
+            self.done.add(line_no)
+        while self.high_water + 1 in self.done:
+            self.high_water += 1
+            self.done.discard(self.high_water)
+
+    def save(self):
+        """Atomically replace the checkpoint file"""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"high_water": self.high_water, "done": sorted(self.done),
+                       "retry": sorted(self.retry)}, f)
+        os.replace(tmp_path, self.path)
+
+
+class BatchRunner:
+    """
+    Stream JSONL request records through the LLM, TTS and STT components
+
+    Each input line is a JSON object with a "type" of generate, analyze,
+    transcribe or synthesize (see run_record for the fields). The input is read
+    lazily and at most `concurrency` records are in flight, so memory stays
+    flat however large the file is. Results are appended to the output JSONL
+    as they complete, in completion order, each tagged with its input line and
+    id. A checkpoint written after every result lets a killed job resume; a
+    record that finished right before the kill may be written twice. Records
+    that failed for transient API reasons are listed for retry in the
+    checkpoint, so rerunning the job runs them again.
+    """
+
+    def __init__(self, llm=None, tts=None, stt=None, concurrency: int = 8):
+        """
+        Args:
+            llm: LLM for generate and analyze records
+            tts: TextToSpeech for synthesize records
+            stt: SpeechToText for transcribe records
+            concurrency: Maximum records processed at once
+        """
+        self.llm = llm
+        self.tts = tts
+        self.stt = stt
+        self.concurrency = concurrency
+        self.counters = {"processed": 0, "failed": 0, "skipped": 0}
+        self._stop = threading.Event()
+
+    def run_record(self, record: dict) -> dict:
+        """
+        Process one request record
+
+        Fields by type:
+            generate: prompt (string or chat messages list), optional temperature/max_tokens
+            analyze: text
+            transcribe: audio_path
+            synthesize: text, output_path
+
+        Returns:
+            The result payload
+
+        Raises:
+            ValueError: For an unknown type or missing field
+        """
+        kind = record.get("type")
+        if kind == "generate":
+            # strict: a failed request must not be recorded (and checkpointed) as a reply
+            return {"text": self.llm.generate(record["prompt"], temperature=record.get("temperature"),
+                                              max_tokens=record.get("max_tokens"), strict=True)}
+        if kind == "analyze":
+            return self.llm.analyze_transcript(record["text"])
+        if kind == "transcribe":
+            return {"text": self.stt.speech_to_text(record["audio_path"])}
+        if kind == "synthesize":
+            # Always write to a file; text_to_speech without a path would play aloud
+            if not record.get("output_path"):
+                raise ValueError("synthesize records need an output_path")
+            return {"audio_path": self.tts.text_to_speech(record["text"], record["output_path"])}
+        raise ValueError(f"Unknown record type {kind!r}, expected one of {', '.join(RECORD_TYPES)}")
+
+    @staticmethod
+    def _read(input_path: str) -> Iterator[Tuple[int, str]]:
+        with open(input_path, "r") as f:
+            for line_no, line in enumerate(f, start=1):
+                yield line_no, line
+
+    def _process(self, line_no: int, line: str) -> dict:
+        result = {"line": line_no, "id": line_no}
+        try:
+            record = json.loads(line)
+            result["id"] = record.get("id", line_no)
+            result["type"] = record.get("type")
+            # Yield API capacity to interactive sessions sharing the process
+            with request_priority(BATCH):
+                result["result"] = self.run_record(record)
+            result["ok"] = True
+        except Exception as e:
+            logger.error(f"Error processing batch line {line_no}: {str(e)}")
+            result["ok"] = False
+            result["error"] = str(e)
+            # API trouble is worth another try on resume; a bad record is not
+            result["retryable"] = is_transient(e)
+        return result
+
+    def run(self, input_path: str, output_path: str, checkpoint_path: Optional[str] = None) -> dict:
+        """
+        Process every record of the input file not yet covered by the checkpoint
+
+        Args:
+            input_path: JSONL request records
+            output_path: JSONL results, appended to
+            checkpoint_path: Progress file (default: output_path + ".checkpoint")
+
+        Returns:
+            Counters for this run
+        """
+        checkpoint = Checkpoint(checkpoint_path or f"{output_path}.checkpoint")
+        in_flight = {}
+        with open(output_path, "a") as out, ThreadPoolExecutor(max_workers=self.concurrency,
+                                                                thread_name_prefix="batch") as pool:
+            def collect(return_when):
+                finished, _ = wait(in_flight, return_when=return_when)
+                for future in finished:
+                    line_no = in_flight.pop(future)
+                    result = future.result()
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                    checkpoint.mark(line_no, retry=bool(result.get("retryable")))
+                    checkpoint.save()
+                    self.counters["processed" if result["ok"] else "failed"] += 1
+
+            try:
+                for line_no, line in self._read(input_path):
+                    if self._stop.is_set():
+                        break
+                    if checkpoint.is_done(line_no):
+                        self.counters["skipped"] += 1
+                        continue
+                    if not line.strip():
+                        checkpoint.mark(line_no)  # Keep the high-water mark moving
+                        continue
+                    if len(in_flight) >= self.concurrency:
+                        collect(FIRST_COMPLETED)
+                    in_flight[pool.submit(self._process, line_no, line)] = line_no
+            finally:
+                if in_flight:
+                    collect(ALL_COMPLETED)
+
+        logger.info(f"Batch finished: {self.counters}")
+        return dict(self.counters)
+
+    def stop(self):
+        """Stop reading new records; in-flight ones are finished and checkpointed"""
+        self._stop.set()
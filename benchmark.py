@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import math
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from clients import create_openai_client
+from fake_openai_server import DEFAULT_PROFILES, EndpointProfile, FakeOpenAIServer, Latency
+from llm import ERROR_REPLY, LLM
+from metrics import FIRST_AUDIO, Metrics
+from rate_limit import RateLimiter
+from resilience import Resilience
+from stt import SAMPLE_RATE, SpeechToText
+from tts import TextToSpeech
+
+logger = logging.getLogger("vocAIyze.Benchmark")
+
+# Benchmark-only stages, measured from the end of the simulated user speech
+SPEECH_TO_FIRST_AUDIO = "speech_to_first_audio"
+TURN_TOTAL = "turn_total"
+
+# The simulated backend has no quota; only concurrency is limited
+BENCHMARK_LIMITS = {
+    "chat": {"requests_per_minute": 1000000, "tokens_per_minute": None},
+    "speech": {"requests_per_minute": 1000000},
+    "transcription": {"requests_per_minute": 1000000},
+}
+
+
+def synthetic_utterance(seconds: float = 2.0, frequency: float = 220.0) -> bytes:
+    """A WAV recording in the microphone format, as SpeechToText.capture_audio returns"""
+    samples = array("h", (int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE))
+                          for i in range(int(seconds * SAMPLE_RATE))))
+    return SpeechToText.encode_wav(samples.tobytes())
+
+
+def run_turn(llm: LLM, tts: TextToSpeech, stt: SpeechToText, audio: bytes, metrics: Metrics) -> bool:
+    """
+    One conversation turn as the pipeline runs it, minus the audio devices:
+    transcribe, stream the reply sentence by sentence, stream each sentence's speech
+
+    Returns:
+        True if the turn produced a real reply
+    """
+    started = time.monotonic()
+    text = stt.speech_to_text(audio)
+    transcribed_at = time.monotonic()
+    first_audio = None
+    ok = True
+    for sentence in llm.generate_sentences(text):
+        if sentence == ERROR_REPLY:
+            ok = False
+        for chunk in tts.iter_speech(sentence):
+            if first_audio is None and chunk:
+                first_audio = time.monotonic()
+                metrics.observe(FIRST_AUDIO, first_audio - transcribed_at)
+                metrics.observe(SPEECH_TO_FIRST_AUDIO, first_audio - started)
+    metrics.observe(TURN_TOTAL, time.monotonic() - started)
+    return ok and first_audio is not None
+
+
+def run_benchmark(turns: int = 50, concurrency: int = 4, profiles: Dict[str, EndpointProfile] = None,
+                  seed: int = None, utterance_seconds: float = 2.0, max_attempts: int = 3) -> dict:
+    """
+    Run simulated turns through the real LLM, TextToSpeech and SpeechToText
+    code against a local FakeOpenAIServer
+
+    Args:
+        turns: Number of turns to run
+        concurrency: Turns in flight at once (simulated concurrent callers)
+        profiles: Endpoint behaviour overrides for the fake server
+        seed: Seed for the server's latency and error sampling
+        utterance_seconds: Length of the audio uploaded each turn
+        max_attempts: Attempts per API call, as --max-attempts in main
+
+    Returns:
+        Report with throughput, per-stage p50/p95/p99 latencies, server
+        request counts and resilience counters
+    """
+    metrics = Metrics()
+    rate_limiter = RateLimiter({name: {**limits, "max_concurrency": max(concurrency, 1) * 2}
+                                for name, limits in BENCHMARK_LIMITS.items()})
+    resilience = Resilience(max_attempts=max_attempts, base_delay=0.05, max_delay=0.5)
+    audio = synthetic_utterance(utterance_seconds)
+
+    with FakeOpenAIServer(profiles, seed=seed) as server:
+        client = create_openai_client("benchmark", base_url=server.base_url, http2=False,
+                                      max_connections=max(concurrency, 1) * 3)
+        components = dict(client=client, rate_limiter=rate_limiter, resilience=resilience, metrics=metrics)
+        llm = LLM("benchmark", **components)
+        tts = TextToSpeech("benchmark", **components)
+        stt = SpeechToText("benchmark", **components)
+
+        def turn(_) -> bool:
+            try:
+                return run_turn(llm, tts, stt, audio, metrics)
+            except Exception as e:
+                logger.warning(f"Benchmark turn failed: {str(e)}")
+                return False
+
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+                results = list(pool.map(turn, range(turns)))
+        finally:
+            wall = time.monotonic() - started
+            client.close()
+            resilience.close()
+        server_stats = server.stats()
+
+    completed = sum(results)
+    return {
+        "turns": turns,
+        "completed": completed,
+        "failed": turns - completed,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "turns_per_second": round(completed / wall, 3) if wall > 0 else 0.0,
+        "stages": metrics.snapshot(),
+        "server": server_stats,
+        "resilience": resilience.stats(),
+    }
+
+
+def format_report(report: dict) -> str:
+    """Human-readable summary of a run_benchmark report"""
+    lines = [f"Turns: {report['completed']}/{report['turns']} completed, concurrency {report['concurrency']}, "
+             f"{report['wall_seconds']:.2f}s wall, {report['turns_per_second']:.2f} turns/s",
+             "",
+             f"{'stage':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for stage, summary in report["stages"].items():
+        cells = [f"{summary[k]:>10.1f}" if summary[k] is not None else f"{'-':>10}"
+                 for k in ("p50_ms", "p95_ms", "p99_ms")]
+        lines.append(f"{stage:<28}{summary['count']:>7}{''.join(cells)}")
+    lines += ["", f"Server requests: {report['server']}", f"Resilience: {report['resilience']}"]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vocAIyze turns against a simulated OpenAI backend")
+    parser.add_argument("--turns", type=int, default=50, help="Number of turns to run")
+    parser.add_argument("--concurrency", type=int, default=4, help="Turns in flight at once")
+    parser.add_argument("--seed", type=int, help="Seed for latency and error sampling")
+    parser.add_argument("--chat-latency", type=float, default=DEFAULT_PROFILES["chat"].latency.median,
+                        help="Median seconds to the first chat chunk")
+    parser.add_argument("--token-interval", type=float, default=DEFAULT_PROFILES["chat"].chunk_interval.median,
+                        help="Median seconds between streamed chat tokens")
+    parser.add_argument("--speech-latency", type=float, default=DEFAULT_PROFILES["speech"].latency.median,
+                        help="Median seconds to the first speech byte")
+    parser.add_argument("--speech-chunk-interval", type=float,
+                        default=DEFAULT_PROFILES["speech"].chunk_interval.median,
+                        help="Median seconds between streamed speech chunks")
+    parser.add_argument("--stt-latency", type=float, default=DEFAULT_PROFILES["transcription"].latency.median,
+                        help="Median seconds for a transcription")
+    parser.add_argument("--latency-sigma", type=float, default=0.4,
+                        help="Log-normal spread of every latency (0: fixed delays)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of requests to every endpoint that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of simulated failures")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Attempts per API call")
+    parser.add_argument("--json", dest="json_path", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    # Retries are counted in the report; only calls that finally fail are logged
+    logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def profile(latency: float, interval: float = 0.0) -> EndpointProfile:
+        return EndpointProfile(latency=Latency(latency, args.latency_sigma),
+                               chunk_interval=Latency(interval, args.latency_sigma),
+                               error_rate=args.error_rate, error_status=args.error_status)
+
+    profiles = {
+        "chat": profile(args.chat_latency, args.token_interval),
+        "speech": profile(args.speech_latency, args.speech_chunk_interval),
+        "transcription": profile(args.stt_latency),
+    }
+    report = run_benchmark(args.turns, args.concurrency, profiles, seed=args.seed, max_attempts=args.max_attempts)
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
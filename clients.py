@@ -0,0 +1,85 @@
+import importlib.util
+import logging
+import threading
+from typing import List
+
+import httpx
+from openai import OpenAI
+
+logger = logging.getLogger("vocAIyze.Clients")
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def create_openai_client(api_key: str, max_connections: int = 20, max_keepalive_connections: int = 10,
+                         keepalive_expiry: float = 120.0, http2: bool = True, timeout: float = 60.0,
+                         base_url: str = None, max_retries: int = 0) -> OpenAI:
+    """
+    Build one OpenAI client backed by a pooled HTTP transport
+
+    Pass the result to LLM, TextToSpeech and SpeechToText so all three share a
+    connection pool and reuse warm TLS connections instead of each opening its
+    own.
+
+    Args:
+        api_key: OpenAI API key
+        max_connections: Upper bound on open connections
+        max_keepalive_connections: Idle connections kept for reuse
+        keepalive_expiry: Seconds an idle connection is kept
+        http2: Use HTTP/2 when the h2 package is installed
+        timeout: Default request timeout in seconds
+        base_url: Override the API endpoint (optional)
+        max_retries: SDK-level retries; off by default because resilience.Resilience
+            retries with backoff, deadlines and circuit breaking
+
+    Returns:
+        Configured OpenAI client
+    """
+    use_http2 = http2 and http2_available()
+    if http2 and not use_http2:
+        logger.info("h2 not installed, using HTTP/1.1")
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=max_connections,
+                            max_keepalive_connections=max_keepalive_connections,
+                            keepalive_expiry=keepalive_expiry),
+        http2=use_http2,
+        timeout=timeout,
+    )
+    logger.info(f"Shared HTTP client created (pool={max_connections}, http2={use_http2})")
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=max_retries)
+
+
+def prewarm_connections(client: OpenAI, connections: int = 3, background: bool = True) -> List[threading.Thread]:
+    """
+    Open connections ahead of the first real request
+
+    Issues a few concurrent lightweight requests so DNS, TCP and TLS setup is
+    paid up front (e.g. while the greeting plays) and the connections stay in
+    the keep-alive pool.
+
+    Args:
+        client: Shared OpenAI client
+        connections: Number of connections to open
+        background: Return immediately instead of waiting for the requests
+
+    Returns:
+        The worker threads
+    """
+    def warm():
+        try:
+            client.with_options(max_retries=0).models.list()
+        except Exception as e:
+            logger.warning(f"Connection prewarm failed: {str(e)}")
+
+    threads = [threading.Thread(target=warm, name=f"prewarm-{i}", daemon=True) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    if not background:
+        for thread in threads:
+            thread.join()
+    logger.info(f"Prewarming {connections} API connections")
+    return threads
@@ -0,0 +1,176 @@
+import logging
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+try:
+    import tiktoken  # Optional: exact token counts for OpenAI models
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger("vocAIyze.Conversation")
+
+# Per-message overhead of the chat format (role, separators), in tokens
+MESSAGE_OVERHEAD = 4
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens locally, without an API call
+
+    Uses tiktoken's cl100k_base encoding when installed, otherwise an estimate
+    from word and punctuation counts that errs on the high side.
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+    # Long words split into several tokens; ~4 characters per token
+    return sum(max(1, (len(word) + 3) // 4) for word in _WORD.findall(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Token count of a chat messages list, including format overhead"""
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+class ConversationMemory:
+    """
+    Chat history trimmed to a token budget, with a running summary
+
+    messages() always starts with the same system prompt so providers can reuse
+    the cached prefix across turns. Once the recent turns exceed the token
+    budget the oldest exchanges are moved out of the window and folded into a
+    running summary, which is sent as a second system message.
+
+    The summarizer runs on a background thread so trim() never waits on it:
+    dropped turns are kept verbatim (cut to the summary budget) until the new
+    summary is swapped in.
+    """
+
+    def __init__(self, system_prompt: str, max_tokens: int = 2000, summary_max_tokens: int = 300,
+                 summarizer: Optional[Callable[[str, List[Dict[str, str]]], str]] = None):
+        """
+        Args:
+            system_prompt: Stable instructions sent first on every request
+            max_tokens: Budget for the summary plus the recent turns
+            summary_max_tokens: Budget for the running summary
+            summarizer: Callable (summary, dropped_messages) -> new summary, run on
+                a background thread. Without one, dropped turns are kept verbatim
+                and cut to the summary budget
+        """
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer
+        self.turns = []
+        self.summary = ""
+        self._summarized = ""  # Last summary from the summarizer
+        self._pending = []  # Dropped messages not yet folded into it
+        self._worker = None
+        self._generation = 0  # Bumped by clear() so stale summaries are discarded
+        self._lock = threading.Lock()
+
+    def add(self, role: str, content: str):
+        """Append a message to the window"""
+        self.turns.append({"role": role, "content": content})
+
+    def _messages(self, summary: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        return messages + self.turns
+
+    def messages(self) -> List[Dict[str, str]]:
+        """The full request: system prompt, running summary, recent turns"""
+        return self._messages(self.summary)
+
+    def token_count(self) -> int:
+        return count_message_tokens(self.messages())
+
+    def trim(self) -> int:
+        """
+        Move the oldest turns out of the window until it fits the budget
+
+        The most recent message is always kept. The window is sized against the
+        summarizer's last summary, not the verbatim stand-in used while a new
+        one is pending, so a slow summarizer does not push out extra turns.
+
+        Returns:
+            Number of messages dropped
+        """
+        dropped = []
+        summary = self._summarized if self.summarizer is not None else self.summary
+        while len(self.turns) > 1 and count_message_tokens(self._messages(summary)) > self.max_tokens:
+            dropped.append(self.turns.pop(0))
+            # Drop whole exchanges so the window never starts with a reply
+            if self.turns and self.turns[0]["role"] == "assistant" and len(self.turns) > 1:
+                dropped.append(self.turns.pop(0))
+        if dropped:
+            self._roll_into_summary(dropped)
+            logger.info(f"Moved {len(dropped)} messages into the conversation summary")
+        return len(dropped)
+
+    def _roll_into_summary(self, dropped: List[Dict[str, str]]):
+        with self._lock:
+            self._pending += dropped
+            self.summary = self._verbatim_summary(self._summarized, self._pending)
+            if self.summarizer is None:
+                self._summarized, self._pending = self.summary, []
+            elif self._worker is None:
+                self._worker = threading.Thread(target=self._summarize_loop, args=(self._generation,),
+                                                name="conversation-summary", daemon=True)
+                self._worker.start()
+
+    def _summarize_loop(self, generation: int):
+        while True:
+            with self._lock:
+                if generation != self._generation or not self._pending:
+                    if generation == self._generation:
+                        self._worker = None
+                    return
+                base, batch = self._summarized, list(self._pending)
+            try:
+                summary = self.summarizer(base, batch)
+            except Exception as e:
+                logger.error(f"Error summarizing conversation: {str(e)}")
+                summary = self._verbatim_summary(base, batch)
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self._summarized = summary
+                del self._pending[:len(batch)]
+                self.summary = self._verbatim_summary(summary, self._pending) if self._pending else summary
+
+    def wait_for_summary(self, timeout: float = None) -> bool:
+        """Block until dropped turns have been summarized; False on timeout"""
+        with self._lock:
+            worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+            return not worker.is_alive()
+        return True
+
+    def _verbatim_summary(self, summary: str, dropped: List[Dict[str, str]]) -> str:
+        """Keep the most recent dropped text that fits the summary budget"""
+        lines = [summary] if summary else []
+        lines += [f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in dropped]
+        while len(lines) > 1 and count_tokens(" ".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        words = " ".join(lines).split()
+        while len(words) > 1 and count_tokens(" ".join(words)) > self.summary_max_tokens:
+            words = words[len(words) // 4 or 1:]
+        return " ".join(words)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._worker = None
+            self.turns = []
+            self.summary = ""
+            self._summarized = ""
+            self._pending = []
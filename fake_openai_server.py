@@ -0,0 +1,253 @@
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+logger = logging.getLogger("vocAIyze.FakeOpenAI")
+
+# Text streamed back by the chat endpoint, cut to the requested max_tokens
+REPLY_TEXT = ("Thanks for the question. Our plan covers the whole team and can be set up this week. "
+              "Most customers see the first results within a month. I can send over the details "
+              "and a short case study if that helps. Would Tuesday or Thursday work for a follow-up call?")
+TRANSCRIPT_TEXT = "Can you tell me how the premium plan compares to what we have today?"
+
+PCM_BYTES_PER_SECOND = 24000 * 2  # Matches tts.PCM_SAMPLE_RATE at 16 bits
+CHARS_PER_SECOND = 15  # Rough speaking rate used to size synthesized audio
+
+
+@dataclass
+class Latency:
+    """
+    Log-normal delay: median * exp(sigma * N(0, 1)), capped at maximum
+
+    sigma=0 gives a fixed delay; 0.5 to 1.0 gives the long right tail real
+    APIs show.
+    """
+    median: float = 0.0
+    sigma: float = 0.0
+    maximum: float = 30.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return min(self.maximum, self.median * math.exp(self.sigma * rng.gauss(0, 1)))
+
+
+@dataclass
+class EndpointProfile:
+    """How one simulated endpoint behaves"""
+    latency: Latency = field(default_factory=Latency)  # Before the response headers
+    chunk_interval: Latency = field(default_factory=Latency)  # Between streamed chunks
+    error_rate: float = 0.0  # Share of requests answered with error_status
+    error_status: int = 503
+    retry_after: float = None  # Retry-After header sent with 429s
+
+
+DEFAULT_PROFILES = {
+    "chat": EndpointProfile(latency=Latency(0.35, 0.4), chunk_interval=Latency(0.02, 0.3)),
+    "speech": EndpointProfile(latency=Latency(0.25, 0.4), chunk_interval=Latency(0.01)),
+    "transcription": EndpointProfile(latency=Latency(0.4, 0.4)),
+}
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the chat, speech and transcription endpoints
+
+    Speaks enough of the OpenAI HTTP API for the real SDK (and so the real LLM,
+    TextToSpeech and SpeechToText code) to run against it: chat completions
+    plain and streamed as server-sent events, chunked speech audio, and
+    multipart transcription uploads. Latency, chunk pacing and error rates
+    come from per-endpoint EndpointProfiles.
+
+    Usage:
+        with FakeOpenAIServer() as server:
+            client = create_openai_client("test", base_url=server.base_url)
+    """
+
+    def __init__(self, profiles: Dict[str, EndpointProfile] = None, host: str = "127.0.0.1",
+                 port: int = 0, seed: int = None, speech_chunk_size: int = 4096):
+        """
+        Args:
+            profiles: Endpoint name (chat, speech, transcription) -> behaviour,
+                merged over DEFAULT_PROFILES
+            host: Interface to bind
+            port: Port to bind (0 picks a free one)
+            seed: Seed for latency and error sampling, for repeatable runs
+            speech_chunk_size: Bytes per streamed speech chunk
+        """
+        self.profiles = {**DEFAULT_PROFILES, **(profiles or {})}
+        self.host = host
+        self.port = port
+        self.speech_chunk_size = speech_chunk_size
+        self.counters = {name: {"requests": 0, "errors": 0} for name in self.profiles}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _sample(self, latency: Latency) -> float:
+        with self._lock:
+            return latency.sample(self._rng)
+
+    def _should_fail(self, endpoint: str) -> bool:
+        profile = self.profiles[endpoint]
+        with self._lock:
+            self.counters[endpoint]["requests"] += 1
+            failed = profile.error_rate > 0 and self._rng.random() < profile.error_rate
+            if failed:
+                self.counters[endpoint]["errors"] += 1
+        return failed
+
+    def start(self) -> "FakeOpenAIServer":
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so connection pooling behaves as in production
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = b""
+                    while True:
+                        size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return body
+                        body += self.rfile.read(size)
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def _send_json(self, status: int, payload: dict, headers: dict = None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_error(self, endpoint: str):
+                profile = server.profiles[endpoint]
+                headers = {}
+                if profile.error_status == 429 and profile.retry_after is not None:
+                    headers["retry-after"] = str(profile.retry_after)
+                self._send_json(profile.error_status, {"error": {
+                    "message": f"Simulated {profile.error_status} from {endpoint}",
+                    "type": "rate_limit_error" if profile.error_status == 429 else "server_error",
+                    "code": None, "param": None}}, headers)
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _start_chunked(self, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": []})
+                    return
+                self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+            def do_POST(self):
+                body = self._read_body()
+                path = self.path.split("?")[0].rstrip("/")
+                endpoint = {"/v1/chat/completions": "chat", "/v1/audio/speech": "speech",
+                            "/v1/audio/transcriptions": "transcription"}.get(path)
+                if endpoint is None:
+                    self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+                    return
+                time.sleep(server._sample(server.profiles[endpoint].latency))
+                if server._should_fail(endpoint):
+                    self._send_error(endpoint)
+                    return
+                getattr(self, f"_{endpoint}")(body)
+
+            def _chat(self, body: bytes):
+                request = json.loads(body or b"{}")
+                words = REPLY_TEXT.split(" ")[:max(1, request.get("max_tokens") or 60)]
+                model = request.get("model", "gpt-4")
+                created = int(time.time())
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                if not request.get("stream"):
+                    text = " ".join(words)
+                    self._send_json(200, {
+                        "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(words),
+                                  "total_tokens": len(body) // 4 + len(words)}})
+                    return
+
+                def event(delta: dict, finish_reason: str = None) -> bytes:
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                             "model": model, "choices": [{"index": 0, "delta": delta,
+                                                          "finish_reason": finish_reason}]}
+                    return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+                self._start_chunked("text/event-stream")
+                self._write_chunk(event({"role": "assistant", "content": ""}))
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(server._sample(server.profiles["chat"].chunk_interval))
+                    self._write_chunk(event({"content": word if i == 0 else " " + word}))
+                self._write_chunk(event({}, "stop"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+            def _speech(self, body: bytes):
+                request = json.loads(body or b"{}")
+                seconds = max(0.5, len(request.get("input", "")) / CHARS_PER_SECOND)
+                audio = bytes(int(seconds * PCM_BYTES_PER_SECOND))  # Silence
+                if request.get("response_format", "mp3") != "pcm":
+                    audio = audio[:len(audio) // 12]  # Roughly mp3 sized; the bytes are not decodable
+                self._start_chunked("audio/pcm" if request.get("response_format") == "pcm" else "audio/mpeg")
+                for start in range(0, len(audio), server.speech_chunk_size):
+                    if start:
+                        time.sleep(server._sample(server.profiles["speech"].chunk_interval))
+                    self._write_chunk(audio[start:start + server.speech_chunk_size])
+                self._write_chunk(b"")
+
+            def _transcription(self, body: bytes):
+                self._send_json(200, {"text": TRANSCRIPT_TEXT})
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        logger.info(f"Fake OpenAI server listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: dict(counters) for name, counters in self.counters.items()}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+from typing import List, Mapping, Tuple
+
+import numpy as np
+
+from kb_index import tokenize
+from rate_limit import get_rate_limiter
+
+try:
+    import fcntl  # POSIX only; serializes writers from several processes
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("vocAIyze.KBEmbeddings")
+
+
+class HashingEmbedder:
+    """
+    Deterministic, offline embedder based on signed feature hashing
+
+    Stemmed terms and adjacent term pairs are hashed into a fixed number of
+    buckets. It needs no model or network, gives the same vectors in every
+    process, and is good enough for tests and small deployments.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-v2-{dim}"  # Bump when tokenize changes, so stored vectors are rebuilt
+
+    def _features(self, text: str) -> List[str]:
+        terms = tokenize(text)
+        return terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts into L2-normalised float32 rows
+
+        Returns:
+            Array of shape (len(texts), dim)
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI embeddings endpoint"""
+
+    def __init__(self, client, model: str = "text-embedding-3-small", dim: int = 1536,
+                 batch_size: int = 256):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.name = f"openai-{model}-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            tokens = sum(len(text) // 4 + 1 for text in batch)
+            with get_rate_limiter().acquire("embeddings", tokens):
+                response = self.client.embeddings.create(model=self.model, input=batch, dimensions=self.dim)
+            for item in response.data:
+                vectors[start + item.index] = item.embedding
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """
+    Knowledge base embeddings in a memory-mapped float32 matrix
+
+    Vectors live in a contiguous .npy file opened with mmap_mode='r', so any
+    number of worker processes can map the same file and share one copy in the
+    page cache. A small manifest records which key and content hash each row
+    holds; update() re-embeds only new or changed entries and publishes a new
+    matrix file atomically, leaving existing mappings valid.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory: str, embedder):
+        """
+        Args:
+            directory: Where the matrix and manifest are stored
+            embedder: Object with .name, .dim and .embed(texts) -> ndarray
+        """
+        self.directory = directory
+        self.embedder = embedder
+        self.keys = []
+        self.values = []
+        self.hashes = []
+        self.matrix = np.zeros((0, embedder.dim), dtype=np.float32)
+        self._manifest_mtime = None
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def _hash(key: str, value: str) -> str:
+        return hashlib.sha1(f"{key}\0{value}".encode("utf-8")).hexdigest()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, self.MANIFEST)
+
+    @contextmanager
+    def _directory_lock(self, shared: bool = False):
+        """
+        Hold the directory's lock file: exclusively to publish, shared to read,
+        so a reader never sees a manifest whose matrix is being removed
+        """
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self) -> bool:
+        """
+        Map the published matrix if it was built with the same embedder
+
+        Returns:
+            True if an index was loaded
+        """
+        with self._directory_lock(shared=True):
+            return self._load()
+
+    def _load(self) -> bool:
+        path = self._manifest_path()
+        if not os.path.exists(path):
+            return False
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("embedder") != self.embedder.name:
+            logger.info("Vector index was built with a different embedder, ignoring it")
+            return False
+        self.matrix = np.load(os.path.join(self.directory, manifest["matrix"]), mmap_mode="r")
+        self.keys = [e["key"] for e in manifest["entries"]]
+        self.values = [e["value"] for e in manifest["entries"]]
+        self.hashes = [e["hash"] for e in manifest["entries"]]
+        self._manifest_mtime = mtime
+        return True
+
+    def refresh(self) -> bool:
+        """Re-map the matrix if another process published a newer one"""
+        try:
+            mtime = os.stat(self._manifest_path()).st_mtime_ns
+        except OSError:
+            return False
+        return mtime != self._manifest_mtime and self.load()
+
+    def update(self, entries: Mapping[str, str]) -> int:
+        """
+        Bring the index in line with the entries, embedding only what changed
+
+        Args:
+            entries: Mapping of key to value
+
+        Returns:
+            Number of entries that were embedded
+        """
+        keys = list(entries)
+        values = [entries[k] for k in keys]
+        hashes = [self._hash(k, v) for k, v in zip(keys, values)]
+        if hashes == self.hashes:
+            return 0
+
+        existing = {h: row for row, h in enumerate(self.hashes)}
+        stale = [i for i, h in enumerate(hashes) if h not in existing]
+        fresh = self.embedder.embed([f"{keys[i].replace('_', ' ')}: {values[i]}" for i in stale]) \
+            if stale else np.zeros((0, self.embedder.dim), dtype=np.float32)
+
+        with self._directory_lock():
+            matrix_name = f"vectors-{uuid.uuid4().hex}.npy"
+            matrix_path = os.path.join(self.directory, matrix_name)
+            out = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32,
+                                            shape=(len(keys), self.embedder.dim))
+            stale_rows = {i: n for n, i in enumerate(stale)}
+            for i, h in enumerate(hashes):
+                out[i] = fresh[stale_rows[i]] if i in stale_rows else self.matrix[existing[h]]
+            out.flush()
+            del out
+
+            manifest = {"embedder": self.embedder.name, "matrix": matrix_name,
+                        "entries": [{"key": k, "value": v, "hash": h} for k, v, h in zip(keys, values, hashes)]}
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._manifest_path())
+
+            # Only remove matrices the published manifest does not name. Processes
+            # still mapping an old matrix keep their view; unlinking is safe
+            with open(self._manifest_path(), "r") as f:
+                published = json.load(f)["matrix"]
+            for name in os.listdir(self.directory):
+                if name.startswith("vectors-") and name != published:
+                    os.remove(os.path.join(self.directory, name))
+            self._load()  # Already under the exclusive lock
+        logger.info(f"Vector index updated: {len(stale)} of {len(keys)} entries embedded")
+        return len(stale)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, str, float]]:
+        """
+        Rank entries by cosine similarity with one matrix-vector product
+
+        Returns:
+            Up to k (key, value, score) tuples with score > 0, best first
+        """
+        if not self.keys:
+            return []
+        query_vector = self.embedder.embed([query])[0]
+        scores = self.matrix @ query_vector
+        k = min(k, len(self.keys))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.keys[i], self.values[i], float(scores[i])) for i in top if scores[i] > 0]
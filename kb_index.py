@@ -0,0 +1,125 @@
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("vocAIyze.KBIndex")
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "our", "should", "so", "that", "the",
+    "their", "them", "this", "to", "we", "what", "when", "with", "you", "your",
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def _stem(word: str) -> str:
+    """Strip common English suffixes so 'leads'/'lead' and 'pricing'/'price' meet"""
+    for suffix in ("ations", "ation", "ings", "ing", "ies", "ied", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            stem = word[:-len(suffix)]
+            if suffix in ("ies", "ied"):
+                return stem + "y"
+            word = stem
+            break
+    # A silent 'e' goes too, so 'price' meets the 'pric' left by 'pricing'
+    if word.endswith("e") and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def split_terms(text: str) -> List[str]:
+    """Lowercase, split on non-alphanumerics (including '_') and drop stop words"""
+    return [t for t in _TOKEN.findall(text.lower().replace("_", " ")) if t not in STOP_WORDS]
+
+
+def tokenize(text: str) -> List[str]:
+    """split_terms, then stem"""
+    return [_stem(t) for t in split_terms(text)]
+
+
+class KnowledgeIndex:
+    """
+    BM25 index over knowledge base keys and values
+
+    Each term maps to a NumPy array of document ids and a precomputed array of
+    BM25 weights, so a query is a handful of vectorized scatter-adds followed by
+    a partial sort. Key terms are boosted because the category name is the
+    strongest signal of what an entry is about.
+    """
+
+    def __init__(self, entries: Dict[str, str], k1: float = 1.5, b: float = 0.75,
+                 key_weight: int = 3):
+        """
+        Args:
+            entries: Mapping of category key to advice text
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalisation
+            key_weight: How many times key terms are counted
+        """
+        self.k1 = k1
+        self.b = b
+        self.key_weight = key_weight
+        self.keys = list(entries)
+        self.values = [entries[k] for k in self.keys]
+        self._postings = {}  # term -> (doc_ids, weights)
+        self._build()
+
+    def _document_terms(self, key: str, value: str) -> Counter:
+        terms = Counter(tokenize(value))
+        for term in tokenize(key):
+            terms[term] += self.key_weight
+        return terms
+
+    def _build(self):
+        n_docs = len(self.keys)
+        docs = [self._document_terms(k, v) for k, v in zip(self.keys, self.values)]
+        lengths = np.array([sum(d.values()) for d in docs], dtype=np.float32)
+        avg_length = float(lengths.mean()) if n_docs else 0.0
+
+        postings = {}
+        for doc_id, terms in enumerate(docs):
+            for term, tf in terms.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(tf)
+
+        norm = self.k1 * (1 - self.b + self.b * lengths / avg_length) if n_docs else lengths
+        for term, (doc_ids, tfs) in postings.items():
+            ids = np.array(doc_ids, dtype=np.int32)
+            tf = np.array(tfs, dtype=np.float32)
+            idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            self._postings[term] = (ids, idf * tf * (self.k1 + 1) / (tf + norm[ids]))
+        logger.info(f"Knowledge index built: {n_docs} entries, {len(self._postings)} terms")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, str, float]]:
+        """
+        Rank entries against a query
+
+        Args:
+            query: Free-text scenario or question
+            k: Number of results
+
+        Returns:
+            Up to k (key, value, score) tuples with score > 0, best first
+        """
+        if not self.keys:
+            return []
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights
+
+        k = min(k, len(self.keys))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.keys[i], self.values[i], float(scores[i])) for i in top if scores[i] > 0]
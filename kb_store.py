@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from typing import Iterator, List, Tuple
+
+from kb_index import split_terms
+
+logger = logging.getLogger("vocAIyze.KBStore")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    value TEXT NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(key, value, tokenize='porter unicode61');
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _entry_hash(value: str) -> str:
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+class KnowledgeBaseStore(Mapping):
+    """
+    Knowledge base backed by an SQLite full-text index
+
+    The curated JSON file stays the source of truth; its entries are mirrored
+    into an SQLite database with an FTS5 index, so nothing is held in memory
+    and lookups scale to tens of thousands of entries. When the JSON file's
+    mtime or size changes the store re-syncs in the background, touching only
+    the entries that were added, changed or removed. The database runs in WAL
+    mode, so queries keep being answered from the previous snapshot while a
+    sync is in progress.
+    """
+
+    def __init__(self, source_path: str, db_path: str = None, check_interval: float = 2.0,
+                 key_weight: float = 3.0):
+        """
+        Args:
+            source_path: JSON file mapping category keys to advice text
+            db_path: SQLite index file (default: next to the source, .sqlite)
+            check_interval: Minimum seconds between checks of the source mtime
+            key_weight: BM25 weight of the key column relative to the value
+        """
+        self.source_path = source_path
+        self.db_path = db_path or os.path.splitext(source_path)[0] + ".sqlite"
+        self.check_interval = check_interval
+        self.key_weight = key_weight
+        self.reloads = 0
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._loaded = False
+        self._last_check = 0.0
+        self._reload_thread = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets readers run during a sync"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _source_signature(self) -> str:
+        stat = os.stat(self.source_path)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def _stored_signature(self, conn: sqlite3.Connection) -> str:
+        row = conn.execute("SELECT value FROM meta WHERE name = 'source_signature'").fetchone()
+        return row[0] if row else ""
+
+    def sync(self) -> Tuple[int, int, int]:
+        """
+        Bring the index in line with the source file, incrementally
+
+        Returns:
+            (added, updated, removed) entry counts
+        """
+        with self._sync_lock:
+            conn = self._connection()
+            signature = self._source_signature()
+            if signature == self._stored_signature(conn):
+                return 0, 0, 0
+
+            with open(self.source_path, "r") as f:
+                entries = json.load(f)
+            # key -> (row id, content hash); FTS rows share the entry's row id
+            stored = {key: (row_id, digest) for row_id, key, digest
+                      in conn.execute("SELECT id, key, hash FROM entries")}
+
+            added = updated = 0
+            with conn:
+                for key, value in entries.items():
+                    digest = _entry_hash(value)
+                    row_id, old = stored.pop(key, (None, None))
+                    if old == digest:
+                        continue
+                    if row_id is None:
+                        added += 1
+                        row_id = conn.execute("INSERT INTO entries (key, value, hash) VALUES (?, ?, ?)",
+                                              (key, value, digest)).lastrowid
+                    else:
+                        updated += 1
+                        conn.execute("UPDATE entries SET value = ?, hash = ? WHERE id = ?",
+                                     (value, digest, row_id))
+                        conn.execute("DELETE FROM entries_fts WHERE rowid = ?", (row_id,))
+                    conn.execute("INSERT INTO entries_fts (rowid, key, value) VALUES (?, ?, ?)",
+                                 (row_id, key, value))
+                for row_id, _ in stored.values():
+                    conn.execute("DELETE FROM entries WHERE id = ?", (row_id,))
+                    conn.execute("DELETE FROM entries_fts WHERE rowid = ?", (row_id,))
+                conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('source_signature', ?)",
+                             (signature,))
+
+            self.reloads += 1
+            logger.info(f"Knowledge base synced: {added} added, {updated} updated, {len(stored)} removed")
+            return added, updated, len(stored)
+
+    def _ensure_fresh(self):
+        """Load on first use, then hot-reload in the background when the file changes"""
+        if not self._loaded:
+            self.sync()
+            self._loaded = True
+            self._last_check = time.monotonic()
+            return
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            changed = self._source_signature() != self._stored_signature(self._connection())
+        except OSError as e:
+            logger.warning(f"Knowledge base source unavailable: {str(e)}")
+            return
+        if changed and (self._reload_thread is None or not self._reload_thread.is_alive()):
+            self._reload_thread = threading.Thread(target=self._background_sync, name="kb-reload",
+                                                   daemon=True)
+            self._reload_thread.start()
+
+    def _background_sync(self):
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"Error reloading knowledge base: {str(e)}")
+        finally:
+            # Reload threads are short-lived; do not leak their connection
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+                self._local.conn = None
+
+    def wait_for_reload(self, timeout: float = None):
+        """Block until a background reload (if any) has finished"""
+        if self._reload_thread is not None:
+            self._reload_thread.join(timeout)
+
+    def __getitem__(self, key: str) -> str:
+        self._ensure_fresh()
+        row = self._connection().execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __iter__(self) -> Iterator[str]:
+        self._ensure_fresh()
+        for (key,) in self._connection().execute("SELECT key FROM entries ORDER BY key"):
+            yield key
+
+    def __len__(self) -> int:
+        self._ensure_fresh()
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, str, float]]:
+        """
+        Rank entries with the FTS5 BM25 ranking, key column boosted
+
+        Args:
+            query: Free-text scenario or question
+            k: Number of results
+
+        Returns:
+            Up to k (key, value, score) tuples, best first
+        """
+        self._ensure_fresh()
+        # FTS5 applies its own porter stemming to the raw terms
+        terms = set(split_terms(query))
+        if not terms:
+            return []
+        match = " OR ".join(f'"{t}"' for t in sorted(terms))
+        rows = self._connection().execute(
+            "SELECT key, value, bm25(entries_fts, ?, 1.0) AS rank FROM entries_fts "
+            "WHERE entries_fts MATCH ? ORDER BY rank LIMIT ?",
+            (self.key_weight, match, k)).fetchall()
+        # FTS5 bm25() is negative, lower is better
+        return [(key, value, -rank) for key, value, rank in rows]
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -1,15 +1,167 @@
 from openai import OpenAI
 import logging
+import hashlib
 import json
 import os
-from typing import Dict, List, Any, Optional
+import re
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from dataclasses import dataclass, replace
+from typing import Dict, List, Any, Optional, Iterator, Union
+from llm_cache import ResponseCache
+from kb_index import KnowledgeIndex
+from kb_store import KnowledgeBaseStore
+from kb_embeddings import VectorIndex
+from prefilter import LexicalPrefilter
+from conversation import count_message_tokens
+from rate_limit import RateLimiter, get_rate_limiter, is_rate_limit_error
+from resilience import Resilience, get_resilience, is_transient
+from metrics import LLM_FIRST_TOKEN, LLM_TOTAL, Metrics, get_metrics
+
+try:
+    import tiktoken  # Optional: lets yes/no answers be constrained with logit_bias
+except ImportError:
+    tiktoken = None
 
 logger = logging.getLogger("vocAIyze.LLM")
 
+SYSTEM_PROMPT = "You are an AI assistant for business professionals. Provide helpful, accurate, and concise responses."
+ERROR_REPLY = "Sorry, I encountered an error while processing your request. Please try again later."
+
+_FLAGGED_SPANS = {
+    "type": "object",
+    "properties": {
+        "detected": {"type": "boolean"},
+        "quotes": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["detected", "quotes"],
+    "additionalProperties": False
+}
+
+# Response schema for analyze_transcript (OpenAI structured outputs, strict mode)
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "topics": {"type": "array", "items": {"type": "string"}},
+        "sentiment": {"type": "string", "enum": ["positive", "neutral", "negative", "mixed"]},
+        "action_items": {"type": "array", "items": {"type": "string"}},
+        "unreliable_promises": _FLAGGED_SPANS,
+        "exaggerations": _FLAGGED_SPANS
+    },
+    "required": ["topics", "sentiment", "action_items", "unreliable_promises", "exaggerations"],
+    "additionalProperties": False
+}
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """Model and sampling settings for one kind of request"""
+    model: str
+    max_tokens: int
+    temperature: float
+
+
+# Conversation keeps the strong model; short or mechanical tasks use a cheap one.
+# Structured outputs (strict JSON schema) need a gpt-4o class model.
+DEFAULT_ROUTES = {
+    "chat": ModelRoute("gpt-4", 500, 0.7),
+    "fast_chat": ModelRoute("gpt-4o-mini", 300, 0.7),  # Fallback when a turn runs out of time
+    "analysis": ModelRoute("gpt-4o", 800, 0),
+    "classify": ModelRoute("gpt-4o-mini", 1, 0),
+    "rerank": ModelRoute("gpt-4o-mini", 20, 0),
+    "summary": ModelRoute("gpt-4o-mini", 200, 0),
+}
+
+CLASSIFIER_PROMPT = "You are a strict sales-compliance classifier. Answer with exactly one word: yes or no."
+
+
+class SentenceSegmenter:
+    """
+    Incrementally split streamed text into sentences
+
+    Tokens are fed in as they arrive; a sentence is released as soon as its
+    terminating punctuation is followed by whitespace, so it can be spoken
+    while the rest of the reply is still being generated.
+    """
+
+    ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "prof.", "sr.", "jr.", "st.", "vs.",
+                     "etc.", "e.g.", "i.e.", "inc.", "ltd.", "co.", "no."}
+    _BOUNDARY = re.compile(r'[.!?]+["\')\]]*\s+|\n+')
+
+    def __init__(self, min_length: int = 20):
+        """
+        Args:
+            min_length: Sentences shorter than this are merged with the next one
+                to avoid many tiny TTS requests
+        """
+        self.min_length = min_length
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Add streamed text and return any sentences completed by it
+
+        Args:
+            text: Next chunk of streamed text
+
+        Returns:
+            List of completed sentences, possibly empty
+        """
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in self._BOUNDARY.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            last_word = candidate.rsplit(None, 1)[-1].lower() if candidate else ""
+            if len(candidate) < self.min_length or last_word in self.ABBREVIATIONS:
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """Return whatever text remains once the stream has ended"""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return remainder or None
+
+
 class LLM:
-    def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
-        self.knowledge_base = self.load_knowledge_base()
+    def __init__(self, api_key: str, client: OpenAI = None, cache: ResponseCache = None,
+                 kb_store: KnowledgeBaseStore = None, vector_index: VectorIndex = None,
+                 routes: Dict[str, ModelRoute] = None, prefilter: LexicalPrefilter = None,
+                 rate_limiter: RateLimiter = None, resilience: Resilience = None, metrics: Metrics = None):
+        # A shared client (see clients.create_openai_client) lets components reuse connections
+        self.client = client or OpenAI(api_key=api_key)
+        self.cache = cache  # Optional ResponseCache for repeated prompts
+        # Requests and tokens per minute are budgeted process-wide, shared with TTS and STT
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        # Retries, deadlines and circuit breaking; hedging is opt-in for the streamed chat path
+        self.resilience = resilience or get_resilience()
+        self.hedge_requests = False
+        self.metrics = metrics or get_metrics()
+        # Per-task model, max_tokens and temperature; override entries via routes
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        self._yes_no_biases = {}
+        # Clears texts with no risky phrasing locally; set to None to always ask the model
+        self.prefilter = prefilter or LexicalPrefilter()
+        self._analyses = OrderedDict()  # Memoized analyze_transcript results
+        self._analysis_lock = threading.Lock()
+        if kb_store is not None:
+            # Lazily loaded, SQLite-indexed and hot-reloaded from its JSON source
+            self.knowledge_base = kb_store
+            self.kb_index = None
+        else:
+            self.knowledge_base = self.load_knowledge_base()
+            self.kb_index = KnowledgeIndex(self.knowledge_base)
+        # Optional embedding index for semantic matching; kept in sync on use
+        self.vector_index = vector_index
+        self._vector_version = None
+        self._vector_lock = threading.Lock()
         logger.info("LLM initialized")
 
     def load_knowledge_base(self) -> dict:
@@ -33,117 +185,492 @@ class LLM:
             logger.error(f"Error loading knowledge base: {str(e)}")
             return {}
 
-    def generate(self, prompt: str) -> str:
+    @staticmethod
+    def _token_estimate(messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Tokens a request can use, as counted against the tokens/min budget"""
+        return count_message_tokens(messages) + max_tokens
+
+    def _complete(self, messages: List[Dict[str, str]], model: str, max_tokens: int,
+                  temperature: float, deadline: float = None, **options) -> str:
+        """Run a chat completion, serving repeated requests from the cache and retrying transient errors"""
+        key = None
+        if self.cache is not None and self.cache.should_cache(temperature):
+            key = ResponseCache.make_key(model, messages, temperature, max_tokens, **options)
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info("Response served from cache")
+                return cached
+
+        def attempt(timeout: float) -> str:
+            with self.rate_limiter.acquire("chat", self._token_estimate(messages, max_tokens)) as permit:
+                response = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    n=1,
+                    stop=None,
+                    timeout=timeout,
+                    **options
+                )
+                usage = getattr(response, "usage", None)
+                if isinstance(getattr(usage, "total_tokens", None), int):
+                    permit.settle(usage.total_tokens)
+            return response.choices[0].message.content.strip()
+
+        # Breakers are per model, so a struggling main model does not take its fallback down with it
+        content = self.resilience.call(f"chat:{model}", attempt, deadline=deadline)
+        if key is not None:
+            self.cache.put(key, content)
+        return content
+
+    @staticmethod
+    def _messages(prompt: Union[str, List[Dict[str, str]]]) -> List[Dict[str, str]]:
+        """Wrap a plain prompt with the system prompt; pass message lists through"""
+        if isinstance(prompt, str):
+            return [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+        if not prompt or prompt[0]["role"] != "system":
+            return [{"role": "system", "content": SYSTEM_PROMPT}] + list(prompt)
+        return list(prompt)
+
+    def route(self, task: str, **overrides) -> ModelRoute:
+        """
+        Settings for a task, with any non-None overrides applied
+
+        Args:
+            task: Key in self.routes (chat, analysis, classify, rerank, summary)
+            overrides: model, max_tokens or temperature for this call
+        """
+        overrides = {k: v for k, v in overrides.items() if v is not None}
+        return replace(self.routes[task], **overrides)
+
+    def generate(self, prompt: Union[str, List[Dict[str, str]]], temperature: float = None,
+                 max_tokens: int = None, task: str = "chat", deadline: float = None,
+                 strict: bool = False) -> str:
+        """
+        Generate a response
+
+        Args:
+            prompt: A user prompt, or a chat messages list (e.g. from ConversationMemory)
+            temperature: Sampling temperature (default: the task's route)
+            max_tokens: Completion token limit (default: the task's route)
+            task: Which route to use
+            deadline: time.monotonic() value by which the reply is needed (optional)
+            strict: Raise errors instead of returning ERROR_REPLY, for callers that
+                must tell a failure from a reply
+        """
+        try:
+            route = self.route(task, temperature=temperature, max_tokens=max_tokens)
+            with self.metrics.span(LLM_TOTAL, task=task):
+                return self._complete(
+                    self._messages(prompt),
+                    model=route.model,
+                    max_tokens=route.max_tokens,
+                    temperature=route.temperature,
+                    deadline=deadline
+                )
+        except Exception as e:
+            if is_rate_limit_error(e):
+                logger.warning(f"Rate limited generating response: {str(e)}")
+            else:
+                logger.error(f"Error generating response: {str(e)}")
+            if strict:
+                raise
+            return ERROR_REPLY
+
+    def _open_stream(self, messages: List[Dict[str, str]], route: ModelRoute, timeout: float):
+        """
+        Start a streamed completion and wait for its first chunk
+
+        Returns:
+            (resources, first chunk, remaining chunks); closing resources ends
+            the stream and frees the rate-limit slot
+        """
+        resources = ExitStack()
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",  # Using the more capable GPT-4 model
-                messages=[
-                    {"role": "system", "content": "You are an AI assistant for business professionals. Provide helpful, accurate, and concise responses."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7,
-                n=1,
-                stop=None
+            # The concurrency slot is held until the stream is exhausted
+            resources.enter_context(self.rate_limiter.acquire("chat", self._token_estimate(messages,
+                                                                                          route.max_tokens)))
+            stream = self.client.chat.completions.create(
+                model=route.model,
+                messages=messages,
+                max_tokens=route.max_tokens,
+                temperature=route.temperature,
+                stream=True,
+                timeout=timeout
             )
-            return response.choices[0].message.content.strip()
+            if hasattr(stream, "close"):
+                resources.callback(stream.close)
+            chunks = iter(stream)
+            first = next(chunks, None)
+        except BaseException as e:
+            resources.__exit__(type(e), e, e.__traceback__)
+            raise
+        return resources, first, chunks
+
+    def generate_stream(self, prompt: Union[str, List[Dict[str, str]]], deadline: float = None,
+                        task: str = "chat", strict: bool = False) -> Iterator[str]:
+        """
+        Generate a response, yielding text deltas as the model produces them
+
+        Failures before the first chunk are retried (and, with hedge_requests,
+        a slow first chunk is hedged); once text has been yielded the stream is
+        not restarted.
+
+        Args:
+            prompt: A user prompt, or a chat messages list
+            deadline: time.monotonic() value by which the first chunk is needed (optional)
+            task: Which route to use
+            strict: Raise transient errors (timeouts, missed deadlines, open circuits)
+                that happen before any text instead of apologizing, so the caller
+                can fall back
+
+        Yields:
+            Chunks of response text. On error, yields an apology if nothing
+            has been produced yet
+        """
+        produced = False
+        messages = self._messages(prompt)
+        route = self.routes[task]
+        started = time.monotonic()
+        paused = 0.0  # Time the consumer held us at a yield, left out of LLM_TOTAL
+        held = None
+        try:
+            key = None
+            if self.cache is not None and self.cache.should_cache(route.temperature):
+                key = ResponseCache.make_key(route.model, messages, route.temperature, route.max_tokens)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    logger.info("Response served from cache")
+                    produced = True
+                    yield cached
+                    return
+
+            resources, first, chunks = self.resilience.call(
+                f"chat:{route.model}", lambda timeout: self._open_stream(messages, route, timeout),
+                deadline=deadline, hedge=self.hedge_requests, on_discard=lambda opened: opened[0].close())
+            with resources:
+                parts = []
+                for chunk in itertools.chain([first] if first is not None else [], chunks):
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    if produced:
+                        # Hold one delta back, so the last is yielded after the permit is freed
+                        delta, held = held, delta
+                        if delta is None:
+                            continue
+                    else:
+                        self.metrics.observe(LLM_FIRST_TOKEN, time.monotonic() - started, task=task)
+                        produced = True
+                    yielded_at = time.monotonic()
+                    yield delta
+                    paused += time.monotonic() - yielded_at
+            self.metrics.observe(LLM_TOTAL, time.monotonic() - started - paused, task=task)
+            if key is not None:
+                self.cache.put(key, "".join(parts).strip())
+            if held is not None:
+                delta, held = held, None
+                yield delta
         except Exception as e:
-            logger.error(f"Error generating response: {str(e)}")
-            return f"Sorry, I encountered an error while processing your request. Please try again later."
+            if is_rate_limit_error(e):
+                logger.warning(f"Rate limited streaming response: {str(e)}")
+            else:
+                logger.error(f"Error streaming response: {str(e)}")
+            if held is not None:
+                yield held
+            if not produced:
+                if strict and is_transient(e):
+                    raise
+                yield ERROR_REPLY
+
+    def generate_sentences(self, prompt: Union[str, List[Dict[str, str]]], min_length: int = 20,
+                           deadline: float = None, task: str = "chat", strict: bool = False) -> Iterator[str]:
+        """
+        Generate a response, yielding each sentence as soon as it is complete
+
+        Args:
+            prompt: A user prompt, or a chat messages list
+            min_length: Minimum sentence length passed to SentenceSegmenter
+            deadline: time.monotonic() value by which the first chunk is needed (optional)
+            task: Which route to use
+            strict: See generate_stream
+
+        Yields:
+            Complete sentences of the response, in order
+        """
+        segmenter = SentenceSegmenter(min_length)
+        for delta in self.generate_stream(prompt, deadline=deadline, task=task, strict=strict):
+            for sentence in segmenter.feed(delta):
+                yield sentence
+        remainder = segmenter.flush()
+        if remainder:
+            yield remainder
+
+    def summarize_conversation(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        """
+        Fold turns that left the context window into the running summary
+
+        Args:
+            summary: The summary so far (may be empty)
+            messages: Chat messages being dropped, oldest first
+
+        Returns:
+            The updated summary
+        """
+        transcript = "\n".join(f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}"
+                               for m in messages)
+        prompt = f"""Update the summary of this conversation with the new exchanges. Keep names, numbers,
+        commitments and open questions. Answer with the summary only, in under 120 words.
+
+        Current summary: {summary or "(none)"}
+
+        New exchanges:
+        {transcript}"""
+        route = self.routes["summary"]
+        return self._complete(self._messages(prompt), model=route.model, max_tokens=route.max_tokens,
+                              temperature=route.temperature)
+
+    def analyze_transcript(self, text: str) -> dict:
+        """
+        Run the full sales-compliance analysis of a text in one request
+
+        Topics, sentiment, action items, unreliable promises and exaggerations
+        come back together as schema-validated JSON, so the text is sent once
+        instead of once per check. Results are memoized per text, and the
+        individual analysis methods are served from them.
+
+        Args:
+            text: Transcript or message to analyze
+
+        Returns:
+            Dict matching ANALYSIS_SCHEMA
+
+        Raises:
+            ValueError: If the response does not match the schema
+        """
+        memo_key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._analysis_lock:
+            if memo_key in self._analyses:
+                self._analyses.move_to_end(memo_key)
+                return self._analyses[memo_key]
+
+        prompt = f"""Analyze the following sales text for a compliance review. Report:
+        - topics: the main topics discussed
+        - sentiment: the overall sentiment (positive, neutral, negative or mixed)
+        - action_items: specific tasks or to-dos, each as one string
+        - unreliable_promises: whether it contains unrealistic or unreliable promises, quoting them
+        - exaggerations: whether it contains exaggerations or hyperbole, quoting them
+
+        Text: {text}"""
+
+        route = self.routes["analysis"]
+        analysis_text = self._complete(
+            [{"role": "user", "content": prompt}],
+            model=route.model,
+            max_tokens=route.max_tokens,
+            temperature=route.temperature,
+            response_format={"type": "json_schema",
+                             "json_schema": {"name": "sales_analysis", "strict": True,
+                                             "schema": ANALYSIS_SCHEMA}}
+        )
+        try:
+            analysis = json.loads(analysis_text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Analysis response is not valid JSON: {str(e)}")
+        missing = set(ANALYSIS_SCHEMA["required"]) - set(analysis)
+        if missing:
+            raise ValueError(f"Analysis response is missing {sorted(missing)}")
+
+        with self._analysis_lock:
+            self._analyses[memo_key] = analysis
+            while len(self._analyses) > 128:
+                self._analyses.popitem(last=False)
+        return analysis
 
     def analyze_text(self, text: str) -> dict:
         try:
-            prompt = f"""Analyze the following text and provide insights on:
-            1. Main topics
-            2. Sentiment
-            3. Key action items (if any)
-            
-            Text: {text}
-            
-            Format your response as JSON with keys 'topics', 'sentiment', and 'action_items'.
-            """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500,
-                temperature=0.3
-            )
-            
-            analysis_text = response.choices[0].message.content.strip()
-            
-            # Try to parse as JSON, but handle plain text responses
-            try:
-                return json.loads(analysis_text)
-            except json.JSONDecodeError:
-                # If not valid JSON, return as structured dict
-                return {
-                    "topics": [analysis_text],
-                    "sentiment": "unknown",
-                    "action_items": []
-                }
+            analysis = self.analyze_transcript(text)
+            return {
+                "topics": analysis["topics"],
+                "sentiment": analysis["sentiment"],
+                "action_items": analysis["action_items"]
+            }
         except Exception as e:
             logger.error(f"Error analyzing text: {str(e)}")
             return {"error": str(e)}
 
+    def _yes_no_bias(self, model: str) -> Optional[Dict[str, int]]:
+        """logit_bias that restricts the answer to a yes/no token, if the tokenizer is known"""
+        if model not in self._yes_no_biases:
+            bias = None
+            if tiktoken is not None:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                    token_ids = [encoding.encode(word) for word in ("yes", "no", "Yes", "No")]
+                    if all(len(ids) == 1 for ids in token_ids):
+                        bias = {str(ids[0]): 100 for ids in token_ids}
+                except KeyError:
+                    logger.info(f"No tokenizer known for {model}, yes/no answers are unconstrained")
+                except Exception as e:
+                    # e.g. the encoding could not be downloaded; cached so it is not retried every call
+                    logger.warning(f"Tokenizer for {model} unavailable ({str(e)}), "
+                                   f"yes/no answers are unconstrained")
+            self._yes_no_biases[model] = bias
+        return self._yes_no_biases[model]
+
+    def classify(self, question: str, text: str, task: str = "classify") -> bool:
+        """
+        Answer a yes/no question about a text with a single-token completion
+
+        Args:
+            question: The yes/no question
+            text: Text the question is about
+            task: Which route to use (a cheap model by default)
+
+        Returns:
+            True for yes
+        """
+        route = self.routes[task]
+        options = {}
+        bias = self._yes_no_bias(route.model)
+        if bias is not None:
+            options["logit_bias"] = bias
+        answer = self._complete(
+            [
+                {"role": "system", "content": CLASSIFIER_PROMPT},
+                {"role": "user", "content": f"{question}\n\nText: {text}"}
+            ],
+            model=route.model,
+            max_tokens=route.max_tokens,
+            temperature=route.temperature,
+            **options
+        )
+        return answer.strip().lower().startswith("y")
+
+    def _memoized_analysis(self, text: str) -> Optional[dict]:
+        """The analyze_transcript result for a text, if it was already computed"""
+        memo_key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._analysis_lock:
+            return self._analyses.get(memo_key)
+
+    def _classify_candidates(self, category: str, question: str, text: str) -> bool:
+        """Ask the model about the prefilter's candidate spans only, or skip it if there are none"""
+        if self.prefilter is None:
+            return self.classify(question, text)
+        spans = self.prefilter.candidates(category, text)
+        if not spans:
+            return False
+        return self.classify(question, "\n".join(spans))
+
     def detect_unreliable_promises(self, text: str) -> bool:
-        prompt = f"Does the following text contain unrealistic or unreliable promises? Answer with 'yes' or 'no' only.\n\nText: {text}"
         try:
-            response = self.generate(prompt).lower()
-            return "yes" in response[:5]  # Check first few characters for "yes"
+            # Reuse a full analysis when one exists; otherwise a one-token check is enough
+            analysis = self._memoized_analysis(text)
+            if analysis is not None:
+                return analysis["unreliable_promises"]["detected"]
+            return self._classify_candidates("unreliable_promises",
+                                             "Does this text contain unrealistic or unreliable promises?", text)
         except Exception as e:
             logger.error(f"Error detecting promises: {str(e)}")
             return False
 
     def detect_exaggerations(self, text: str) -> bool:
-        prompt = f"Does the following text contain exaggerations or hyperbole? Answer with 'yes' or 'no' only.\n\nText: {text}"
         try:
-            response = self.generate(prompt).lower()
-            return "yes" in response[:5]  # Check first few characters for "yes"
+            analysis = self._memoized_analysis(text)
+            if analysis is not None:
+                return analysis["exaggerations"]["detected"]
+            return self._classify_candidates("exaggerations",
+                                             "Does this text contain exaggerations or hyperbole?", text)
         except Exception as e:
             logger.error(f"Error detecting exaggerations: {str(e)}")
             return False
 
     def summarize_todos(self, conversation: str) -> list:
-        prompt = f"""Extract all action items or to-dos from this conversation. 
-        Format as a JSON array of strings, with each item being a specific task.
-        
-        Conversation: {conversation}"""
-        
         try:
-            response = self.generate(prompt)
-            # Try to parse as JSON
-            try:
-                return json.loads(response)
-            except json.JSONDecodeError:
-                # If not valid JSON, try to extract as list
-                return [item.strip() for item in response.split('\n') if item.strip()]
+            return self.analyze_transcript(conversation)["action_items"]
         except Exception as e:
             logger.error(f"Error summarizing todos: {str(e)}")
             return []
 
-    def query_knowledge_base(self, scenario: str) -> str:
-        """Query the knowledge base for relevant information based on a scenario"""
+    def _sync_vectors(self):
+        """Embed new or changed entries after the knowledge base (re)loads"""
+        if isinstance(self.knowledge_base, KnowledgeBaseStore):
+            # len() triggers the store's lazy load and hot-reload check; reloads counts changes
+            len(self.knowledge_base)
+            version = self.knowledge_base.reloads
+        else:
+            # A plain dict can be edited in place, so key on its contents
+            version = hash(frozenset(self.knowledge_base.items()))
+        if version == self._vector_version:
+            return
+        with self._vector_lock:
+            if version != self._vector_version:
+                self.vector_index.refresh()
+                self.vector_index.update(dict(self.knowledge_base))
+                self._vector_version = version
+
+    def search_knowledge_base(self, scenario: str, k: int = 3, semantic: bool = None) -> List[tuple]:
+        """
+        Rank knowledge base entries against a scenario using the local index
+
+        Args:
+            scenario: Free-text description of the situation
+            k: Number of results
+            semantic: Rank by embedding similarity (default: when a vector index is set)
+
+        Returns:
+            Up to k (key, value, score) tuples, best first
+        """
+        if semantic is None:
+            semantic = self.vector_index is not None
+        if semantic:
+            if self.vector_index is None:
+                raise ValueError("Semantic search needs a vector index")
+            self._sync_vectors()
+            return self.vector_index.search(scenario, k)
+        if self.kb_index is None:
+            return self.knowledge_base.search(scenario, k)
+        return self.kb_index.search(scenario, k)
+
+    def query_knowledge_base(self, scenario: str, rerank: bool = False) -> str:
+        """
+        Query the knowledge base for relevant information based on a scenario
+
+        Entries are ranked locally; with rerank=True the LLM picks the best of
+        the top candidates.
+        """
         try:
-            # Find the most relevant key in the knowledge base
+            results = self.search_knowledge_base(scenario, k=3)
+            if not results:
+                return "I don't have specific information about this scenario in my knowledge base."
+            if not rerank or len(results) == 1:
+                return results[0][1]
+
             prompt = f"""Given the following scenario, which of these knowledge categories is most relevant?
             
             Scenario: {scenario}
             
             Categories:
-            {', '.join(self.knowledge_base.keys())}
+            {', '.join(key for key, _, _ in results)}
             
             Return only the category name, nothing else."""
             
-            category = self.generate(prompt)
+            category = self.generate(prompt, task="rerank")
             
-            # Clean up the response to match knowledge base keys
-            for key in self.knowledge_base:
+            # Clean up the response to match the candidate keys
+            for key, value, _ in results:
                 if key.lower() in category.lower():
-                    return self.knowledge_base[key]
+                    return value
                     
-            # If no direct match, return the most general advice
-            return "I don't have specific information about this scenario in my knowledge base."
+            # The reranker answered with something else; trust the local ranking
+            return results[0][1]
         except Exception as e:
             logger.error(f"Error querying knowledge base: {str(e)}")
             return "Unable to access knowledge base at this time."
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("vocAIyze.LLMCache")
+
+
+class ResponseCache:
+    """
+    Two-tier cache of chat completions
+
+    An in-process LRU sits in front of an optional SQLite file shared across
+    runs. Entries are keyed by everything that determines the completion
+    (model, messages including the system prompt, temperature, max_tokens),
+    expire after a TTL, and each tier is bounded in size. Sampled completions
+    (temperature above max_temperature) are not cached unless
+    cache_high_temperature is set, since callers expect them to vary.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 24 * 3600, disk_path: str = None,
+                 disk_max_entries: int = 100000, max_temperature: float = 0.3,
+                 cache_high_temperature: bool = False, disk_sweep_interval: int = 256):
+        """
+        Args:
+            max_entries: Entries kept in memory
+            ttl: Seconds an entry stays valid (None for no expiry)
+            disk_path: SQLite file for the persistent tier (optional)
+            disk_max_entries: Entries kept on disk; may be exceeded by up to
+                disk_sweep_interval entries between sweeps
+            max_temperature: Highest temperature that is cached by default
+            cache_high_temperature: Cache regardless of temperature
+            disk_sweep_interval: Puts between removing expired and excess disk entries
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self.disk_sweep_interval = max(1, disk_sweep_interval)
+        self._puts_since_sweep = 0
+        self.max_temperature = max_temperature
+        self.cache_high_temperature = cache_high_temperature
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                         "evictions": 0, "expirations": 0, "skipped": 0}
+        self._memory = OrderedDict()  # key -> (created_at, value), least recent first
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            disk_dir = os.path.dirname(os.path.abspath(disk_path))
+            os.makedirs(disk_dir, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                    key TEXT PRIMARY KEY,
+                                    value TEXT NOT NULL,
+                                    created_at REAL NOT NULL,
+                                    accessed_at REAL NOT NULL)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created_at)")
+            self._db.commit()
+            logger.info(f"LLM response cache persisted to {disk_path}")
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                 **extra) -> str:
+        """
+        Hash the request parameters that determine a completion
+
+        Args:
+            model: Model name
+            messages: Chat messages, including the system prompt
+            temperature: Sampling temperature
+            max_tokens: Completion token limit
+            extra: Any other parameters that change the output
+
+        Returns:
+            Hex digest key
+        """
+        material = json.dumps({"model": model, "messages": messages, "temperature": temperature,
+                               "max_tokens": max_tokens, **extra}, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def should_cache(self, temperature: float) -> bool:
+        """Whether a request at this temperature is eligible for caching"""
+        if self.cache_high_temperature or temperature <= self.max_temperature:
+            return True
+        self.counters["skipped"] += 1
+        return False
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a completion, memory first then disk
+
+        Returns:
+            The cached completion, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+                self.counters["expirations"] += 1
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created_at FROM responses WHERE key = ?",
+                                       (key,)).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at, now):
+                        self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, created_at, value)
+                        self.counters["disk_hits"] += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.counters["expirations"] += 1
+
+            self.counters["misses"] += 1
+            return None
+
+    def _remember(self, key: str, created_at: float, value: str):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def put(self, key: str, value: str):
+        """Store a completion in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) "
+                             "VALUES (?, ?, ?, ?)", (key, value, now, now))
+            # Counting and trimming the table is kept off most writes
+            self._puts_since_sweep += 1
+            if self._puts_since_sweep >= self.disk_sweep_interval:
+                self._sweep(now)
+            self._db.commit()
+
+    def _sweep(self, now: float):
+        """Drop expired disk entries, then the least recently used beyond disk_max_entries"""
+        self._puts_since_sweep = 0
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        overflow = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.disk_max_entries
+        if overflow > 0:
+            self._db.execute("DELETE FROM responses WHERE key IN "
+                             "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)", (overflow,))
+            self.counters["evictions"] += overflow
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and the overall hit ratio"""
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {**self.counters, "memory_entries": len(self._memory),
+                "hit_ratio": round(hits / lookups, 3) if lookups else 0.0}
+
+    def close(self):
+        """Close the persistent tier"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,11 +1,25 @@
 import os
 from openai import OpenAI
-from llm import LLM
+from llm import LLM, ERROR_REPLY, DEFAULT_ROUTES
+from dataclasses import replace
 from tts import TextToSpeech
 from stt import SpeechToText
+from pipeline import ConversationPipeline, FILLER_PHRASE, RETRY_PROMPT
+from tts_cache import TTSCache
+from llm_cache import ResponseCache
+from kb_store import KnowledgeBaseStore
+from kb_embeddings import HashingEmbedder, OpenAIEmbedder, VectorIndex
+from prefilter import LexicalPrefilter, load_lexicon
+from clients import create_openai_client, prewarm_connections
+from batch import BatchRunner
+from rate_limit import DEFAULT_LIMITS, configure_rate_limits
+from resilience import configure_resilience
+from metrics import MetricsExporter, get_metrics
+from server import VoiceServer
 from pathlib import Path
 import logging
 import argparse
+import asyncio
 from datetime import datetime
 
 # Configure logging
@@ -19,13 +33,77 @@ logging.basicConfig(
 )
 logger = logging.getLogger("vocAIyze")
 
+GREETING = "Hello, I'm vocAIyze. How can I assist you today?"
+FAREWELL = "Thank you for using vocAIyze. Goodbye!"
+
+# Spoken often enough to keep synthesized on disk
+PREWARM_PHRASES = [
+    GREETING,
+    FAREWELL,
+    ERROR_REPLY,
+    RETRY_PROMPT,
+    FILLER_PHRASE,
+]
+
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="vocAIyze - Voice-based AI Assistant")
-    parser.add_argument("--mode", choices=["interactive", "file"], default="interactive",
-                        help="Run in interactive mode or process from file")
-    parser.add_argument("--input", help="Input file path (for file mode)")
-    parser.add_argument("--output", help="Output file path (for file mode)")
+    parser.add_argument("--mode", choices=["interactive", "file", "batch", "server"], default="interactive",
+                        help="Run in interactive mode, process from file, run a JSONL batch job, "
+                             "or serve callers over WebSocket")
+    parser.add_argument("--input", help="Input file path (for file and batch mode)")
+    parser.add_argument("--output", help="Output file path (for file and batch mode)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Records processed at once (for batch mode)")
+    parser.add_argument("--checkpoint", help="Batch progress file (default: <output>.checkpoint)")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (for server mode)")
+    parser.add_argument("--port", type=int, default=8765, help="WebSocket port (for server mode)")
+    parser.add_argument("--max-sessions", type=int, default=50,
+                        help="Concurrent callers allowed (for server mode)")
+    parser.add_argument("--tts-cache-dir", default=os.getenv("VOCAIYZE_TTS_CACHE_DIR",
+                                                             str(Path(__file__).parent / ".tts_cache")),
+                        help="Directory for cached speech audio")
+    parser.add_argument("--tts-cache-mb", type=int, default=50,
+                        help="Maximum size of the speech cache in megabytes (0 disables it)")
+    parser.add_argument("--llm-cache-db", default=os.getenv("VOCAIYZE_LLM_CACHE_DB",
+                                                            str(Path(__file__).parent / ".llm_cache.sqlite")),
+                        help="SQLite file for persistent LLM response caching (empty to keep it in memory only)")
+    parser.add_argument("--cache-sampled-responses", action="store_true",
+                        help="Also cache completions generated at high temperature (useful for batch reruns)")
+    parser.add_argument("--pool-size", type=int, default=20,
+                        help="Maximum concurrent HTTP connections to the OpenAI API")
+    parser.add_argument("--chat-rpm", type=int, default=DEFAULT_LIMITS["chat"]["requests_per_minute"],
+                        help="Chat completion requests per minute allowed by your account")
+    parser.add_argument("--chat-tpm", type=int, default=DEFAULT_LIMITS["chat"]["tokens_per_minute"],
+                        help="Chat completion tokens per minute allowed by your account")
+    parser.add_argument("--audio-rpm", type=int, default=DEFAULT_LIMITS["speech"]["requests_per_minute"],
+                        help="Speech and transcription requests per minute allowed by your account")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Attempts per API call on transient failures, including the first")
+    parser.add_argument("--hedge-requests", action="store_true",
+                        help="Send a duplicate chat/speech request when the first is unusually slow")
+    parser.add_argument("--no-http2", action="store_true",
+                        help="Disable HTTP/2 even if the h2 package is installed")
+    parser.add_argument("--metrics-file",
+                        help="Keep stage timings in this file in Prometheus text format")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve stage timings for Prometheus on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--turn-budget", type=float, default=4.0,
+                        help="Seconds from end of speech to first reply audio before falling back (0 disables)")
+    parser.add_argument("--full-duplex", action="store_true",
+                        help="Keep listening while a reply plays (headsets only: there is no echo cancellation)")
+    parser.add_argument("--history-tokens", type=int, default=2000,
+                        help="Token budget for conversation context; older turns are summarized")
+    parser.add_argument("--chat-model", default=DEFAULT_ROUTES["chat"].model,
+                        help="Model used for conversation replies")
+    parser.add_argument("--classifier-model", default=DEFAULT_ROUTES["classify"].model,
+                        help="Model used for yes/no compliance checks, reranking and summaries")
+    parser.add_argument("--prefilter-lexicon",
+                        help="JSON file of phrases that trigger the exaggeration/promise checks")
+    parser.add_argument("--kb-embedder", choices=["none", "hashing", "openai"], default="none",
+                        help="Match knowledge base entries by embedding similarity instead of keywords")
+    parser.add_argument("--kb-vectors-dir", default=str(Path(__file__).parent / ".kb_vectors"),
+                        help="Directory for the memory-mapped knowledge base vectors")
     args = parser.parse_args()
 
     # Fetch the API key from an environment variable
@@ -34,17 +112,76 @@ def main():
         logger.error("OPENAI_API_KEY environment variable not set")
         raise ValueError("OPENAI_API_KEY environment variable not set")
 
-    # Initialize components
-    llm = LLM(api_key)
-    tts = TextToSpeech(api_key)
-    stt = SpeechToText(api_key)
+    # Initialize components around one pooled client and one set of rate limits
+    rate_limiter = configure_rate_limits({
+        "chat": {"requests_per_minute": args.chat_rpm, "tokens_per_minute": args.chat_tpm},
+        "speech": {"requests_per_minute": args.audio_rpm},
+        "transcription": {"requests_per_minute": args.audio_rpm},
+    })
+    resilience = configure_resilience(max_attempts=args.max_attempts)
+    client = create_openai_client(api_key, max_connections=args.pool_size, http2=not args.no_http2)
+    llm_cache = ResponseCache(disk_path=args.llm_cache_db or None,
+                              cache_high_temperature=args.cache_sampled_responses)
+    kb_path = Path(__file__).parent / "knowledge_base.json"
+    kb_store = KnowledgeBaseStore(str(kb_path)) if kb_path.exists() else None
+    vector_index = None
+    if args.kb_embedder != "none":
+        embedder = OpenAIEmbedder(client) if args.kb_embedder == "openai" else HashingEmbedder()
+        vector_index = VectorIndex(args.kb_vectors_dir, embedder)
+    routes = {"chat": replace(DEFAULT_ROUTES["chat"], model=args.chat_model)}
+    for task in ("classify", "rerank", "summary"):
+        routes[task] = replace(DEFAULT_ROUTES[task], model=args.classifier_model)
+    prefilter = LexicalPrefilter(load_lexicon(args.prefilter_lexicon)) if args.prefilter_lexicon else None
+    llm = LLM(api_key, client=client, cache=llm_cache, kb_store=kb_store, vector_index=vector_index,
+              routes=routes, prefilter=prefilter)
+    tts_cache = TTSCache(args.tts_cache_dir, args.tts_cache_mb * 1024 * 1024) if args.tts_cache_mb else None
+    tts = TextToSpeech(api_key, cache=tts_cache, client=client)
+    stt = SpeechToText(api_key, client=client)
+    llm.hedge_requests = tts.hedge_requests = args.hedge_requests
+    metrics = get_metrics()
+    exporter = None
+    if args.metrics_file or args.metrics_port is not None:
+        exporter = MetricsExporter(metrics, path=args.metrics_file, port=args.metrics_port).start()
     
-    # File mode
-    if args.mode == "file":
-        process_file_mode(llm, tts, stt, args.input, args.output)
-    # Interactive mode
-    else:
-        run_interactive_mode(llm, tts, stt)
+    try:
+        # File mode
+        if args.mode == "file":
+            process_file_mode(llm, tts, stt, args.input, args.output)
+        elif args.mode == "batch":
+            run_batch_mode(llm, tts, stt, args.input, args.output, args.concurrency, args.checkpoint)
+        elif args.mode == "server":
+            if tts_cache is not None:
+                tts.prewarm(PREWARM_PHRASES)
+            prewarm_connections(client)
+            run_server_mode(llm, tts, stt, args.host, args.port, args.max_sessions, args.history_tokens,
+                            args.turn_budget or None)
+        # Interactive mode
+        else:
+            if tts_cache is not None:
+                tts.prewarm(PREWARM_PHRASES)
+            # Connections open in the background while the greeting plays
+            prewarm_connections(client)
+            # Opening the microphone up front keeps device setup out of the first turn
+            stt.open_microphone()
+            run_interactive_mode(llm, tts, stt, args.history_tokens, args.turn_budget or None, args.full_duplex)
+    finally:
+        # Audio devices are kept open across turns; release them on the way out
+        stt.close()
+        tts.close()
+        client.close()
+        llm_cache.close()
+        resilience.close()
+        if exporter is not None:
+            exporter.stop()
+
+    logger.info(f"LLM cache stats: {llm_cache.stats()}")
+    logger.info(f"Compliance prefilter stats: {llm.prefilter.stats()}")
+    logger.info(f"Rate limiter stats: {rate_limiter.stats()}")
+    logger.info(f"Resilience stats: {resilience.stats()}")
+    logger.info(f"Stage timings: {metrics.snapshot()}")
+
+    if tts_cache is not None:
+        logger.info(f"TTS cache stats: {tts_cache.stats()}")
 
 def process_file_mode(llm, tts, stt, input_path, output_path):
     """Process input from a file and save results to output file"""
@@ -85,57 +222,50 @@ def process_file_mode(llm, tts, stt, input_path, output_path):
         logger.error(f"Error in file processing: {str(e)}")
         raise
 
-def run_interactive_mode(llm, tts, stt):
+def run_batch_mode(llm, tts, stt, input_path, output_path, concurrency=8, checkpoint_path=None):
+    """Run a resumable batch job over a JSONL file of request records"""
+    if not input_path:
+        raise ValueError("--input is required in batch mode")
+    output_path = output_path or f"{os.path.splitext(input_path)[0]}.results.jsonl"
+    runner = BatchRunner(llm, tts, stt, concurrency=concurrency)
+    try:
+        counters = runner.run(input_path, output_path, checkpoint_path)
+        print(f"Batch complete: {counters['processed']} processed, {counters['failed']} failed, "
+              f"{counters['skipped']} already done. Results in {output_path}")
+    except KeyboardInterrupt:
+        runner.stop()
+        print("\nBatch interrupted; rerun the same command to resume")
+
+def run_interactive_mode(llm, tts, stt, history_tokens=2000, turn_budget=4.0, full_duplex=False):
     """Run an interactive conversation session"""
     logger.info("Starting interactive mode")
-    
-    # Greeting
-    greeting = "Hello, I'm vocAIyze. How can I assist you today?"
-    print(greeting)
-    tts.text_to_speech(greeting)
-    
-    conversation_history = []
-    
+
+    # Capture, transcription, generation, synthesis and playback run as
+    # concurrent stages; with full_duplex the next utterance is captured while a reply plays
+    pipeline = ConversationPipeline(llm, tts, stt, history_tokens=history_tokens, turn_budget=turn_budget,
+                                    full_duplex=full_duplex)
     try:
-        while True:
-            # Record user input
-            print("\nListening... (speak now)")
-            audio_path = Path("./user_input.wav")
-            stt.record_audio(str(audio_path), duration=7)
-            
-            # Convert speech to text
-            user_input = stt.speech_to_text(str(audio_path))
-            print(f"You: {user_input}")
-            
-            if user_input.lower() in ["exit", "quit", "goodbye", "bye"]:
-                farewell = "Thank you for using vocAIyze. Goodbye!"
-                print(f"Assistant: {farewell}")
-                tts.text_to_speech(farewell)
-                break
-            
-            # Add to conversation history and generate response
-            conversation_history.append({"role": "user", "content": user_input})
-            
-            # Generate context-aware response
-            prompt = "\n".join([f"{'User' if item['role'] == 'user' else 'Assistant'}: {item['content']}" 
-                               for item in conversation_history])
-            response = llm.generate(prompt)
-            
-            print(f"Assistant: {response}")
-            tts.text_to_speech(response)
-            
-            # Add response to history
-            conversation_history.append({"role": "assistant", "content": response})
-            
-            # Keep conversation history manageable
-            if len(conversation_history) > 10:
-                conversation_history = conversation_history[-10:]
-                
+        pipeline.run(greeting=GREETING, farewell=FAREWELL)
     except KeyboardInterrupt:
         print("\nExiting vocAIyze...")
     except Exception as e:
         logger.error(f"Error in interactive mode: {str(e)}")
         print(f"An error occurred: {str(e)}")
+    logger.info(f"Turn latency budget outcomes: {pipeline.outcomes}")
+
+def run_server_mode(llm, tts, stt, host="127.0.0.1", port=8765, max_sessions=50, history_tokens=2000,
+                    turn_budget=4.0):
+    """Serve concurrent callers over WebSocket, sharing the components between sessions"""
+    logger.info("Starting server mode")
+    server = VoiceServer(llm, tts, stt, max_sessions=max_sessions, history_tokens=history_tokens,
+                         turn_budget=turn_budget, greeting=GREETING, farewell=FAREWELL)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        server.close()
+    logger.info(f"Server stats: {server.stats()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,310 @@
+import bisect
+import contextvars
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("vocAIyze.Metrics")
+
+# Stages of a conversation turn
+CAPTURE = "capture"                # Recording the utterance from the microphone
+UPLOAD_PREPARE = "upload_prepare"  # Downmixing, resampling and encoding audio for upload
+TRANSCRIPTION = "transcription"    # Transcription request, including the upload
+LLM_FIRST_TOKEN = "llm_first_token"
+LLM_TOTAL = "llm_total"
+TTS_FIRST_BYTE = "tts_first_byte"
+TTS_TOTAL = "tts_total"
+DECODE = "decode"                  # Decoding compressed speech before playback
+PLAYBACK = "playback"
+FIRST_AUDIO = "turn_first_audio"   # End of transcription to first reply audio
+
+# Upper bounds in seconds; wide enough for both local stages and slow API calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_session_id = contextvars.ContextVar("vocaiyze_session_id", default=None)
+_turn_id = contextvars.ContextVar("vocaiyze_turn_id", default=None)
+
+
+@contextmanager
+def turn_context(session_id: str = None, turn_id: int = None):
+    """Tag spans recorded in the enclosed block with a session and turn"""
+    session_token = _session_id.set(session_id)
+    turn_token = _turn_id.set(turn_id)
+    try:
+        yield
+    finally:
+        _turn_id.reset(turn_token)
+        _session_id.reset(session_token)
+
+
+def current_tags() -> dict:
+    return {"session": _session_id.get(), "turn": _turn_id.get()}
+
+
+class Histogram:
+    """
+    Stage latencies as cumulative buckets plus a window of recent samples
+
+    The buckets and totals are what Prometheus scrapes; the window gives the
+    in-process p50/p95/p99 without keeping every observation.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self._recent.append(value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._recent:
+                return None
+            ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ordered = sorted(self._recent)
+            count, total = self.count, self.sum
+            cumulative, running = [], 0
+            for n in self.counts:
+                running += n
+                cumulative.append(running)
+        quantiles = {q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else None
+                     for q in QUANTILES}
+        return {"count": count, "sum": total, "buckets": list(zip(self.buckets + (float("inf"),), cumulative)),
+                "quantiles": quantiles}
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Metrics:
+    """
+    Timing spans for every stage of a turn
+
+    Durations are kept per stage (and per any low-cardinality labels such as the
+    LLM task) in a Histogram. Every span is also written to the log with the
+    session and turn it belongs to, taken from turn_context, so a slow turn can
+    be traced stage by stage; those IDs are not Prometheus labels because each
+    would create a new series.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window: int = 1024,
+                 recent_spans: int = 1000):
+        """
+        Args:
+            buckets: Histogram bucket upper bounds in seconds
+            window: Recent samples per histogram used for percentiles
+            recent_spans: Spans kept in memory for inspection
+        """
+        self.bucket_bounds = buckets
+        self.window = window
+        self.spans = deque(maxlen=recent_spans)
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, stage: str, **labels) -> Histogram:
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.bucket_bounds, self.window)
+            return self._histograms[key]
+
+    def observe(self, stage: str, seconds: float, **labels):
+        """
+        Record one stage duration
+
+        Args:
+            stage: Stage name, e.g. TRANSCRIPTION
+            seconds: How long it took
+            labels: Extra Prometheus labels; keep their values to a small set
+        """
+        self.histogram(stage, **labels).observe(seconds)
+        tags = current_tags()
+        self.spans.append({"stage": stage, "seconds": seconds, **tags, **labels})
+        extra = "".join(f" {k}={v}" for k, v in labels.items())
+        logger.info(f"span stage={stage} duration_ms={seconds * 1000:.1f} "
+                    f"session={tags['session']} turn={tags['turn']}{extra}")
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """Time the enclosed block as one stage; failed blocks are recorded too"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started, **labels)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Count and p50/p95/p99 in milliseconds per stage (and label set)"""
+        with self._lock:
+            histograms = dict(self._histograms)
+        summary = {}
+        for (stage, labels), histogram in sorted(histograms.items()):
+            name = stage + "".join(f"[{k}={v}]" for k, v in labels)
+            data = histogram.snapshot()
+            summary[name] = {"count": data["count"],
+                             **{f"p{int(q * 100)}_ms": round(v * 1000, 1) if v is not None else None
+                                for q, v in data["quantiles"].items()}}
+        return summary
+
+    def render_prometheus(self) -> str:
+        """All stage histograms in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = dict(self._histograms)
+        name = "vocaiyze_stage_duration_seconds"
+        lines = [f"# HELP {name} Duration of each conversation stage",
+                 f"# TYPE {name} histogram"]
+        quantile_lines = []
+        for (stage, labels), histogram in sorted(histograms.items()):
+            base = {"stage": stage, **dict(labels)}
+            data = histogram.snapshot()
+            for bound, cumulative in data["buckets"]:
+                lines.append(f"{name}_bucket{_format_labels({**base, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(base)} {_format_value(data['sum'])}")
+            lines.append(f"{name}_count{_format_labels(base)} {data['count']}")
+            for q, value in data["quantiles"].items():
+                if value is not None:
+                    quantile_lines.append(f"{name}_recent{_format_labels({**base, 'quantile': str(q)})} "
+                                          f"{_format_value(value)}")
+        if quantile_lines:
+            lines += [f"# HELP {name}_recent Stage duration quantiles over recent samples",
+                      f"# TYPE {name}_recent gauge"] + quantile_lines
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Atomically replace path with the current metrics (for node_exporter's textfile collector)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render_prometheus())
+            # mkstemp creates the file 0600; the collector may run as another user
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class MetricsExporter:
+    """
+    Publish Metrics in Prometheus text format
+
+    Either rewrites a file every `interval` seconds, serves GET /metrics on a
+    local port, or both. Threads are daemons; stop() writes the file one last
+    time.
+    """
+
+    def __init__(self, metrics: "Metrics", path: str = None, port: int = None,
+                 host: str = "127.0.0.1", interval: float = 15.0):
+        """
+        Args:
+            metrics: Metrics to publish
+            path: Text file to keep up to date (optional)
+            port: Port for the HTTP endpoint (optional; 0 picks a free port)
+            host: Interface the HTTP endpoint binds to
+            interval: Seconds between file writes
+        """
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.metrics.write_prometheus(self.path)
+            except Exception as e:
+                logger.error(f"Error writing metrics to {self.path}: {str(e)}")
+
+    def start(self) -> "MetricsExporter":
+        if self.path:
+            thread = threading.Thread(target=self._write_loop, name="metrics-file", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            logger.info(f"Writing metrics to {self.path} every {self.interval:g}s")
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/metrics", "/"):
+                        self.send_error(404)
+                        return
+                    body = metrics.render_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass  # Scrapes would otherwise flood stderr
+
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.port = self._server.server_address[1]
+            thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.path:
+            try:
+                self.metrics.write_prometheus(self.path)
+            except Exception as e:
+                logger.error(f"Error writing metrics to {self.path}: {str(e)}")
+
+
+_default_metrics = None
+_default_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """The process-wide metrics used by components that are not given their own"""
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
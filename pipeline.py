@@ -0,0 +1,464 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+from conversation import ConversationMemory
+from llm import ERROR_REPLY, SYSTEM_PROMPT
+from metrics import FIRST_AUDIO, Metrics, get_metrics, turn_context
+from resilience import is_timeout, is_transient
+
+logger = logging.getLogger("vocAIyze.Pipeline")
+
+EXIT_PHRASES = ["exit", "quit", "goodbye", "bye"]
+RETRY_PROMPT = "Sorry, I didn't catch that. Could you say it again?"
+# Spoken (from the TTS cache) when the main model cannot answer within the turn budget
+FILLER_PHRASE = "Let me check on that."
+
+# Turn outcomes against the latency budget
+MET = "met"
+DEGRADED = "degraded"
+MISSED = "missed"
+
+# Marks the end of the stream on every queue
+_STOP = object()
+
+
+@dataclass
+class Turn:
+    """One captured user utterance flowing from capture to generation"""
+    turn_id: int
+    audio: Optional[bytes] = None
+    user_text: Optional[str] = None
+    transcribed_at: Optional[float] = None
+    deadline: Optional[float] = None
+    final: bool = False
+    failed: bool = False
+
+
+@dataclass
+class Segment:
+    """One sentence of a reply flowing from generation to playback"""
+    turn_id: int
+    text: str
+    audio: Optional[bytes] = None
+    chunks: Optional[queue.Queue] = None
+    first: bool = True
+    last: bool = True
+    final: bool = False
+    transcribed_at: Optional[float] = None
+    deadline: Optional[float] = None
+    degraded: bool = False
+
+
+class ConversationPipeline:
+    """
+    Staged conversation engine: capture -> STT -> LLM -> TTS -> playback
+
+    Each stage runs on its own worker thread and hands work to the next through
+    a bounded queue, so earlier turns are transcribed, answered, synthesized and
+    played while later work is in flight (in full-duplex mode the microphone
+    keeps listening too). The stages are the existing SpeechToText, LLM and
+    TextToSpeech components.
+
+    Replies are streamed from the LLM and split into sentences; each sentence
+    is synthesized as soon as it is complete and played in order, so the first
+    sentence is heard while later ones are still being generated.
+
+    Each turn has a latency budget, from the end of the user's speech to the
+    first audio of the reply. The remaining time is passed to the STT, LLM and
+    TTS calls as their deadline. If the main model has not started answering
+    when the budget is nearly spent, a cached filler clip is played and the
+    reply comes from the faster fallback model. Speech that misses its own
+    deadline (at least tts_reserve) is spoken late rather than dropped. Every
+    turn is recorded as met, degraded or missed at its first audio.
+    """
+
+    def __init__(self, llm, tts, stt, queue_size: int = 2, full_duplex: bool = False,
+                 history_tokens: int = 2000, exit_phrases: List[str] = None,
+                 turn_budget: Optional[float] = 4.0, tts_reserve: float = 1.0,
+                 session_id: str = None, metrics: Metrics = None):
+        """
+        Args:
+            llm: LLM used to generate replies
+            tts: TextToSpeech used to synthesize and play replies
+            stt: SpeechToText used to capture and transcribe user speech
+            queue_size: Maximum number of items waiting between two stages
+            full_duplex: Keep capturing while a reply is playing. There is no echo
+                cancellation, so only enable it with a headset; by default the
+                microphone is paused until playback of the previous reply ends,
+                so the assistant does not transcribe its own voice
+            history_tokens: Token budget for the conversation context; older turns
+                are rolled into a running summary
+            exit_phrases: Utterances that end the session
+            turn_budget: Seconds from end of speech to first reply audio (None: no budget)
+            tts_reserve: Part of the budget kept for synthesizing the first sentence
+            session_id: Tags this session's timing spans (default: a random ID)
+            metrics: Where stage timings are recorded (default: the process-wide Metrics)
+        """
+        self.llm = llm
+        self.tts = tts
+        self.stt = stt
+        self.full_duplex = full_duplex
+        self.exit_phrases = exit_phrases or EXIT_PHRASES
+        self.memory = ConversationMemory(SYSTEM_PROMPT, max_tokens=history_tokens,
+                                         summarizer=llm.summarize_conversation)
+        self.farewell = "Goodbye!"
+        self.turn_budget = turn_budget
+        self.tts_reserve = tts_reserve
+        self.outcomes = {MET: 0, DEGRADED: 0, MISSED: 0}
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.metrics = metrics or get_metrics()
+
+        self.captured = queue.Queue(maxsize=queue_size)
+        self.transcribed = queue.Queue(maxsize=queue_size)
+        # Sentences rather than whole turns flow through these two queues
+        self.replies = queue.Queue(maxsize=queue_size * 4)
+        self.synthesized = queue.Queue(maxsize=queue_size * 4)
+
+        self._halt = threading.Event()        # Stop everything now (error or interrupt)
+        self._capture_done = threading.Event()  # Stop listening, drain the rest
+        self._playback_idle = threading.Event()
+        self._playback_idle.set()
+        self._threads = []
+        self._capture_thread = None
+        self._turn_counter = 0
+        self._turn_lock = threading.Lock()
+        self.error = None
+
+    def _next_turn_id(self) -> int:
+        with self._turn_lock:
+            self._turn_counter += 1
+            return self._turn_counter
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Put without blocking forever once the pipeline is halting"""
+        while not self._halt.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        """Get the next item, or _STOP once the pipeline is halting"""
+        while not self._halt.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    def _fail(self, stage: str, e: Exception):
+        logger.error(f"Error in {stage} stage: {str(e)}")
+        if self.error is None:
+            self.error = e
+        self._halt.set()
+
+    def _capture_stage(self):
+        try:
+            while not self._halt.is_set() and not self._capture_done.is_set():
+                if not self.full_duplex:
+                    self._playback_idle.wait()
+                    if self._halt.is_set() or self._capture_done.is_set():
+                        break  # The exit phrase was heard while the reply played
+                turn = Turn(self._next_turn_id())
+                print("\nListening... (speak now)")
+                with turn_context(self.session_id, turn.turn_id):
+                    turn.audio = self.stt.capture_audio(vad=True)
+                if turn.audio is None:
+                    continue
+                if self.turn_budget is not None:
+                    turn.deadline = time.monotonic() + self.turn_budget
+                if self._capture_done.is_set():
+                    break
+                if not self.full_duplex:
+                    # Hold the microphone until this turn's reply has played
+                    self._playback_idle.clear()
+                if not self._put(self.captured, turn):
+                    break
+        except Exception as e:
+            self._fail("capture", e)
+        finally:
+            self._put(self.captured, _STOP)
+
+    def _transcribe_stage(self):
+        try:
+            while True:
+                turn = self._get(self.captured)
+                if turn is _STOP:
+                    break
+                try:
+                    with turn_context(self.session_id, turn.turn_id):
+                        turn.user_text = self.stt.speech_to_text(turn.audio, deadline=turn.deadline)
+                except Exception as e:
+                    if not is_transient(e):
+                        raise
+                    # The API is struggling even after retries; lose this turn, not the session
+                    logger.warning(f"Turn {turn.turn_id} could not be transcribed: {str(e)}")
+                    turn.audio = None
+                    turn.failed = True
+                    self._put(self.transcribed, turn)
+                    continue
+                turn.transcribed_at = time.monotonic()
+                turn.audio = None
+                print(f"You: {turn.user_text}")
+                if turn.user_text.lower().strip(" .!?") in self.exit_phrases:
+                    turn.final = True
+                    self._capture_done.set()
+                    self._put(self.transcribed, turn)
+                    break
+                self._put(self.transcribed, turn)
+        except Exception as e:
+            self._fail("transcription", e)
+        finally:
+            self._put(self.transcribed, _STOP)
+
+    def _generate_stage(self):
+        try:
+            while True:
+                turn = self._get(self.transcribed)
+                if turn is _STOP:
+                    break
+                if turn.final:
+                    self._put(self.replies, Segment(turn.turn_id, self.farewell, final=True,
+                                                    transcribed_at=turn.transcribed_at,
+                                                    deadline=turn.deadline))
+                    continue
+                if turn.failed:
+                    self._put(self.replies, Segment(turn.turn_id, RETRY_PROMPT, deadline=turn.deadline,
+                                                    degraded=True))
+                    continue
+                self.memory.add("user", turn.user_text)
+                with turn_context(self.session_id, turn.turn_id):
+                    reply = self._stream_reply(turn)
+                self.memory.add("assistant", reply)
+                # Only counts tokens here; dropped turns are summarized on the memory's own thread
+                self.memory.trim()
+        except Exception as e:
+            self._fail("generation", e)
+        finally:
+            self._put(self.replies, _STOP)
+
+    def _stream_reply(self, turn: Turn) -> str:
+        """Queue each sentence of the reply as it is generated, return the full reply"""
+        messages = self.memory.messages()
+        sentences = []
+        spoken = 0
+        pending = None
+
+        def emit(sentence: str, degraded: bool = False):
+            # Hold one sentence back so the last one can be flagged as such
+            nonlocal pending, spoken
+            if pending is not None:
+                self._put(self.replies, pending)
+            pending = Segment(turn.turn_id, sentence, first=spoken == 0, last=False,
+                              transcribed_at=turn.transcribed_at, deadline=turn.deadline, degraded=degraded)
+            spoken += 1
+
+        llm_deadline = turn.deadline - self.tts_reserve if turn.deadline is not None else None
+        try:
+            for sentence in self.llm.generate_sentences(messages, deadline=llm_deadline,
+                                                        strict=llm_deadline is not None):
+                emit(sentence)
+                sentences.append(sentence)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            if sentences:
+                # Close the turn with what was already said
+                logger.warning(f"Turn {turn.turn_id} reply was cut short: {str(e)}")
+            else:
+                logger.warning(f"Turn {turn.turn_id} reply is over budget ({str(e)}), using the fallback model")
+                emit(FILLER_PHRASE, degraded=True)
+                fallback_deadline = time.monotonic() + self.turn_budget if self.turn_budget else None
+                try:
+                    for sentence in self.llm.generate_sentences(messages, deadline=fallback_deadline,
+                                                                task="fast_chat"):
+                        emit(sentence, degraded=True)
+                        sentences.append(sentence)
+                except Exception as e:
+                    if not is_transient(e):
+                        raise
+                    logger.warning(f"Turn {turn.turn_id} fallback reply failed: {str(e)}")
+                if not sentences:
+                    emit(RETRY_PROMPT, degraded=True)
+                    sentences.append(RETRY_PROMPT)
+
+        if pending is not None:
+            pending.last = True
+            self._put(self.replies, pending)
+        return " ".join(sentences)
+
+    def _tts_deadline(self, segment: Segment) -> Optional[float]:
+        """
+        When a first sentence's audio is needed: the rest of the turn budget, but
+        never less than tts_reserve from now, so a sentence that queued behind
+        the previous reply's playback still gets a fair try
+        """
+        if not segment.first or segment.deadline is None:
+            return None
+        return max(segment.deadline, time.monotonic() + self.tts_reserve)
+
+    def _synthesize(self, segment: Segment):
+        """Synthesize a segment; past its budget it is spoken late, on other transient errors not at all"""
+        deadline = self._tts_deadline(segment)
+        streamed = False
+        while True:
+            try:
+                if not self.tts.streaming_playback:
+                    segment.audio = self.tts.synthesize(segment.text, deadline=deadline)
+                    return
+                for chunk in self.tts.iter_speech(segment.text, deadline=deadline):
+                    streamed = True
+                    segment.chunks.put(chunk)
+                return
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                if deadline is not None and not streamed and is_timeout(e):
+                    # Late audio beats none; playback records the turn as missed
+                    logger.warning(f"Turn {segment.turn_id} speech missed its budget ({str(e)}), "
+                                   f"speaking it late")
+                    deadline = None
+                    continue
+                # Still shown on screen; whatever audio arrived is played
+                logger.warning(f"Turn {segment.turn_id} sentence could not be synthesized: {str(e)}")
+                return
+
+    def _synthesize_stage(self):
+        try:
+            while True:
+                segment = self._get(self.replies)
+                if segment is _STOP:
+                    break
+                with turn_context(self.session_id, segment.turn_id):
+                    if not self.tts.streaming_playback:
+                        self._synthesize(segment)
+                        self._put(self.synthesized, segment)
+                        continue
+                    # Hand the segment to playback right away and feed it PCM chunks
+                    # as they arrive, so playback starts before synthesis finishes
+                    segment.chunks = queue.Queue()
+                    self._put(self.synthesized, segment)
+                    try:
+                        self._synthesize(segment)
+                    finally:
+                        segment.chunks.put(_STOP)
+        except Exception as e:
+            self._fail("synthesis", e)
+        finally:
+            self._put(self.synthesized, _STOP)
+
+    def _drain(self, segment: Segment):
+        """Yield streamed audio chunks until the segment ends or the pipeline halts"""
+        heard = False
+        while True:
+            chunk = self._get(segment.chunks)
+            if chunk is _STOP:
+                if not heard:
+                    self._first_audio(segment, heard=False)
+                return
+            if not heard:
+                heard = True
+                self._first_audio(segment, heard=True)
+            yield chunk
+
+    def _first_audio(self, segment: Segment, heard: bool):
+        """Time a turn's first audio (or its absence) against the budget"""
+        if not segment.first:
+            return
+        if heard and segment.transcribed_at is not None:
+            self.metrics.observe(FIRST_AUDIO, time.monotonic() - segment.transcribed_at)
+        if segment.deadline is not None:
+            self._record_outcome(segment, heard)
+
+    def _record_outcome(self, segment: Segment, heard: bool):
+        """Classify a turn by when and how its first audio started"""
+        overrun = time.monotonic() - segment.deadline
+        if overrun > 0 or not heard or segment.text == ERROR_REPLY:
+            outcome = MISSED
+        elif segment.degraded:
+            outcome = DEGRADED
+        else:
+            outcome = MET
+        self.outcomes[outcome] += 1
+        logger.info(f"Turn {segment.turn_id} latency budget {outcome} "
+                    f"({'over' if overrun > 0 else 'under'} by {abs(overrun):.2f}s)")
+
+    def _playback_stage(self):
+        try:
+            while True:
+                segment = self._get(self.synthesized)
+                if segment is _STOP:
+                    break
+                with turn_context(self.session_id, segment.turn_id):
+                    print(f"{'Assistant: ' if segment.first else ''}{segment.text}",
+                          end="\n" if segment.last else " ", flush=True)
+                    if segment.chunks is not None:
+                        # Timed at the first chunk, once synthesis has actually produced audio
+                        self.tts.play_stream(self._drain(segment))
+                    else:
+                        self._first_audio(segment, heard=bool(segment.audio))
+                        if segment.audio:
+                            self.tts.play_audio(segment.audio)
+                    if segment.last:
+                        self._playback_idle.set()
+                    if segment.final:
+                        break
+        except Exception as e:
+            self._fail("playback", e)
+        finally:
+            self._playback_idle.set()
+
+    def run(self, greeting: str = None, farewell: str = "Goodbye!"):
+        """
+        Run the conversation until an exit phrase is heard
+
+        Args:
+            greeting: Text spoken when the session starts (optional)
+            farewell: Text spoken in reply to an exit phrase
+
+        Raises:
+            The first exception raised by any stage
+        """
+        self.farewell = farewell
+        stages = [self._capture_stage, self._transcribe_stage, self._generate_stage,
+                  self._synthesize_stage, self._playback_stage]
+        self._threads = [threading.Thread(target=stage, name=stage.__name__.strip("_"), daemon=True)
+                         for stage in stages]
+        self._capture_thread = self._threads[0]
+
+        if greeting:
+            print(greeting)
+            if not self.full_duplex:
+                self._playback_idle.clear()
+            self.replies.put(Segment(0, greeting))
+
+        logger.info("Starting conversation pipeline")
+        try:
+            for thread in self._threads:
+                thread.start()
+            # The playback stage finishes last: after the farewell or on halt
+            while self._threads[-1].is_alive():
+                self._threads[-1].join(timeout=0.2)
+        finally:
+            self.stop()
+
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Halt all stages"""
+        self._halt.set()
+        self._capture_done.set()
+        self._playback_idle.set()
+        for thread in self._threads:
+            # The capture stage may be blocked on the microphone; it is a daemon thread
+            if thread is not self._capture_thread and thread.is_alive():
+                thread.join(timeout=1)
+        logger.info("Conversation pipeline stopped")
@@ -0,0 +1,129 @@
+import json
+import logging
+import re
+import threading
+from typing import Dict, List
+
+logger = logging.getLogger("vocAIyze.Prefilter")
+
+# Phrases that make a text worth a closer look. Entries starting with "re:" are
+# regular expressions; everything else is matched as a case-insensitive phrase.
+# Everyday words ("best", "always", "never", "promise") appear in almost every
+# sales call, so they only count as part of a claim; otherwise nearly every
+# transcript would be escalated to the model.
+DEFAULT_LEXICON = {
+    "exaggerations": [
+        "unbeatable", "unmatched", "unparalleled", "revolutionary", "game changer", "game-changing",
+        "world class", "world-class", "best in class", "best-in-class", "flawless", "number one", "#1",
+        "only solution", "like nothing else", "nothing else comes close", "nobody else can",
+        "no one else can", "blow away", "blows away", "of all time", "in the universe",
+        "everyone is switching", "everybody is switching",
+        r"re:\b(?:best|greatest|biggest|fastest|cheapest|most\s+\w+)\s+(?:\w+\s+){0,2}?"
+        r"(?:ever|in\s+the\s+(?:world|market|industry|country)|on\s+the\s+market)\b",
+        r"re:\b\d{3,}\s*(?:%|percent)",
+        r"re:\b\d+x\s+(?:faster|better|more|cheaper|growth|roi|returns?)\b",
+    ],
+    "unreliable_promises": [
+        "guarantee", "guaranteed", "guarantees", "i promise", "we promise", "100%", "100 percent",
+        "risk-free", "risk free", "no risk", "zero risk", "can't lose", "cannot lose", "will definitely",
+        "definitely will", "certainly will", "without fail", "no matter what", "always works",
+        "always work", "never fail", "never fails", "double your", "triple your", "overnight results",
+        "overnight success", "instant results", "money back", "free forever",
+        r"re:\bwill\s+(?:increase|double|triple|grow|boost)\s+(?:your|the)\b",
+    ],
+}
+
+_SENTENCE_END = re.compile(r"[.!?\n]")
+
+
+def load_lexicon(path: str) -> Dict[str, List[str]]:
+    """Load a lexicon JSON file mapping category names to phrase lists"""
+    with open(path, "r") as f:
+        lexicon = json.load(f)
+    if not isinstance(lexicon, dict) or not all(isinstance(v, list) for v in lexicon.values()):
+        raise ValueError("Lexicon must map category names to lists of phrases")
+    return lexicon
+
+
+class LexicalPrefilter:
+    """
+    Local first pass for the compliance detectors
+
+    Each category's lexicon is compiled into one alternation regex, so a text is
+    scanned once per category. Texts with no match are cleared without an LLM
+    call; otherwise only the sentences around the matches are returned as
+    candidate spans to be confirmed by the model.
+    """
+
+    def __init__(self, lexicon: Dict[str, List[str]] = None, max_span_chars: int = 300):
+        """
+        Args:
+            lexicon: Category -> phrases, merged over DEFAULT_LEXICON so a
+                partial lexicon only replaces the categories it names
+            max_span_chars: Longest context kept around a match
+        """
+        self.lexicon = {**DEFAULT_LEXICON, **(lexicon or {})}
+        self.max_span_chars = max_span_chars
+        self._patterns = {category: self._compile(phrases) for category, phrases in self.lexicon.items()}
+        self._lock = threading.Lock()
+        self.counters = {category: {"checked": 0, "shortcut": 0, "escalated": 0} for category in self.lexicon}
+
+    @staticmethod
+    def _compile(phrases: List[str]) -> re.Pattern:
+        alternatives = []
+        # Longest first so the alternation prefers the most specific phrase
+        for phrase in sorted(phrases, key=len, reverse=True):
+            phrase = phrase.strip()
+            if not phrase or phrase == "re:":
+                continue  # An empty alternative would match everywhere
+            if phrase.startswith("re:"):
+                alternatives.append(f"(?:{phrase[3:]})")
+                continue
+            body = r"\s+".join(re.escape(word) for word in phrase.split())
+            start = r"\b" if phrase[0].isalnum() else ""
+            end = r"\b" if phrase[-1].isalnum() else ""
+            alternatives.append(f"{start}{body}{end}")
+        return re.compile("|".join(alternatives) or r"(?!)", re.IGNORECASE)
+
+    def _sentence(self, text: str, start: int, end: int) -> tuple:
+        """Expand a match to its sentence, capped at max_span_chars"""
+        half = self.max_span_chars // 2
+        left = max(0, start - half)
+        for match in _SENTENCE_END.finditer(text, left, start):
+            left = match.end()
+        right_match = _SENTENCE_END.search(text, end, min(len(text), end + half))
+        right = right_match.end() if right_match else min(len(text), end + half)
+        return left, right
+
+    def candidates(self, category: str, text: str) -> List[str]:
+        """
+        Spans of the text that may belong to the category
+
+        Args:
+            category: Lexicon category, e.g. "exaggerations"
+            text: Text to scan
+
+        Returns:
+            Matching sentences in order, overlapping ones merged; empty if nothing matched
+        """
+        ranges = []
+        for match in self._patterns[category].finditer(text):
+            left, right = self._sentence(text, match.start(), match.end())
+            if ranges and left <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(right, ranges[-1][1]))
+            else:
+                ranges.append((left, right))
+
+        with self._lock:
+            counters = self.counters[category]
+            counters["checked"] += 1
+            counters["escalated" if ranges else "shortcut"] += 1
+        return [text[left:right].strip() for left, right in ranges]
+
+    def stats(self) -> dict:
+        """Per-category counters and the share of texts cleared locally"""
+        with self._lock:
+            return {category: {**counters,
+                               "shortcut_ratio": round(counters["shortcut"] / counters["checked"], 3)
+                               if counters["checked"] else 0.0}
+                    for category, counters in self.counters.items()}
@@ -0,0 +1,261 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    from openai import RateLimitError
+except ImportError:  # Very old openai releases
+    RateLimitError = None
+
+logger = logging.getLogger("vocAIyze.RateLimit")
+
+# Request priorities; interactive sessions always go ahead of batch work
+INTERACTIVE = 0
+BATCH = 1
+
+_priority = contextvars.ContextVar("vocaiyze_request_priority", default=INTERACTIVE)
+
+# Published per-minute limits are account specific; these are conservative defaults
+DEFAULT_LIMITS = {
+    "chat": {"requests_per_minute": 500, "tokens_per_minute": 30000, "max_concurrency": 16},
+    "speech": {"requests_per_minute": 50, "tokens_per_minute": None, "max_concurrency": 8},
+    "transcription": {"requests_per_minute": 50, "tokens_per_minute": None, "max_concurrency": 8},
+    "embeddings": {"requests_per_minute": 500, "tokens_per_minute": 1000000, "max_concurrency": 4},
+}
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Run the enclosed API calls at the given priority (INTERACTIVE or BATCH)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    if RateLimitError is not None and isinstance(e, RateLimitError):
+        return True
+    return getattr(e, "status_code", None) == 429
+
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    """Seconds suggested by a 429 response's Retry-After header, if any"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Continuously refilled bucket holding up to one minute of allowance"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (0 if it is now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.per_minute
+
+    def take(self, amount: float):
+        # May go negative when a settled request used more than reserved
+        self.level -= amount
+
+
+class Permit:
+    """One admitted request; releases its concurrency slot on exit"""
+
+    def __init__(self, limiter: "EndpointLimiter", tokens: float):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, actual_tokens: float):
+        """Correct the token bucket once the real usage is known"""
+        if self.limiter is not None:
+            self.limiter._adjust_tokens(actual_tokens - self.tokens)
+        self.tokens = actual_tokens
+
+    def release(self, error: Exception = None):
+        """Free the slot; pass the request's error, if any, so 429s slow the endpoint down"""
+        if self.limiter is None:
+            return
+        limiter, self.limiter = self.limiter, None
+        limiter._release(rate_limited=error is not None and is_rate_limit_error(error),
+                         retry_after=retry_after_seconds(error) if error is not None else None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(exc)
+        return False
+
+
+class EndpointLimiter:
+    """
+    Admission control for one API endpoint
+
+    Requests wait for a concurrency slot and for room in the requests/min and
+    tokens/min buckets. The concurrency limit follows AIMD: it grows by one
+    after a full window of successful requests and halves on a 429, when new
+    requests are also held back for the Retry-After period. Batch requests only
+    start when no interactive request is waiting, and always leave one slot
+    free for interactive traffic.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, tokens_per_minute: float = None,
+                 max_concurrency: int = 16, min_concurrency: int = 1):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.counters = {"admitted": 0, "rate_limited": 0, "waited_seconds": 0.0}
+        self._waiting = {INTERACTIVE: 0, BATCH: 0}
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _slots(self, priority: int) -> int:
+        limit = int(self.limit)
+        if priority == BATCH and limit > 1:
+            return limit - 1
+        return limit
+
+    def _delay(self, priority: int, tokens: float, now: float) -> Optional[float]:
+        """Seconds to wait before this request may start, or None to wait for a release"""
+        if priority == BATCH and self._waiting[INTERACTIVE]:
+            return None
+        if self.active >= self._slots(priority):
+            return None
+        delay = max(self._paused_until - now, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        return delay
+
+    def acquire(self, tokens: float = 0, priority: int = None) -> Permit:
+        """
+        Block until the request may be sent
+
+        Args:
+            tokens: Estimated tokens (prompt + max completion) the request uses
+            priority: INTERACTIVE or BATCH (default: the current request_priority)
+
+        Returns:
+            Permit, to be used as a context manager around the API call
+        """
+        priority = _priority.get() if priority is None else priority
+        started = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = self._delay(priority, tokens, now)
+                    if delay == 0:
+                        break
+                    # Re-check periodically: buckets refill without a notify
+                    self._cond.wait(timeout=min(delay, 1.0) if delay is not None else 1.0)
+            finally:
+                self._waiting[priority] -= 1
+            self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+            self.active += 1
+            self.counters["admitted"] += 1
+            self.counters["waited_seconds"] += time.monotonic() - started
+        return Permit(self, tokens)
+
+    def _adjust_tokens(self, delta: float):
+        if self.tokens is not None:
+            with self._cond:
+                self.tokens.take(delta)
+
+    def _release(self, rate_limited: bool, retry_after: Optional[float]):
+        with self._cond:
+            self.active -= 1
+            if rate_limited:
+                self.counters["rate_limited"] += 1
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                pause = retry_after if retry_after is not None else 1.0
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                logger.warning(f"Rate limited on {self.name}: concurrency limit now {int(self.limit)}, "
+                               f"pausing {pause:.1f}s")
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self.counters, "waited_seconds": round(self.counters["waited_seconds"], 3),
+                    "concurrency_limit": int(self.limit), "active": self.active}
+
+
+class RateLimiter:
+    """Per-endpoint limiters shared by every component in the process"""
+
+    def __init__(self, limits: Dict[str, dict] = None):
+        """
+        Args:
+            limits: Endpoint name -> EndpointLimiter keyword arguments, merged
+                over DEFAULT_LIMITS
+        """
+        self._limits = {name: dict(settings) for name, settings in DEFAULT_LIMITS.items()}
+        for name, settings in (limits or {}).items():
+            self._limits.setdefault(name, {}).update(settings)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def endpoint(self, name: str) -> EndpointLimiter:
+        with self._lock:
+            if name not in self._endpoints:
+                self._endpoints[name] = EndpointLimiter(name, **self._limits[name])
+            return self._endpoints[name]
+
+    def acquire(self, name: str, tokens: float = 0, priority: int = None) -> Permit:
+        """Shorthand for endpoint(name).acquire(...)"""
+        return self.endpoint(name).acquire(tokens, priority)
+
+    def stats(self) -> dict:
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        return {name: limiter.stats() for name, limiter in endpoints.items()}
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The process-wide limiter used by components that are not given their own"""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
+
+
+def configure_rate_limits(limits: Dict[str, dict]) -> RateLimiter:
+    """Replace the process-wide limiter; call before creating components"""
+    global _default_limiter
+    with _default_lock:
+        _default_limiter = RateLimiter(limits)
+        return _default_limiter
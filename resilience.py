@@ -0,0 +1,350 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+
+from rate_limit import is_rate_limit_error, retry_after_seconds
+
+logger = logging.getLogger("vocAIyze.Resilience")
+
+T = TypeVar("T")
+
+# Error classes
+RETRY = "retry"
+RATE_LIMITED = "rate_limited"
+FATAL = "fatal"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while an endpoint's circuit is open"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call's deadline passes before it could succeed"""
+
+
+def classify_error(e: Exception) -> str:
+    """
+    Decide whether a failed API call is worth retrying
+
+    Returns:
+        RATE_LIMITED for 429s, RETRY for timeouts, connection errors and 5xx
+        responses, FATAL for everything else (bad requests, auth, missing files)
+    """
+    if is_rate_limit_error(e):
+        return RATE_LIMITED
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError,
+                      httpx.TimeoutException, httpx.NetworkError, ConnectionError, TimeoutError)):
+        return RETRY
+    status = getattr(e, "status_code", None)
+    if isinstance(status, int) and (status >= 500 or status in (408, 409)):
+        return RETRY
+    return FATAL
+
+
+def is_timeout(e: Exception) -> bool:
+    return isinstance(e, (openai.APITimeoutError, httpx.TimeoutException, TimeoutError))
+
+
+def is_transient(e: Exception) -> bool:
+    """True for failures a caller may reasonably shrug off and try again later"""
+    return isinstance(e, (CircuitOpenError, DeadlineExceeded)) or classify_error(e) != FATAL
+
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint after repeated transient failures
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast for reset_timeout seconds; then a single trial call is let
+    through (half-open) and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_neutral(self):
+        """An outcome that says nothing about the endpoint's health; frees a half-open trial"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for picking the hedge delay"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class Resilience:
+    """
+    Retries, deadlines, circuit breaking and hedging for API calls
+
+    call() runs a function that performs one API request, given the seconds it
+    may take. Transient failures are retried with full-jitter exponential
+    backoff (429s honour Retry-After) until the attempts or the deadline run
+    out; failures that retrying cannot fix are raised at once. Each endpoint
+    has its own circuit breaker and latency history. Neither 429s nor timeouts
+    forced by a caller's deadline shorter than default_timeout count against
+    the breaker. With hedge=True, a
+    duplicate request is sent if the first is slower than the endpoint's
+    hedge_percentile latency, and whichever answers first wins.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0,
+                 default_timeout: float = 30.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 hedge_percentile: float = 95, hedge_min_samples: int = 20, max_hedge_workers: int = 8):
+        """
+        Args:
+            max_attempts: Attempts per call, including the first
+            base_delay: Backoff before the first retry, doubled each time
+            max_delay: Upper bound on a single backoff
+            default_timeout: Deadline in seconds for calls that do not pass one
+            failure_threshold: Consecutive failures that open an endpoint's circuit
+            reset_timeout: Seconds a circuit stays open before a trial call
+            hedge_percentile: Latency percentile after which a hedge is sent
+            hedge_min_samples: Latencies needed before hedging starts
+            max_hedge_workers: Threads available for hedged calls
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_timeout = default_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_hedge_workers = max_hedge_workers
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "hedges": 0, "hedge_wins": 0,
+                         "circuit_rejections": 0}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[endpoint]
+
+    def latencies(self, endpoint: str) -> LatencyTracker:
+        with self._lock:
+            if endpoint not in self._latencies:
+                self._latencies[endpoint] = LatencyTracker()
+            return self._latencies[endpoint]
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _backoff(self, attempt: int, e: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if classify_error(e) == RATE_LIMITED:
+            delay = max(delay, retry_after_seconds(e) or 0.0)
+        return delay
+
+    def call(self, endpoint: str, fn: Callable[[float], T], deadline: float = None,
+             hedge: bool = False, on_discard: Callable[[T], None] = None) -> T:
+        """
+        Run fn(timeout) with retries until it succeeds or the deadline passes
+
+        Args:
+            endpoint: Name used for the circuit breaker and latency history
+            fn: Performs one attempt; receives the seconds left before the deadline
+            deadline: time.monotonic() value by which the call must finish
+                (default: now + default_timeout)
+            hedge: Allow a duplicate attempt when the first one is slow. Only
+                for requests that are safe to send twice
+            on_discard: Called with the result of a hedged attempt that lost,
+                e.g. to close a stream
+
+        Returns:
+            fn's result
+
+        Raises:
+            CircuitOpenError: The endpoint's circuit is open
+            DeadlineExceeded: The deadline passed
+            The last error, when it is not retryable or the attempts ran out
+        """
+        budgeted = deadline is not None
+        deadline = deadline if deadline is not None else time.monotonic() + self.default_timeout
+        breaker = self.breaker(endpoint)
+        self._count("calls")
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{endpoint} call exceeded its deadline")
+            if not breaker.allow():
+                self._count("circuit_rejections")
+                raise CircuitOpenError(f"{endpoint} circuit is open")
+
+            started = time.monotonic()
+            try:
+                if hedge:
+                    result = self._hedged(endpoint, fn, remaining, on_discard)
+                else:
+                    result = fn(remaining)
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == FATAL:
+                    # The request was at fault, not the endpoint
+                    breaker.record_success()
+                    raise
+                if kind == RATE_LIMITED:
+                    # Quota pushback, handled by Retry-After and the rate limiter, not an outage
+                    breaker.record_neutral()
+                elif budgeted and remaining < self.default_timeout and is_timeout(e):
+                    # The caller's tight deadline cut the attempt short; the endpoint may be fine
+                    breaker.record_neutral()
+                else:
+                    breaker.record_failure()
+                attempt += 1
+                delay = self._backoff(attempt - 1, e)
+                if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    self._count("failures")
+                    logger.error(f"{endpoint} call failed after {attempt} attempt(s): {str(e)}")
+                    raise
+                self._count("retries")
+                logger.warning(f"{endpoint} call failed ({kind}), retrying in {delay:.2f}s: {str(e)}")
+                time.sleep(delay)
+                continue
+
+            breaker.record_success()
+            self.latencies(endpoint).add(time.monotonic() - started)
+            return result
+
+    def _hedged(self, endpoint: str, fn: Callable[[float], T], remaining: float,
+                on_discard: Callable[[T], None] = None) -> T:
+        tracker = self.latencies(endpoint)
+        hedge_after = tracker.percentile(self.hedge_percentile) if len(tracker) >= self.hedge_min_samples else None
+        if hedge_after is None or hedge_after >= remaining:
+            return fn(remaining)
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_hedge_workers, thread_name_prefix="hedge")
+        started = time.monotonic()
+        primary = self._pool.submit(fn, remaining)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        secondary = self._pool.submit(fn, remaining - (time.monotonic() - started))
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, remaining - (time.monotonic() - started)),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is None:
+                error = next(iter(done)).exception()
+                continue
+            if winner is secondary:
+                self._count("hedge_wins")
+            self._discard_when_done({primary, secondary} - {winner}, on_discard)
+            return winner.result()
+        # Out of time: attempts still running must be released whenever they land
+        self._discard_when_done(pending, on_discard)
+        if error is not None:
+            raise error
+        raise DeadlineExceeded(f"{endpoint} hedged call exceeded its deadline")
+
+    @staticmethod
+    def _discard_when_done(futures, on_discard: Callable[[T], None] = None):
+        """Synchronous HTTP calls cannot be cancelled; hand unused results to on_discard when they land"""
+        if on_discard is None:
+            return
+        for future in futures:
+            future.add_done_callback(lambda f: f.exception() is None and on_discard(f.result()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            breakers = {name: b.state for name, b in self._breakers.items()}
+        return {**counters, "circuits": breakers}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+_default_resilience = None
+_default_lock = threading.Lock()
+
+
+def get_resilience() -> Resilience:
+    """The process-wide resilience layer used by components that are not given their own"""
+    global _default_resilience
+    with _default_lock:
+        if _default_resilience is None:
+            _default_resilience = Resilience()
+        return _default_resilience
+
+
+def configure_resilience(**options) -> Resilience:
+    """Replace the process-wide resilience layer; call before creating components"""
+    global _default_resilience
+    with _default_lock:
+        _default_resilience = Resilience(**options)
+        return _default_resilience
@@ -0,0 +1,103 @@
+import threading
+
+
+class RingBuffer:
+    """
+    Preallocated single-writer byte ring with zero-copy reads
+
+    The storage is twice the capacity and every write is mirrored into both
+    halves, so any window of up to `capacity` bytes is contiguous and can be
+    returned as a memoryview without copying. Positions are absolute byte
+    offsets since creation; a view stays valid until the writer has advanced
+    `capacity` bytes past its start.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity: Number of most recent bytes retained
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._storage = bytearray(2 * capacity)
+        self._view = memoryview(self._storage)
+        self._written = 0
+        self._cond = threading.Condition()
+
+    @property
+    def written(self) -> int:
+        """Absolute position one past the last byte written"""
+        return self._written
+
+    @property
+    def oldest(self) -> int:
+        """Absolute position of the oldest byte still retained"""
+        return max(0, self._written - self.capacity)
+
+    def write(self, data) -> int:
+        """
+        Append bytes, overwriting the oldest data once full
+
+        Safe to call from an audio callback thread.
+
+        Args:
+            data: Bytes-like object
+
+        Returns:
+            Number of bytes written
+        """
+        data = memoryview(data).cast("B")
+        n = len(data)
+        if n > self.capacity:
+            # Only the newest `capacity` bytes can be kept
+            skipped = n - self.capacity
+            data = data[skipped:]
+            with self._cond:
+                self._written += skipped
+            n = self.capacity
+
+        cap = self.capacity
+        pos = self._written % cap
+        end = pos + n
+        self._view[pos:end] = data
+        # Mirror into the other half so every window stays contiguous
+        if end <= cap:
+            self._view[pos + cap:end + cap] = data
+        else:
+            head = cap - pos
+            self._view[pos + cap:2 * cap] = data[:head]
+            self._view[0:end - cap] = data[head:]
+
+        with self._cond:
+            self._written += n
+            self._cond.notify_all()
+        return n
+
+    def wait_for(self, position: int, timeout: float = None) -> bool:
+        """
+        Block until at least `position` bytes have been written
+
+        Returns:
+            True if the position was reached, False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._written >= position, timeout)
+
+    def view(self, start: int, end: int) -> memoryview:
+        """
+        Zero-copy view of the bytes between two absolute positions
+
+        Raises:
+            ValueError: If the range is not (or no longer) in the buffer
+        """
+        if end < start or end > self._written:
+            raise ValueError(f"Range {start}-{end} not written yet")
+        if start < self.oldest:
+            raise ValueError(f"Range {start}-{end} has been overwritten")
+        offset = start % self.capacity
+        return self._view[offset:offset + (end - start)]
+
+    def resize(self, capacity: int):
+        """Reallocate the storage, discarding its contents (writer must be idle)"""
+        self.__init__(capacity)
@@ -0,0 +1,421 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
+from conversation import ConversationMemory
+from llm import SYSTEM_PROMPT
+from metrics import FIRST_AUDIO, Metrics, get_metrics, turn_context
+from pipeline import EXIT_PHRASES, FILLER_PHRASE, RETRY_PROMPT
+from resilience import is_transient
+from stt import SAMPLE_WIDTH, SpeechToText, VoiceActivityDetector
+
+try:
+    import websockets  # Optional: only needed for --mode server
+except ImportError:
+    websockets = None
+
+logger = logging.getLogger("vocAIyze.Server")
+
+DEFAULT_INPUT_RATE = 16000
+# Input sample rates a client may declare; anything else is refused
+MIN_INPUT_RATE = 8000
+MAX_INPUT_RATE = 48000
+# WebSocket close code for "try again later"
+CLOSE_TRY_AGAIN_LATER = 1013
+
+# Marks the end of a stream on every queue
+_END = object()
+
+
+class Endpointer:
+    """
+    Split a stream of 16-bit mono PCM into utterances
+
+    Incoming audio is cut into fixed frames for the VoiceActivityDetector, so
+    detection does not depend on how the client sizes its messages. An
+    utterance starts at the first speech frame (plus a little pre-roll) and
+    ends after trailing silence or at the maximum length.
+    """
+
+    def __init__(self, sample_rate: int = DEFAULT_INPUT_RATE, detector: VoiceActivityDetector = None,
+                 silence_duration: float = 0.8, preroll_duration: float = 0.3, max_duration: float = 15.0,
+                 frame_duration: float = 0.02):
+        self.sample_rate = sample_rate
+        self.detector = detector or VoiceActivityDetector()
+        self.frame_bytes = int(sample_rate * frame_duration) * SAMPLE_WIDTH
+        # feed() would never consume an empty frame
+        assert self.frame_bytes > 0, f"sample_rate {sample_rate} is too low for {frame_duration}s frames"
+        self.silence_frames = max(1, int(silence_duration / frame_duration))
+        self.max_bytes = int(sample_rate * max_duration) * SAMPLE_WIDTH
+        self._preroll = deque(maxlen=max(1, int(preroll_duration / frame_duration)))
+        self._pending = bytearray()
+        self._utterance = None
+        self._silent = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Add audio
+
+        Returns:
+            Utterances completed by this audio, oldest first
+        """
+        self._pending += data
+        completed = []
+        while len(self._pending) >= self.frame_bytes:
+            frame = bytes(self._pending[:self.frame_bytes])
+            del self._pending[:self.frame_bytes]
+            speech = self.detector.is_speech(frame)
+            if self._utterance is None:
+                if not speech:
+                    self._preroll.append(frame)
+                    continue
+                self._utterance = bytearray(b"".join(self._preroll))
+                self._preroll.clear()
+                self._silent = 0
+            self._utterance += frame
+            self._silent = 0 if speech else self._silent + 1
+            if self._silent >= self.silence_frames or len(self._utterance) >= self.max_bytes:
+                completed.append(self.flush())
+        return completed
+
+    def flush(self) -> Optional[bytes]:
+        """End the current utterance now (e.g. push-to-talk released); None if there is none"""
+        utterance, self._utterance = self._utterance, None
+        self._silent = 0
+        return bytes(utterance) if utterance else None
+
+
+class VoiceSession:
+    """
+    One caller's conversation, run as asyncio tasks on the server's event loop
+
+    A receiver splits incoming audio into utterances, a turn worker runs each
+    one through STT, the LLM and TTS, and a sender writes results back. The
+    stages talk through bounded queues, so a caller who speaks faster than
+    replies are produced, or reads audio slower than it is synthesized, is
+    held back instead of growing memory. Blocking component calls run on the
+    server's shared thread pool.
+
+    Protocol, client to server:
+        binary: 16-bit mono PCM at the session's sample rate
+        {"type": "start", "sample_rate": 16000}: optional, before any audio;
+            rates from 8000 to 48000 are accepted
+        {"type": "end"}: end the current utterance without waiting for silence
+        {"type": "stop"}: end the session
+
+    Server to client:
+        {"type": "session", "session_id": ...}
+        {"type": "transcript", "turn": n, "text": ...}
+        {"type": "reply", "turn": n, "text": ...}: one sentence, followed by its audio
+        binary: 24 kHz 16-bit mono PCM of the reply
+        {"type": "audio_end", "turn": n}: the turn's reply is complete
+        {"type": "error", "message": ...}
+    """
+
+    def __init__(self, server: "VoiceServer", websocket, session_id: str = None):
+        self.server = server
+        self.websocket = websocket
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.sample_rate = DEFAULT_INPUT_RATE
+        self.endpointer = self._endpointer()
+        self.memory = ConversationMemory(SYSTEM_PROMPT, max_tokens=server.history_tokens,
+                                         summarizer=server.llm.summarize_conversation)
+        self.utterances = asyncio.Queue(maxsize=server.queue_size)
+        self.outbound = asyncio.Queue(maxsize=server.outbound_size)
+        self.turns = 0
+        self._transcribed_at = None  # Set until the current turn's first audio is sent
+
+    def _endpointer(self) -> Endpointer:
+        # Same endpointing settings as local microphone capture
+        stt = self.server.stt
+        return Endpointer(self.sample_rate, silence_duration=stt.vad_silence_duration,
+                          preroll_duration=stt.vad_preroll_duration, max_duration=stt.vad_max_duration)
+
+    async def _in_thread(self, fn: Callable, *args, **kwargs):
+        """Run a blocking call on the shared pool, keeping this session's metric tags"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, functools.partial(fn, *args, **kwargs))
+        return await loop.run_in_executor(self.server.executor, call)
+
+    async def _iterate(self, make_iterator: Callable[[], Iterator], buffer: int = 4) -> AsyncIterator:
+        """Consume a blocking iterator on the shared pool, at most `buffer` items ahead"""
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue(maxsize=buffer)
+        abandoned = threading.Event()
+
+        def pump():
+            try:
+                for item in make_iterator():
+                    if abandoned.is_set():
+                        return
+                    asyncio.run_coroutine_threadsafe(items.put(item), loop).result()
+            finally:
+                if not abandoned.is_set():
+                    asyncio.run_coroutine_threadsafe(items.put(_END), loop).result()
+
+        pumping = asyncio.ensure_future(self._in_thread(pump))
+        try:
+            while True:
+                item = await items.get()
+                if item is _END:
+                    break
+                yield item
+            await pumping  # Raises the iterator's error, if any
+        finally:
+            if not pumping.done():
+                abandoned.set()
+                # Unblock a put waiting for room so the worker thread can exit
+                while not items.empty():
+                    items.get_nowait()
+
+    async def _send(self, message):
+        await self.outbound.put(message)
+
+    async def _send_json(self, **payload):
+        await self._send(json.dumps(payload))
+
+    async def _receive_loop(self):
+        async for message in self.websocket:
+            if isinstance(message, (bytes, bytearray, memoryview)):
+                for utterance in self.endpointer.feed(bytes(message)):
+                    await self.utterances.put(utterance)
+                continue
+            try:
+                control = json.loads(message)
+            except ValueError:
+                control = None
+            if not isinstance(control, dict):
+                await self._send_json(type="error", message="Expected JSON control messages")
+                continue
+            kind = control.get("type")
+            if kind == "start":
+                rate = control.get("sample_rate", DEFAULT_INPUT_RATE)
+                valid = isinstance(rate, int) and not isinstance(rate, bool)
+                if not valid or not MIN_INPUT_RATE <= rate <= MAX_INPUT_RATE:
+                    await self._send_json(type="error", message=f"sample_rate must be an integer from "
+                                                                f"{MIN_INPUT_RATE} to {MAX_INPUT_RATE}")
+                    continue
+                self.sample_rate = rate
+                self.endpointer = self._endpointer()
+            elif kind == "end":
+                utterance = self.endpointer.flush()
+                if utterance:
+                    await self.utterances.put(utterance)
+            elif kind == "stop":
+                break
+
+    async def _send_loop(self):
+        while True:
+            message = await self.outbound.get()
+            if message is _END:
+                return
+            await self.websocket.send(message)
+
+    async def _speak(self, turn_id: int, text: str, deadline: float = None):
+        """Send one sentence and stream its speech; synthesis failures only lose the audio"""
+        await self._send_json(type="reply", turn=turn_id, text=text)
+        try:
+            async for chunk in self._iterate(lambda: self.server.tts.iter_speech(text, deadline=deadline), 16):
+                if self._transcribed_at is not None:
+                    self.server.metrics.observe(FIRST_AUDIO, time.monotonic() - self._transcribed_at)
+                    self._transcribed_at = None
+                await self._send(chunk)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            logger.warning(f"Session {self.session_id} turn {turn_id} sentence could not be synthesized: "
+                           f"{str(e)}")
+
+    async def _reply(self, turn_id: int, deadline: Optional[float]) -> str:
+        """Speak the reply sentence by sentence as it is generated, return the full reply"""
+        server = self.server
+        messages = self.memory.messages()
+        sentences = []
+        llm_deadline = deadline - server.tts_reserve if deadline is not None else None
+
+        async def speak_all(task: str, sentence_deadline: Optional[float], strict: bool):
+            async for sentence in self._iterate(lambda: server.llm.generate_sentences(
+                    messages, deadline=sentence_deadline, task=task, strict=strict)):
+                first = not sentences
+                sentences.append(sentence)
+                await self._speak(turn_id, sentence, deadline if first else None)
+
+        try:
+            await speak_all("chat", llm_deadline, llm_deadline is not None)
+        except Exception as e:
+            if sentences or not is_transient(e):
+                raise
+            logger.warning(f"Session {self.session_id} turn {turn_id} reply is over budget ({str(e)}), "
+                           f"using the fallback model")
+            await self._speak(turn_id, FILLER_PHRASE)
+            fallback_deadline = time.monotonic() + server.turn_budget if server.turn_budget else None
+            await speak_all("fast_chat", fallback_deadline, False)
+        return " ".join(sentences)
+
+    async def _turn(self, turn_id: int, pcm: bytes) -> bool:
+        """Answer one utterance; False once the caller has said goodbye"""
+        server = self.server
+        deadline = time.monotonic() + server.turn_budget if server.turn_budget else None
+        audio = SpeechToText.encode_wav(pcm, self.sample_rate)
+        try:
+            text = await self._in_thread(server.stt.speech_to_text, audio, deadline=deadline)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            logger.warning(f"Session {self.session_id} turn {turn_id} could not be transcribed: {str(e)}")
+            await self._speak(turn_id, RETRY_PROMPT)
+            await self._send_json(type="audio_end", turn=turn_id)
+            return True
+        self._transcribed_at = time.monotonic()
+        await self._send_json(type="transcript", turn=turn_id, text=text)
+
+        if text.lower().strip(" .!?") in server.exit_phrases:
+            await self._speak(turn_id, server.farewell)
+            await self._send_json(type="audio_end", turn=turn_id)
+            return False
+
+        self.memory.add("user", text)
+        reply = await self._reply(turn_id, deadline)
+        self.memory.add("assistant", reply)
+        await self._send_json(type="audio_end", turn=turn_id)
+        # Only counts tokens here; dropped turns are summarized on the memory's own thread
+        await self._in_thread(self.memory.trim)
+        return True
+
+    async def _turn_loop(self):
+        if self.server.greeting:
+            await self._speak(0, self.server.greeting)
+            await self._send_json(type="audio_end", turn=0)
+        while True:
+            pcm = await self.utterances.get()
+            self.turns += 1
+            with turn_context(self.session_id, self.turns):
+                if not await self._turn(self.turns, pcm):
+                    return
+
+    async def run(self):
+        """Serve the caller until they say goodbye, stop or disconnect"""
+        await self.websocket.send(json.dumps({"type": "session", "session_id": self.session_id}))
+        sender = asyncio.ensure_future(self._send_loop())
+        receiver = asyncio.ensure_future(self._receive_loop())
+        turns = asyncio.ensure_future(self._turn_loop())
+        try:
+            done, _ = await asyncio.wait({receiver, turns}, return_when=asyncio.FIRST_COMPLETED)
+            if turns in done:
+                error = turns.exception()
+                if error is not None:
+                    logger.error(f"Error in session {self.session_id}: {str(error)}")
+                    await self._send_json(type="error", message=str(error))
+                # Let the caller hear everything already queued, then hang up
+                await self._send(_END)
+                await sender
+            await self.websocket.close()
+        finally:
+            for task in (receiver, turns, sender):
+                task.cancel()
+            await asyncio.gather(receiver, turns, sender, return_exceptions=True)
+
+
+class VoiceServer:
+    """
+    Serve many concurrent callers over WebSocket
+
+    The LLM, TextToSpeech and SpeechToText components (and with them the HTTP
+    connection pool, caches, rate limiter and resilience layer) are created
+    once and shared by every session; each session only holds its own
+    conversation memory and queues. Callers beyond max_sessions are turned
+    away with close code 1013 (try again later).
+    """
+
+    def __init__(self, llm, tts, stt, max_sessions: int = 50, queue_size: int = 2,
+                 outbound_size: int = 64, history_tokens: int = 2000, turn_budget: Optional[float] = 4.0,
+                 tts_reserve: float = 1.0, max_workers: int = None, greeting: str = None,
+                 farewell: str = "Goodbye!", exit_phrases: List[str] = None, metrics: Metrics = None):
+        """
+        Args:
+            llm: Shared LLM
+            tts: Shared TextToSpeech
+            stt: Shared SpeechToText
+            max_sessions: Concurrent callers allowed
+            queue_size: Utterances a session may have waiting for an answer
+            outbound_size: Messages (mostly audio chunks) buffered per session
+                before synthesis waits for the caller to read
+            history_tokens: Token budget for each conversation's context
+            turn_budget: Seconds from end of speech to first reply audio (None: no budget)
+            tts_reserve: Part of the budget kept for synthesizing the first sentence
+            max_workers: Threads for blocking API calls, shared by all sessions
+                (default: three per session)
+            greeting: Spoken when a session starts (optional)
+            farewell: Spoken in reply to an exit phrase
+            exit_phrases: Utterances that end a session
+            metrics: Where stage timings are recorded (default: the process-wide Metrics)
+        """
+        self.llm = llm
+        self.tts = tts
+        self.stt = stt
+        self.max_sessions = max_sessions
+        self.queue_size = queue_size
+        self.outbound_size = outbound_size
+        self.history_tokens = history_tokens
+        self.turn_budget = turn_budget
+        self.tts_reserve = tts_reserve
+        self.greeting = greeting
+        self.farewell = farewell
+        self.exit_phrases = exit_phrases or EXIT_PHRASES
+        self.metrics = metrics or get_metrics()
+        # A turn has at most one STT, LLM or TTS call plus a streaming LLM call in flight
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or max_sessions * 3,
+                                           thread_name_prefix="session")
+        self.sessions = {}
+        self.counters = {"accepted": 0, "rejected": 0, "completed": 0}
+
+    async def handle(self, websocket, path: str = None):
+        """WebSocket connection handler (path is passed by older websockets releases)"""
+        if len(self.sessions) >= self.max_sessions:
+            self.counters["rejected"] += 1
+            logger.warning(f"Rejecting caller: {len(self.sessions)} sessions already active")
+            await websocket.send(json.dumps({"type": "error", "message": "Server busy, try again later"}))
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Server busy")
+            return
+
+        session = VoiceSession(self, websocket)
+        self.sessions[session.session_id] = session
+        self.counters["accepted"] += 1
+        logger.info(f"Session {session.session_id} started ({len(self.sessions)} active)")
+        try:
+            await session.run()
+        except Exception as e:
+            logger.error(f"Session {session.session_id} ended with an error: {str(e)}")
+        finally:
+            del self.sessions[session.session_id]
+            self.counters["completed"] += 1
+            logger.info(f"Session {session.session_id} ended after {session.turns} turn(s)")
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, stop: asyncio.Event = None):
+        """
+        Accept callers until stop is set (or forever)
+
+        Raises:
+            RuntimeError: The websockets package is not installed
+        """
+        if websockets is None:
+            raise RuntimeError("Server mode needs the websockets package: pip install vocAIyze[server]")
+        stop = stop or asyncio.Event()
+        # Audio frames are small; anything over 1 MiB is not a client of ours
+        async with websockets.serve(self.handle, host, port, max_size=2 ** 20):
+            logger.info(f"Listening on ws://{host}:{port} (max {self.max_sessions} sessions)")
+            await stop.wait()
+
+    def stats(self) -> dict:
+        return {**self.counters, "active": len(self.sessions)}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
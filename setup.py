@@ -9,7 +9,13 @@ setup(
         "pyaudio>=0.2.13",
         "pydub>=0.25.1",
         "python-dotenv>=1.0.0",
+        "numpy>=1.21.0",
     ],
+    extras_require={
+        "flac": ["soundfile>=0.12.0"],
+        "tokens": ["tiktoken>=0.5.0"],
+        "server": ["websockets>=10.0"],
+    },
     author="Romil Shah",
     author_email="your.email@example.com",
     description="Voice-powered AI assistant that leverages OpenAI for speech-to-text, language processing, and text-to-speech capabilities",
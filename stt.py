@@ -1,64 +1,453 @@
 import pyaudio
+import io
 import wave
 import os
+import math
+from collections import deque
+import numpy as np
 from openai import OpenAI
 import logging
 from pathlib import Path
 import tempfile
+import time
+from typing import BinaryIO, Optional, Tuple, Union
+from ring_buffer import RingBuffer
+from rate_limit import RateLimiter, get_rate_limiter
+from resilience import Resilience, get_resilience
+from metrics import CAPTURE, TRANSCRIPTION, UPLOAD_PREPARE, Metrics, get_metrics
+
+try:
+    import soundfile  # Optional: enables FLAC uploads
+except ImportError:
+    soundfile = None
 
 logger = logging.getLogger("vocAIyze.STT")
 
+# Microphone capture format: 16-bit mono at 44.1 kHz, read in 1024-sample chunks
+SAMPLE_RATE = 44100
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+CHUNK_SIZE = 1024
+
+# Whisper works at 16 kHz internally; anything above that is wasted upload
+UPLOAD_SAMPLE_RATE = 16000
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """
+    Resample a mono signal with an FFT-based band-limited resampler
+
+    Truncating the spectrum at the new Nyquist frequency doubles as the
+    anti-aliasing filter, so no separate low-pass pass is needed.
+
+    Args:
+        samples: 1-D float array
+        src_rate: Sample rate of samples
+        dst_rate: Desired sample rate
+
+    Returns:
+        Resampled float array
+    """
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    n_out = max(1, int(round(len(samples) * dst_rate / src_rate)))
+    spectrum = np.fft.rfft(samples)
+    keep = min(len(spectrum), n_out // 2 + 1)
+    return np.fft.irfft(spectrum[:keep], n_out) * (n_out / len(samples))
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int, threshold: float,
+                 frame_duration: float = 0.02, padding: float = 0.2) -> np.ndarray:
+    """
+    Drop leading and trailing frames whose RMS energy is below threshold
+
+    Args:
+        samples: 1-D float array in 16-bit sample units
+        sample_rate: Sample rate of samples
+        threshold: RMS energy separating speech from silence
+        frame_duration: Analysis frame length in seconds
+        padding: Audio kept on either side of the detected speech, in seconds
+
+    Returns:
+        Trimmed samples, or the input unchanged if no frame clears the threshold
+    """
+    frame = max(1, int(sample_rate * frame_duration))
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return samples
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(frames * frames, axis=1))
+    voiced = np.flatnonzero(energy >= threshold)
+    if len(voiced) == 0:
+        return samples
+    pad = int(sample_rate * padding)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+class VoiceActivityDetector:
+    """
+    Frame-level speech detector for 16-bit mono PCM chunks.
+
+    A frame counts as speech when its RMS energy clears the threshold, or when
+    it is moderately loud with a high zero-crossing rate (unvoiced consonants
+    such as "s" or "f"). The threshold adapts to the background noise floor,
+    which is tracked from frames classified as silence.
+    """
+
+    def __init__(self, energy_threshold: float = 300.0, zcr_threshold: float = 0.25,
+                 noise_ratio: float = 3.0, noise_adapt_rate: float = 0.05):
+        self.energy_threshold = energy_threshold
+        self.zcr_threshold = zcr_threshold
+        self.noise_ratio = noise_ratio
+        self.noise_adapt_rate = noise_adapt_rate
+        self.noise_floor = None
+
+    @staticmethod
+    def frame_features(data: bytes) -> Tuple[float, float]:
+        """
+        Compute RMS energy and zero-crossing rate of one frame
+
+        Args:
+            data: Raw 16-bit signed PCM samples
+
+        Returns:
+            Tuple of (rms_energy, zero_crossing_rate)
+        """
+        # Vectorized: this runs for every frame of every session, on the server's event loop
+        samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2')
+        n = len(samples)
+        if n < 2:
+            return 0.0, 0.0
+        wide = samples.astype(np.int64)
+        energy = math.sqrt(float(np.dot(wide, wide)) / n)
+        positive = samples >= 0
+        crossings = int(np.count_nonzero(positive[1:] != positive[:-1]))
+        return energy, crossings / (n - 1)
+
+    def threshold(self) -> float:
+        """Current energy threshold, raised above the observed noise floor"""
+        if self.noise_floor is None:
+            return self.energy_threshold
+        return max(self.energy_threshold, self.noise_floor * self.noise_ratio)
+
+    def is_speech(self, data: bytes) -> bool:
+        """Classify a frame as speech (True) or silence (False)"""
+        energy, zcr = self.frame_features(data)
+        threshold = self.threshold()
+        speech = energy >= threshold or (energy >= threshold / 2 and zcr >= self.zcr_threshold)
+        if not speech:
+            if self.noise_floor is None:
+                self.noise_floor = energy
+            else:
+                self.noise_floor += self.noise_adapt_rate * (energy - self.noise_floor)
+        return speech
+
+    def reset(self):
+        """Forget the tracked noise floor"""
+        self.noise_floor = None
+
+
+class Microphone:
+    """
+    Long-lived, callback-driven PortAudio input stream
+
+    Opening PortAudio and the input device is slow, so it is done once; between
+    recordings the stream is paused, which is cheap and stops stale audio from
+    piling up. PortAudio delivers audio on its own thread into a preallocated
+    RingBuffer, so capture never blocks the caller; reads return zero-copy
+    memoryviews into that buffer. Use as a context manager, or call close().
+    """
+
+    def __init__(self, rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+                 chunk: int = CHUNK_SIZE, buffer_seconds: float = 20.0, read_timeout: float = 2.0):
+        """
+        Args:
+            rate: Sample rate in Hz
+            channels: Number of input channels
+            chunk: Frames delivered per callback
+            buffer_seconds: Audio retained in the ring buffer
+            read_timeout: Seconds a read waits for audio before failing
+        """
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self.read_timeout = read_timeout
+        self.frame_bytes = SAMPLE_WIDTH * channels
+        self.buffer = RingBuffer(int(buffer_seconds * rate) * self.frame_bytes)
+        self.position = 0  # Absolute ring position of the next read
+        self.overruns = 0
+        self._audio = None
+        self._stream = None
+
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on the PortAudio thread: copy into the ring and return at once
+        self.buffer.write(in_data)
+        return None, pyaudio.paContinue
+
+    def open(self):
+        """Initialise PortAudio and open the input stream (paused)"""
+        if self._stream is not None:
+            return
+        self._audio = pyaudio.PyAudio()  # Create an interface to PortAudio
+        try:
+            self._stream = self._audio.open(format=pyaudio.paInt16,
+                                            channels=self.channels,
+                                            rate=self.rate,
+                                            frames_per_buffer=self.chunk,
+                                            input=True,
+                                            start=False,
+                                            stream_callback=self._on_audio)
+        except Exception:
+            self._audio.terminate()
+            self._audio = None
+            raise
+        logger.info("Microphone opened")
+
+    def ensure_capacity(self, seconds: float):
+        """Grow the ring buffer to hold at least `seconds` of audio (while paused)"""
+        needed = int(seconds * self.rate) * self.frame_bytes
+        if needed > self.buffer.capacity:
+            self.buffer.resize(needed)
+            self.position = 0
+
+    def start(self):
+        """Resume capturing, opening the device on first use"""
+        self.open()
+        # Audio from before this call is not part of the recording
+        self.position = self.buffer.written
+        if self._stream.is_stopped():
+            self._stream.start_stream()
+
+    def pause(self):
+        """Stop capturing but keep the device open"""
+        if self._stream is not None and not self._stream.is_stopped():
+            self._stream.stop_stream()
+
+    def read(self, frames: int) -> memoryview:
+        """
+        Return the next chunk of 16-bit PCM as a zero-copy view
+
+        The view is only valid until the ring buffer wraps past it.
+
+        Raises:
+            IOError: If no audio arrives within read_timeout
+        """
+        end = self.position + frames * self.frame_bytes
+        if not self.buffer.wait_for(end, self.read_timeout):
+            raise IOError("Microphone stopped delivering audio")
+        if self.position < self.buffer.oldest:
+            # The reader fell more than a buffer behind; skip to what is left
+            self.overruns += 1
+            logger.warning("Microphone ring buffer overrun")
+            self.position = self.buffer.oldest
+            end = self.position + frames * self.frame_bytes
+        data = self.buffer.view(self.position, end)
+        self.position = end
+        return data
+
+    def span(self, start: int, end: int) -> memoryview:
+        """Zero-copy view of everything captured between two read positions"""
+        return self.buffer.view(start, end)
+
+    @property
+    def is_open(self) -> bool:
+        return self._stream is not None
+
+    def close(self):
+        """Close the stream and terminate PortAudio"""
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._audio is not None:
+            self._audio.terminate()
+            self._audio = None
+            logger.info("Microphone closed")
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class SpeechToText:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client: OpenAI = None, rate_limiter: RateLimiter = None,
+                 resilience: Resilience = None, metrics: Metrics = None):
         self.api_key = api_key
-        self.client = OpenAI(api_key=api_key)
+        self.client = client or OpenAI(api_key=api_key)
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.resilience = resilience or get_resilience()
+        self.metrics = metrics or get_metrics()
         self.default_duration = 5
         self.model = "whisper-1"  # Default model
+        # The input device is opened on first use and kept open across turns
+        self.microphone = None
+        self.keep_device_open = True
+        # Upload preprocessing for WAV input: downmix, resample, trim, compress
+        self.preprocess = True
+        self.upload_sample_rate = UPLOAD_SAMPLE_RATE
+        self.upload_format = "flac"  # Falls back to "wav" without soundfile
+        self.trim_silence = True
+        # Voice-activity endpointing settings (used when record_audio(vad=True))
+        self.vad = VoiceActivityDetector()
+        self.vad_max_duration = 15      # Hard cap on a single utterance, in seconds
+        self.vad_silence_duration = 0.8  # Trailing silence that ends an utterance
+        self.vad_onset_duration = 0.05   # Speech needed before capture starts
+        self.vad_preroll_duration = 0.3  # Audio kept from before speech onset
         logger.info("SpeechToText initialized")
 
-    def record_audio(self, output_path: str, duration: int = None):
+    def _get_microphone(self) -> Microphone:
+        if self.microphone is None:
+            self.microphone = Microphone(buffer_seconds=max(self.vad_max_duration, self.default_duration) + 1)
+        return self.microphone
+
+    def _record_pcm(self, duration: float, vad: bool) -> Optional[memoryview]:
         """
-        Record audio from the microphone
-        
+        Capture raw PCM from the microphone
+
+        Returns:
+            Zero-copy view of 16-bit mono PCM at SAMPLE_RATE, valid until the
+            next recording, or None if vad=True and no speech was heard
+        """
+        chunk = CHUNK_SIZE  # Record in chunks of 1024 samples
+        fs = SAMPLE_RATE
+
+        microphone = self._get_microphone()
+        microphone.ensure_capacity(duration + 1)
+
+        if vad:
+            logger.info(f"Listening for speech (max {duration} seconds)...")
+        else:
+            logger.info(f"Recording for {duration} seconds...")
+        print('Recording...')
+
+        microphone.start()
+        try:
+            if vad:
+                span = self._capture_utterance(microphone, chunk, fs, duration)
+            else:
+                start = microphone.position
+                # Consume chunks for the specified duration
+                for _ in range(0, int(fs / chunk * duration)):
+                    microphone.read(chunk)
+                span = (start, microphone.position)
+        finally:
+            # Pause rather than close, so the next turn starts capturing immediately
+            microphone.pause()
+
+        print('Finished recording')
+        logger.info("Recording finished")
+        if span is None:
+            logger.info("No speech detected")
+            pcm = None
+        else:
+            pcm = microphone.span(*span)
+        if not self.keep_device_open:
+            # The view outlives the device but not a new one; hand back a copy
+            pcm = bytes(pcm) if pcm is not None else None
+            self.close()
+        return pcm
+
+    def open_microphone(self):
+        """Open the input device ahead of the first recording"""
+        self._get_microphone().open()
+
+    def close(self):
+        """Release the microphone"""
+        if self.microphone is not None:
+            self.microphone.close()
+            self.microphone = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def encode_wav(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+        """
+        Wrap raw 16-bit mono PCM in a WAV container, in memory
+
         Args:
-            output_path: Path to save the recorded audio
-            duration: Recording duration in seconds (default: self.default_duration)
+            pcm: Raw PCM samples
+            sample_rate: Sample rate of the PCM
+
+        Returns:
+            WAV file contents
+        """
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wf:
+            wf.setnchannels(CHANNELS)
+            wf.setsampwidth(SAMPLE_WIDTH)
+            wf.setframerate(sample_rate)
+            wf.writeframes(pcm)
+        return buffer.getvalue()
+
+    def capture_audio(self, duration: int = None, vad: bool = False,
+                      archive_path: str = None) -> Optional[bytes]:
+        """
+        Record audio from the microphone into memory
+
+        Args:
+            duration: Recording duration in seconds (default: self.default_duration).
+                With vad=True this is the maximum duration (default: self.vad_max_duration)
+            vad: Start on speech onset and stop after trailing silence
+            archive_path: Also save the recording to this path (optional)
+
+        Returns:
+            WAV-encoded audio ready for speech_to_text, or None if vad=True and
+            no speech was heard
         """
         if duration is None:
-            duration = self.default_duration
-            
-        chunk = 1024  # Record in chunks of 1024 samples
-        sample_format = pyaudio.paInt16  # 16 bits per sample
-        channels = 1
-        fs = 44100  # Record at 44100 samples per second
+            duration = self.vad_max_duration if vad else self.default_duration
 
         try:
-            p = pyaudio.PyAudio()  # Create an interface to PortAudio
-
-            logger.info(f"Recording for {duration} seconds...")
-            print('Recording...')
+            started = time.monotonic()
+            pcm = self._record_pcm(duration, vad)
+            if pcm is None:
+                return None
+            audio = self.encode_wav(pcm)
+            self.metrics.observe(CAPTURE, time.monotonic() - started)
 
-            stream = p.open(format=sample_format,
-                            channels=channels,
-                            rate=fs,
-                            frames_per_buffer=chunk,
-                            input=True)
+            if archive_path:
+                archive_dir = os.path.dirname(archive_path)
+                if archive_dir:
+                    os.makedirs(archive_dir, exist_ok=True)
+                with open(archive_path, 'wb') as f:
+                    f.write(audio)
+                logger.info(f"Audio archived to {archive_path}")
+            return audio
 
-            frames = []  # Initialize array to store frames
+        except Exception as e:
+            logger.error(f"Error in capture_audio: {str(e)}")
+            raise
 
-            # Store data in chunks for the specified duration
-            for _ in range(0, int(fs / chunk * duration)):
-                data = stream.read(chunk)
-                frames.append(data)
+    def record_audio(self, output_path: str, duration: int = None, vad: bool = False):
+        """
+        Record audio from the microphone
+        
+        Args:
+            output_path: Path to save the recorded audio
+            duration: Recording duration in seconds (default: self.default_duration).
+                With vad=True this is the maximum duration (default: self.vad_max_duration)
+            vad: Start on speech onset and stop after trailing silence instead of
+                recording for a fixed duration
 
-            # Stop and close the stream
-            stream.stop_stream()
-            stream.close()
-            # Terminate the PortAudio interface
-            p.terminate()
+        Returns:
+            The output path, or None if vad=True and no speech was heard
+        """
+        if duration is None:
+            duration = self.vad_max_duration if vad else self.default_duration
 
-            print('Finished recording')
-            logger.info("Recording finished")
+        try:
+            pcm = self._record_pcm(duration, vad)
+            if pcm is None:
+                return None
 
             # Save the recorded data as a WAV file
             output_dir = os.path.dirname(output_path)
@@ -66,10 +455,10 @@ class SpeechToText:
                 os.makedirs(output_dir)
                 
             wf = wave.open(output_path, 'wb')
-            wf.setnchannels(channels)
-            wf.setsampwidth(p.get_sample_size(sample_format))
-            wf.setframerate(fs)
-            wf.writeframes(b''.join(frames))
+            wf.setnchannels(CHANNELS)
+            wf.setsampwidth(SAMPLE_WIDTH)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(pcm)
             wf.close()
             
             logger.info(f"Audio saved to {output_path}")
@@ -79,33 +468,116 @@ class SpeechToText:
             logger.error(f"Error in record_audio: {str(e)}")
             raise
 
-    def speech_to_text(self, audio_path: str) -> str:
+    def _capture_utterance(self, microphone: Microphone, chunk: int, fs: int,
+                           max_duration: float) -> Optional[Tuple[int, int]]:
+        """
+        Read chunks from a started Microphone until the speaker stops
+
+        Capture begins once speech has been heard for vad_onset_duration (keeping
+        vad_preroll_duration of audio from before the onset) and ends after
+        vad_silence_duration of trailing silence or max_duration overall.
+
+        Returns:
+            (start, end) microphone positions of the utterance, or None if no
+            speech was heard
+        """
+        chunk_seconds = chunk / fs
+        max_chunks = int(max_duration / chunk_seconds)
+        onset_chunks = max(1, math.ceil(self.vad_onset_duration / chunk_seconds))
+        silence_chunks = max(1, math.ceil(self.vad_silence_duration / chunk_seconds))
+        # Start positions of the most recent chunks heard before the onset
+        preroll = deque(maxlen=max(onset_chunks, int(self.vad_preroll_duration / chunk_seconds)))
+
+        start = None
+        speech_run = 0
+        silence_run = 0
+        self.vad.reset()
+
+        for _ in range(max_chunks):
+            chunk_start = microphone.position
+            speech = self.vad.is_speech(microphone.read(chunk))
+
+            if start is None:
+                preroll.append(chunk_start)
+                speech_run = speech_run + 1 if speech else 0
+                if speech_run >= onset_chunks:
+                    start = preroll[0]
+                    logger.info("Speech onset detected")
+                continue
+
+            silence_run = 0 if speech else silence_run + 1
+            if silence_run >= silence_chunks:
+                logger.info("Trailing silence detected, ending capture")
+                break
+
+        if start is None:
+            return None
+        return start, microphone.position
+
+    def speech_to_text(self, audio: Union[str, Path, bytes, bytearray, memoryview, BinaryIO],
+                       deadline: float = None) -> str:
         """
         Convert speech audio to text using OpenAI's Whisper API
         
         Args:
-            audio_path: Path to the audio file
+            audio: Path to an audio file, or an in-memory WAV recording as
+                bytes/bytearray/memoryview or a binary file object
+            deadline: time.monotonic() value by which the transcript is needed (optional)
             
         Returns:
             Transcribed text
         """
         try:
-            logger.info(f"Transcribing audio from {audio_path}")
-            
-            # Check if file exists
-            if not os.path.exists(audio_path):
-                logger.error(f"Audio file not found: {audio_path}")
-                raise FileNotFoundError(f"Audio file not found: {audio_path}")
-                
-            # Check file extension
-            if not audio_path.lower().endswith(('.mp3', '.wav', '.m4a')):
-                logger.warning(f"Unsupported file format: {audio_path}")
-                
-            with open(audio_path, "rb") as audio_file:
-                response = self.client.audio.transcriptions.create(
-                    model=self.model,
-                    file=audio_file
-                )
+            if isinstance(audio, (str, Path)):
+                audio_path = str(audio)
+                logger.info(f"Transcribing audio from {audio_path}")
+
+                # Check if file exists
+                if not os.path.exists(audio_path):
+                    logger.error(f"Audio file not found: {audio_path}")
+                    raise FileNotFoundError(f"Audio file not found: {audio_path}")
+
+                # Check file extension
+                if not audio_path.lower().endswith(('.mp3', '.wav', '.m4a')):
+                    logger.warning(f"Unsupported file format: {audio_path}")
+
+                if not (self.preprocess and audio_path.lower().endswith('.wav')):
+                    def attempt(timeout: float):
+                        # Reopened per attempt so a retry uploads the whole file
+                        with open(audio_path, "rb") as audio_file, self.rate_limiter.acquire("transcription"):
+                            return self.client.audio.transcriptions.create(
+                                model=self.model,
+                                file=audio_file,
+                                timeout=timeout
+                            )
+
+                    with self.metrics.span(TRANSCRIPTION):
+                        response = self.resilience.call("transcription", attempt, deadline=deadline)
+                    logger.info("Transcription completed successfully")
+                    return response.text
+
+                # WAV files are read so they can be downsampled before upload
+                with open(audio_path, "rb") as audio_file:
+                    audio = audio_file.read()
+
+            if isinstance(audio, (bytearray, memoryview)):
+                audio = bytes(audio)
+            elif not isinstance(audio, bytes):
+                audio = audio.read()
+            with self.metrics.span(UPLOAD_PREPARE):
+                filename, payload = self.prepare_upload(audio)
+            logger.info(f"Uploading {len(payload)} bytes of audio")
+            # The filename tells the API which container the bytes are in
+            def attempt(timeout: float):
+                with self.rate_limiter.acquire("transcription"):
+                    return self.client.audio.transcriptions.create(
+                        model=self.model,
+                        file=(filename, payload),
+                        timeout=timeout
+                    )
+
+            with self.metrics.span(TRANSCRIPTION):
+                response = self.resilience.call("transcription", attempt, deadline=deadline)
                 
             logger.info("Transcription completed successfully")
             return response.text
@@ -114,6 +586,53 @@ class SpeechToText:
             logger.error(f"Error in speech_to_text: {str(e)}")
             raise
 
+    def prepare_upload(self, audio: bytes) -> Tuple[str, bytes]:
+        """
+        Shrink a WAV recording before upload
+
+        The audio is downmixed to mono, resampled to upload_sample_rate, trimmed
+        of leading/trailing silence and encoded as upload_format. Anything that
+        is not 16-bit PCM WAV is passed through unchanged.
+
+        Args:
+            audio: WAV file contents
+
+        Returns:
+            Tuple of (filename, payload) for the transcription request
+        """
+        if not self.preprocess or audio[:4] != b'RIFF':
+            return "speech.wav", audio
+
+        try:
+            with wave.open(io.BytesIO(audio), 'rb') as wf:
+                channels = wf.getnchannels()
+                sample_width = wf.getsampwidth()
+                rate = wf.getframerate()
+                pcm = wf.readframes(wf.getnframes())
+        except (wave.Error, EOFError) as e:
+            logger.warning(f"Could not parse WAV for preprocessing: {str(e)}")
+            return "speech.wav", audio
+        if sample_width != SAMPLE_WIDTH:
+            return "speech.wav", audio
+
+        samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32)
+        if channels > 1:
+            samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+        samples = resample(samples, rate, self.upload_sample_rate)
+        if self.trim_silence:
+            samples = trim_silence(samples, self.upload_sample_rate, self.vad.energy_threshold)
+        samples = np.clip(np.round(samples), -32768, 32767).astype('<i2')
+
+        if self.upload_format == "flac" and soundfile is not None:
+            buffer = io.BytesIO()
+            soundfile.write(buffer, samples, self.upload_sample_rate, format="FLAC", subtype="PCM_16")
+            filename, payload = "speech.flac", buffer.getvalue()
+        else:
+            filename, payload = "speech.wav", self.encode_wav(samples.tobytes(), self.upload_sample_rate)
+
+        logger.info(f"Upload preprocessed: {len(audio)} -> {len(payload)} bytes")
+        return filename, payload
+
     def set_model(self, model_name: str) -> bool:
         """
         Set the model for transcription
@@ -139,10 +658,9 @@ if __name__ == "__main__":
     stt = SpeechToText(api_key)
     
     # Test recording and transcription
-    output_path = "test_recording.wav"
     print("Recording 5 seconds of audio...")
-    stt.record_audio(output_path, 5)
+    audio = stt.capture_audio(5)
     
     print("Transcribing audio...")
-    transcription = stt.speech_to_text(output_path)
+    transcription = stt.speech_to_text(audio)
     print(f"Transcription: {transcription}")
\ No newline at end of file
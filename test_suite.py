@@ -1,9 +1,39 @@
 import unittest
+import io
+import json
 import os
+import wave
+import math
+import tempfile
+import time
+from array import array
+import numpy as np
 from unittest.mock import patch, MagicMock, mock_open
-from llm import LLM
+from llm import LLM, ModelRoute
 from tts import TextToSpeech
-from stt import SpeechToText
+from stt import SpeechToText, VoiceActivityDetector
+from pipeline import ConversationPipeline, FILLER_PHRASE, RETRY_PROMPT
+from tts_cache import TTSCache
+from ring_buffer import RingBuffer
+from clients import create_openai_client
+from llm_cache import ResponseCache
+from kb_index import KnowledgeIndex, tokenize
+from kb_store import KnowledgeBaseStore
+from kb_embeddings import HashingEmbedder, VectorIndex
+from conversation import ConversationMemory, count_tokens
+from batch import BatchRunner
+from rate_limit import BATCH, INTERACTIVE, EndpointLimiter, RateLimiter
+from resilience import CircuitOpenError, DeadlineExceeded, Resilience
+from benchmark import SPEECH_TO_FIRST_AUDIO, run_benchmark
+from fake_openai_server import EndpointProfile, Latency
+from server import Endpointer, VoiceServer
+from metrics import LLM_FIRST_TOKEN, LLM_TOTAL, Metrics, MetricsExporter, turn_context
+from prefilter import LexicalPrefilter, load_lexicon
+import threading
+import asyncio
+import httpx
+import openai
+
 
 class TestLLM(unittest.TestCase):
 
@@ -45,6 +75,326 @@ class TestLLM(unittest.TestCase):
         # Assert
         self.assertEqual(result, {"test": "knowledge"})
 
+    @patch('llm.OpenAI')
+    def test_generate_sentences_streams_complete_sentences(self, mock_openai):
+        def chunk(text):
+            c = MagicMock()
+            c.choices[0].delta.content = text
+            return c
+
+        tokens = ["Hello there", ", happy to help.", " Our plan costs", " 3.5 dollars", " a seat! Thanks"]
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.chat.completions.create.return_value = iter([chunk(t) for t in tokens])
+
+        llm = LLM("fake_api_key")
+        sentences = list(llm.generate_sentences("price?", min_length=10))
+
+        self.assertEqual(sentences, ["Hello there, happy to help.",
+                                     "Our plan costs 3.5 dollars a seat!", "Thanks"])
+        self.assertTrue(mock_client.chat.completions.create.call_args[1]["stream"])
+
+    @patch('llm.OpenAI')
+    def test_generate_served_from_cache(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.chat.completions.create.return_value.choices[0].message.content = "no"
+
+        llm = LLM("fake_api_key", cache=ResponseCache())
+        llm.generate("Is this a question?", temperature=0)
+        llm.generate("Is this a question?", temperature=0)
+        llm.generate("Tell me a story")  # Sampled at 0.7: not cached
+        llm.generate("Tell me a story")
+
+        self.assertEqual(mock_client.chat.completions.create.call_count, 3)
+        stats = llm.cache.stats()
+        self.assertEqual(stats["memory_hits"], 1)
+        self.assertEqual(stats["skipped"], 2)
+
+    @patch('llm.OpenAI')
+    def test_compliance_checks_share_one_analysis_call(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.chat.completions.create.return_value.choices[0].message.content = json.dumps({
+            "topics": ["pricing"],
+            "sentiment": "positive",
+            "action_items": ["Send the contract"],
+            "unreliable_promises": {"detected": True, "quotes": ["guaranteed 300% ROI"]},
+            "exaggerations": {"detected": False, "quotes": []}
+        })
+        text = "We guarantee a 300% ROI. I'll send the contract tomorrow."
+
+        llm = LLM("fake_api_key")
+        self.assertEqual(llm.analyze_text(text)["topics"], ["pricing"])
+        self.assertTrue(llm.detect_unreliable_promises(text))
+        self.assertFalse(llm.detect_exaggerations(text))
+        self.assertEqual(llm.summarize_todos(text), ["Send the contract"])
+
+        mock_client.chat.completions.create.assert_called_once()
+        response_format = mock_client.chat.completions.create.call_args[1]["response_format"]
+        self.assertTrue(response_format["json_schema"]["strict"])
+
+    @patch('llm.OpenAI')
+    def test_detectors_use_single_token_cheap_route(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.chat.completions.create.return_value.choices[0].message.content = "Yes"
+
+        llm = LLM("fake_api_key", routes={"classify": ModelRoute("gpt-4o-mini", 1, 0)})
+        self.assertTrue(llm.detect_exaggerations("This is the best product in the universe!"))
+
+        kwargs = mock_client.chat.completions.create.call_args[1]
+        self.assertEqual(kwargs["model"], "gpt-4o-mini")
+        self.assertEqual(kwargs["max_tokens"], 1)
+        self.assertEqual(kwargs["temperature"], 0)
+
+        llm.generate("Hello")
+        self.assertEqual(mock_client.chat.completions.create.call_args[1]["model"], "gpt-4")
+
+    @patch('llm.tiktoken')
+    @patch('llm.OpenAI')
+    def test_unavailable_tokenizer_leaves_answers_unconstrained(self, mock_openai, mock_tiktoken):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.chat.completions.create.return_value.choices[0].message.content = "Yes"
+        mock_tiktoken.encoding_for_model.side_effect = ConnectionError("offline")
+
+        llm = LLM("fake_api_key")
+        self.assertTrue(llm.classify("Is this a question?", "Is it?"))
+        self.assertTrue(llm.classify("Is this a question?", "Really?"))
+
+        self.assertNotIn("logit_bias", mock_client.chat.completions.create.call_args[1])
+        self.assertEqual(mock_tiktoken.encoding_for_model.call_count, 1)
+
+    @patch('llm.OpenAI')
+    def test_prefilter_skips_clean_text_and_sends_only_spans(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.chat.completions.create.return_value.choices[0].message.content = "yes"
+
+        llm = LLM("fake_api_key")
+        self.assertFalse(llm.detect_unreliable_promises("Let's review the proposal on Tuesday."))
+        mock_client.chat.completions.create.assert_not_called()
+
+        text = "Thanks for your time today. Our onboarding takes two weeks. We guarantee you will double your revenue."
+        self.assertTrue(llm.detect_unreliable_promises(text))
+        sent = mock_client.chat.completions.create.call_args[1]["messages"][-1]["content"]
+        self.assertIn("We guarantee you will double your revenue.", sent)
+        self.assertNotIn("onboarding", sent)
+
+        stats = llm.prefilter.stats()["unreliable_promises"]
+        self.assertEqual((stats["checked"], stats["shortcut"], stats["escalated"]), (2, 1, 1))
+
+    @patch('llm.OpenAI')
+    def test_partial_lexicon_keeps_default_categories(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.chat.completions.create.return_value.choices[0].message.content = "yes"
+
+        with tempfile.TemporaryDirectory() as lexicon_dir:
+            path = os.path.join(lexicon_dir, "lexicon.json")
+            with open(path, "w") as f:
+                json.dump({"exaggerations": ["mind-blowing"]}, f)
+            llm = LLM("fake_api_key", prefilter=LexicalPrefilter(load_lexicon(path)))
+
+        self.assertTrue(llm.detect_exaggerations("The results are mind-blowing."))
+        self.assertFalse(llm.detect_exaggerations("This is the best plan."))
+        self.assertTrue(llm.detect_unreliable_promises("We guarantee you will double your revenue."))
+
+    @patch('llm.OpenAI')
+    def test_neutral_transcript_skips_the_model(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        transcript = ("Thanks everyone for joining. We always send the agenda the day before, and I never want "
+                      "to waste your time. What is the best time for a follow-up? Have you ever used a CRM? "
+                      "I can send the proposal by next week.")
+
+        llm = LLM("fake_api_key")
+        self.assertFalse(llm.detect_exaggerations(transcript))
+        self.assertFalse(llm.detect_unreliable_promises(transcript))
+        mock_client.chat.completions.create.assert_not_called()
+
+        # Empty phrases in a custom lexicon are skipped rather than matching everything
+        prefilter = LexicalPrefilter({"exaggerations": ["", "  ", "re:", "mind-blowing"]})
+        self.assertEqual(prefilter.candidates("exaggerations", transcript), [])
+
+    @patch('llm.OpenAI')
+    def test_query_knowledge_base_ranks_locally(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+
+        llm = LLM("fake_api_key")
+        llm.knowledge_base = {
+            "pricing_discussions": "Focus on value before discussing price.",
+            "finding_leads": "Use LinkedIn Sales Navigator to find targeted leads.",
+            "remote_meetings": "Send an agenda in advance of the video call."
+        }
+        llm.kb_index = KnowledgeIndex(llm.knowledge_base)
+
+        results = llm.search_knowledge_base("How should I find new leads?")
+        self.assertEqual(results[0][0], "finding_leads")
+        self.assertGreater(results[0][2], 0)
+        self.assertEqual(llm.query_knowledge_base("The client thinks our price is too high"),
+                         "Focus on value before discussing price.")
+        self.assertIn("don't have specific information", llm.query_knowledge_base("zebra migration"))
+        mock_client.chat.completions.create.assert_not_called()
+        self.assertEqual(tokenize("pricing"), tokenize("price"))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_disk_tier_survives_restart_and_expires(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, "responses.sqlite")
+            key = ResponseCache.make_key("gpt-4", [{"role": "user", "content": "hi"}], 0, 10)
+
+            cache = ResponseCache(disk_path=path)
+            cache.put(key, "hello")
+            cache.close()
+
+            cache = ResponseCache(disk_path=path)
+            self.assertEqual(cache.get(key), "hello")
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            cache.close()
+
+            cache = ResponseCache(disk_path=path, ttl=0)
+            with patch('llm_cache.time.time', return_value=time.time() + 1):
+                self.assertIsNone(cache.get(key))
+            self.assertEqual(cache.stats()["expirations"], 1)
+            cache.close()
+
+    def test_disk_tier_is_trimmed_every_few_puts(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResponseCache(max_entries=1, disk_path=os.path.join(cache_dir, "responses.sqlite"),
+                                  disk_max_entries=3, disk_sweep_interval=4)
+            for i in range(7):
+                cache.put(f"k{i}", str(i))
+            # Swept at the fourth put; the three since wait for the next sweep
+            self.assertEqual(cache._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0], 6)
+            cache.put("k7", "7")
+            self.assertEqual(cache._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0], 3)
+            self.assertIsNone(cache.get("k0"))
+            self.assertEqual(cache.get("k7"), "7")
+            plan = cache._db.execute("EXPLAIN QUERY PLAN DELETE FROM responses WHERE created_at < 0").fetchall()
+            self.assertIn("responses_created", str(plan))
+            cache.close()
+
+    def test_memory_tier_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a")
+        cache.put("c", "3")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+class TestKnowledgeBaseStore(unittest.TestCase):
+
+    def _write(self, path, entries):
+        with open(path, 'w') as f:
+            json.dump(entries, f)
+
+    def test_search_and_incremental_hot_reload(self):
+        with tempfile.TemporaryDirectory() as kb_dir:
+            source = os.path.join(kb_dir, "kb.json")
+            self._write(source, {"pricing_discussions": "Focus on value before discussing price.",
+                                 "finding_leads": "Use LinkedIn to find targeted leads."})
+            store = KnowledgeBaseStore(source, check_interval=0)
+
+            self.assertEqual(store.search("how do I find leads")[0][0], "finding_leads")
+            self.assertEqual(len(store), 2)
+
+            self._write(source, {"pricing_discussions": "Lead with ROI when discussing price.",
+                                 "remote_meetings": "Send an agenda before the video call."})
+            os.utime(source, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+            store.search("video call agenda")  # Notices the change and reloads in the background
+            store.wait_for_reload(5)
+
+            self.assertEqual(store.search("video call agenda")[0][0], "remote_meetings")
+            self.assertNotIn("finding_leads", store)
+            self.assertEqual(store["pricing_discussions"], "Lead with ROI when discussing price.")
+            self.assertEqual(store.sync(), (0, 0, 0))
+            store.close()
+
+
+class TestVectorIndex(unittest.TestCase):
+
+    def test_incremental_update_and_shared_mapping(self):
+        entries = {"pricing_discussions": "Focus on value before discussing price.",
+                   "finding_leads": "Use LinkedIn to find targeted leads.",
+                   "remote_meetings": "Send an agenda before the video call."}
+        with tempfile.TemporaryDirectory() as vec_dir:
+            embedder = MagicMock(wraps=HashingEmbedder(dim=64))
+            embedder.name, embedder.dim = "hashing-v2-64", 64
+            index = VectorIndex(vec_dir, embedder)
+
+            self.assertEqual(index.update(entries), 3)
+            self.assertEqual(index.search("agenda for a video call", k=1)[0][0], "remote_meetings")
+            self.assertIsInstance(index.matrix, np.memmap)
+
+            entries["finding_leads"] = "Attend industry events to meet new leads."
+            self.assertEqual(index.update(entries), 1)  # Only the changed entry is embedded
+            self.assertEqual(index.update(entries), 0)
+
+            # A second process maps the published file without embedding anything
+            reader = VectorIndex(vec_dir, HashingEmbedder(dim=64))
+            self.assertEqual(len(reader), 3)
+            self.assertEqual(reader.search("industry events", k=1)[0][0], "finding_leads")
+
+    def test_concurrent_writers_leave_a_loadable_index(self):
+        with tempfile.TemporaryDirectory() as vec_dir:
+            def write(n):
+                index = VectorIndex(vec_dir, HashingEmbedder(dim=16))
+                for round_ in range(5):
+                    index.update({f"key_{n}_{i}": f"value {round_} {i}" for i in range(n + 1)})
+
+            errors = []
+            writing = threading.Event()
+
+            def read():
+                index = VectorIndex(vec_dir, HashingEmbedder(dim=16))
+                while writing.is_set():
+                    try:
+                        index.refresh()
+                    except Exception as e:  # e.g. the matrix was removed under the reader
+                        errors.append(e)
+
+            writing.set()
+            readers = [threading.Thread(target=read) for _ in range(2)]
+            threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+            for thread in readers + threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            writing.clear()
+            for thread in readers:
+                thread.join()
+            self.assertEqual(errors, [])
+
+            reader = VectorIndex(vec_dir, HashingEmbedder(dim=16))
+            self.assertEqual(reader.matrix.shape[0], len(reader))
+            self.assertEqual(len([n for n in os.listdir(vec_dir) if n.startswith("vectors-")]), 1)
+
+    @patch('llm.OpenAI')
+    def test_llm_semantic_search(self, mock_openai):
+        with tempfile.TemporaryDirectory() as vec_dir:
+            llm = LLM("fake_api_key", vector_index=VectorIndex(vec_dir, HashingEmbedder()))
+            llm.knowledge_base = {"handling_objections": "Acknowledge the concern before answering it.",
+                                  "closing_deals": "Summarize the agreed value and ask for the signature."}
+
+            self.assertEqual(llm.search_knowledge_base("the client raised an objection", k=1)[0][0],
+                             "handling_objections")
+            self.assertEqual(llm.query_knowledge_base("asking for the signature"),
+                             "Summarize the agreed value and ask for the signature.")
+
+            # In-place edits to a dict knowledge base are picked up
+            llm.knowledge_base["closing_deals"] = "Send the contract the same day."
+            self.assertEqual(llm.query_knowledge_base("send the contract"), "Send the contract the same day.")
+
+
 class TestTextToSpeech(unittest.TestCase):
 
     @patch('openai.OpenAI')
@@ -62,12 +412,50 @@ class TestTextToSpeech(unittest.TestCase):
         with patch('os.makedirs'):
             with patch.object(mock_response, 'stream_to_file') as mock_stream:
                 tts = TextToSpeech("fake_api_key")
+                tts.streaming_playback = False
                 tts.text_to_speech("Test text")
                 
                 # Assert
                 mock_client.audio.speech.create.assert_called_once()
                 mock_stream.assert_called_once()
 
+    @patch('tts.OpenAI')
+    @patch('pyaudio.PyAudio')
+    def test_text_to_speech_streams_pcm(self, mock_pyaudio, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        response = mock_client.audio.speech.with_streaming_response.create.return_value.__enter__.return_value
+        response.iter_bytes.return_value = [b"\x01\x02\x03", b"\x04\x05"]
+        mock_output = mock_pyaudio.return_value.open.return_value
+
+        tts = TextToSpeech("fake_api_key")
+        with patch('tts.AudioSegment.from_file') as mock_decode:
+            result = tts.text_to_speech("Test text")
+            mock_decode.assert_not_called()
+
+        self.assertIsNone(result)
+        kwargs = mock_client.audio.speech.with_streaming_response.create.call_args[1]
+        self.assertEqual(kwargs["response_format"], "pcm")
+        # Chunks are written as whole 16-bit samples
+        written = [c[0][0] for c in mock_output.write.call_args_list]
+        self.assertEqual(written, [b"\x01\x02", b"\x03\x04"])
+        mock_client.audio.speech.create.assert_not_called()
+
+    @patch('tts.OpenAI')
+    def test_stream_total_leaves_out_playback_time(self, mock_openai):
+        speech = mock_openai.return_value.audio.speech
+        response = speech.with_streaming_response.create.return_value.__enter__.return_value
+        response.iter_bytes.return_value = [b"\x01\x02", b"\x03\x04"]
+        metrics = Metrics()
+
+        tts = TextToSpeech("fake_api_key", metrics=metrics)
+        for _ in tts.iter_speech("Test text"):
+            time.sleep(0.2)  # Playing the chunk
+
+        totals = [span["seconds"] for span in metrics.spans if span["stage"] == "tts_total"]
+        self.assertEqual(len(totals), 1)
+        self.assertLess(totals[0], 0.2)
+
     def test_set_voice(self):
         with patch('openai.OpenAI'):
             tts = TextToSpeech("fake_api_key")
@@ -82,8 +470,66 @@ class TestTextToSpeech(unittest.TestCase):
             self.assertFalse(result)
             self.assertEqual(tts.current_voice, "nova")  # Should not change
 
+    @patch('tts.OpenAI')
+    def test_prewarmed_phrase_is_served_from_cache(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.audio.speech.create.return_value.content = b"\x00\x01" * 10
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            tts = TextToSpeech("fake_api_key", cache=TTSCache(cache_dir))
+            self.assertEqual(tts.prewarm(["Hello there."]), 1)
+            self.assertEqual(tts.prewarm(["Hello there."]), 0)
+
+            chunks = list(tts.iter_speech("Hello   there."))
+
+        self.assertEqual(b"".join(chunks), b"\x00\x01" * 10)
+        self.assertEqual(mock_client.audio.speech.create.call_count, 1)
+        mock_client.audio.speech.with_streaming_response.create.assert_not_called()
+        self.assertEqual(tts.cache.stats()["hits"], 1)
+
+
+class TestTTSCache(unittest.TestCase):
+
+    def test_lru_eviction_by_size(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TTSCache(cache_dir, max_bytes=25)
+            a, b, c = (cache.key("tts-1", "alloy", t, "pcm") for t in ("a", "b", "c"))
+            cache.put(a, b"x" * 10)
+            cache.put(b, b"y" * 10)
+            self.assertEqual(cache.get(a), b"x" * 10)  # a is now most recently used
+            cache.put(c, b"z" * 10)
+
+            self.assertIsNone(cache.get(b))
+            self.assertIn(a, cache)
+            self.assertIn(c, cache)
+            self.assertEqual(cache.evictions, 1)
+            self.assertAlmostEqual(cache.hit_ratio, 0.5)
+
+            # The index is rebuilt from disk
+            reopened = TTSCache(cache_dir, max_bytes=25)
+            self.assertEqual(reopened.get(c), b"z" * 10)
+
+    def test_key_depends_on_voice_and_normalized_text(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TTSCache(cache_dir)
+            self.assertEqual(cache.key("tts-1", "alloy", " Hi  there", "pcm"),
+                             cache.key("tts-1", "alloy", "Hi there", "pcm"))
+            self.assertNotEqual(cache.key("tts-1", "alloy", "Call the US office", "pcm"),
+                                cache.key("tts-1", "alloy", "Call the us office", "pcm"))
+            self.assertNotEqual(cache.key("tts-1", "alloy", "hi", "pcm"),
+                                cache.key("tts-1", "nova", "hi", "pcm"))
+
+
 class TestSpeechToText(unittest.TestCase):
 
+    def test_frame_features(self):
+        square = array('h', [1000, 1000, -1000, -1000] * 4).tobytes()
+        energy, zcr = VoiceActivityDetector.frame_features(memoryview(square + b"\x00"))
+        self.assertAlmostEqual(energy, 1000.0)
+        self.assertAlmostEqual(zcr, 7 / 15)
+        self.assertEqual(VoiceActivityDetector.frame_features(b"\x01\x00"), (0.0, 0.0))
+
     @patch('openai.OpenAI')
     def test_speech_to_text(self, mock_openai):
         # Setup
@@ -112,9 +558,7 @@ class TestSpeechToText(unittest.TestCase):
         mock_py_instance = MagicMock()
         mock_pyaudio.return_value = mock_py_instance
         
-        mock_stream = MagicMock()
-        mock_py_instance.open.return_value = mock_stream
-        mock_stream.read.return_value = b'audio data'
+        self._feed_microphone(mock_py_instance, [b'audio data!!'] * 8000)
         
         mock_wave_instance = MagicMock()
         mock_wave.return_value = mock_wave_instance
@@ -130,5 +574,826 @@ class TestSpeechToText(unittest.TestCase):
                 mock_py_instance.open.assert_called_once()
                 mock_wave_instance.writeframes.assert_called_once()
 
+    @staticmethod
+    def _feed_microphone(mock_py_instance, chunks):
+        """Deliver chunks through the stream callback whenever capture starts"""
+        mock_stream = MagicMock()
+        mock_py_instance.open.return_value = mock_stream
+        mock_stream.is_stopped.return_value = True
+
+        def start_stream():
+            callback = mock_py_instance.open.call_args[1]['stream_callback']
+            for data in chunks:
+                callback(data, len(data) // 2, None, 0)
+
+        mock_stream.start_stream.side_effect = start_stream
+        return mock_stream
+
+    @staticmethod
+    def _tone_chunk(amplitude, chunk=1024):
+        return array('h', [int(amplitude * math.sin(2 * math.pi * 440 * i / 44100))
+                           for i in range(chunk)]).tobytes()
+
+    @patch('openai.OpenAI')
+    @patch('pyaudio.PyAudio')
+    @patch('wave.open')
+    def test_record_audio_vad_stops_on_trailing_silence(self, mock_wave, mock_pyaudio, mock_openai):
+        silence = bytes(2048)
+        speech = self._tone_chunk(5000)
+        chunks = [silence] * 10 + [speech] * 20 + [silence] * 400
+
+        mock_py_instance = MagicMock()
+        mock_pyaudio.return_value = mock_py_instance
+        self._feed_microphone(mock_py_instance, chunks)
+        mock_wave_instance = MagicMock()
+        mock_wave.return_value = mock_wave_instance
+
+        stt = SpeechToText("fake_api_key")
+        result = stt.record_audio("test.wav", vad=True)
+
+        self.assertEqual(result, "test.wav")
+        written = bytes(mock_wave_instance.writeframes.call_args[0][0])
+        self.assertIn(speech * 20, written)
+        # Stops well before the recording cap once the trailing silence is heard
+        self.assertLess(len(written), 100 * 2048)
+
+    @patch('openai.OpenAI')
+    @patch('pyaudio.PyAudio')
+    @patch('wave.open')
+    def test_record_audio_vad_without_speech(self, mock_wave, mock_pyaudio, mock_openai):
+        mock_py_instance = MagicMock()
+        mock_pyaudio.return_value = mock_py_instance
+        self._feed_microphone(mock_py_instance, [bytes(2048)] * 50)
+
+        stt = SpeechToText("fake_api_key")
+        result = stt.record_audio("test.wav", duration=1, vad=True)
+
+        self.assertIsNone(result)
+        mock_wave.assert_not_called()
+
+    @patch('stt.OpenAI')
+    @patch('pyaudio.PyAudio')
+    def test_capture_audio_in_memory_round_trip(self, mock_pyaudio, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.audio.transcriptions.create.return_value.text = "hi"
+        self._feed_microphone(mock_pyaudio.return_value, [b'\x01\x00' * 1024] * 5)
+
+        stt = SpeechToText("fake_api_key")
+        stt.preprocess = False
+        with patch('builtins.open') as mock_file:
+            audio = stt.capture_audio(duration=0.1)
+            mock_file.assert_not_called()
+
+        self.assertTrue(audio.startswith(b'RIFF'))
+        self.assertEqual(stt.speech_to_text(memoryview(audio)), "hi")
+        name, body = mock_client.audio.transcriptions.create.call_args[1]["file"]
+        self.assertEqual(name, "speech.wav")
+        self.assertEqual(body, audio)
+
+    @patch('stt.OpenAI')
+    @patch('pyaudio.PyAudio')
+    def test_microphone_is_reused_across_recordings(self, mock_pyaudio, mock_openai):
+        mock_stream = self._feed_microphone(mock_pyaudio.return_value, [b'\x00\x00' * 1024] * 5)
+        mock_stream.is_stopped.side_effect = [True, False, True, False]
+
+        with SpeechToText("fake_api_key") as stt:
+            stt.capture_audio(duration=0.1)
+            stt.capture_audio(duration=0.1)
+
+        mock_pyaudio.assert_called_once()
+        mock_pyaudio.return_value.open.assert_called_once()
+        self.assertEqual(mock_stream.start_stream.call_count, 2)
+        mock_stream.close.assert_called_once()
+        mock_pyaudio.return_value.terminate.assert_called_once()
+
+    @patch('stt.OpenAI')
+    @patch('pyaudio.PyAudio')
+    def test_capture_returns_view_into_ring_buffer(self, mock_pyaudio, mock_openai):
+        chunks = [bytes([i]) * 2048 for i in range(5)]
+        self._feed_microphone(mock_pyaudio.return_value, chunks)
+
+        stt = SpeechToText("fake_api_key")
+        pcm = stt._record_pcm(duration=0.1, vad=False)
+
+        self.assertIsInstance(pcm, memoryview)
+        self.assertEqual(bytes(pcm), b"".join(chunks[:4]))
+        self.assertEqual(pcm.obj, stt.microphone.buffer._storage)
+
+    @patch('stt.OpenAI')
+    def test_prepare_upload_downsamples_and_trims(self, mock_openai):
+        fs = 44100
+        t_axis = np.arange(fs) / fs
+        tone = (8000 * np.sin(2 * np.pi * 300 * t_axis)).astype('<i2')
+        silence = np.zeros(fs, dtype='<i2')
+        pcm = np.concatenate([silence, tone, silence]).tobytes()
+
+        stt = SpeechToText("fake_api_key")
+        stt.upload_format = "wav"
+        filename, payload = stt.prepare_upload(SpeechToText.encode_wav(pcm, fs))
+
+        self.assertEqual(filename, "speech.wav")
+        with wave.open(io.BytesIO(payload), 'rb') as wf:
+            self.assertEqual(wf.getframerate(), 16000)
+            duration = wf.getnframes() / wf.getframerate()
+        # One second of speech plus padding, instead of three seconds at 44.1 kHz
+        self.assertLess(duration, 1.6)
+        self.assertGreater(duration, 0.9)
+        self.assertLess(len(payload) * 4, len(pcm))
+
+
+class TestSharedClient(unittest.TestCase):
+
+    def test_components_share_one_client(self):
+        client = create_openai_client("fake_api_key", max_connections=5, http2=False)
+        try:
+            components = [LLM("fake_api_key", client=client),
+                          TextToSpeech("fake_api_key", client=client),
+                          SpeechToText("fake_api_key", client=client)]
+            for component in components:
+                self.assertIs(component.client, client)
+        finally:
+            client.close()
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_wrapped_window_is_contiguous(self):
+        ring = RingBuffer(8)
+        ring.write(b"abcdef")
+        ring.write(b"ghij")  # wraps around, overwriting "ab"
+
+        self.assertEqual(bytes(ring.view(2, 10)), b"cdefghij")
+        self.assertEqual(ring.oldest, 2)
+        with self.assertRaises(ValueError):
+            ring.view(0, 4)
+
+    def test_wait_for_times_out(self):
+        ring = RingBuffer(4)
+        ring.write(b"ab")
+        self.assertTrue(ring.wait_for(2, timeout=0))
+        self.assertFalse(ring.wait_for(3, timeout=0.01))
+
+
+class TestConversationMemory(unittest.TestCase):
+
+    def test_trims_to_budget_and_summarizes_dropped_turns(self):
+        summarizer = MagicMock(side_effect=lambda summary, dropped: f"{len(dropped)} earlier messages")
+        memory = ConversationMemory("Be brief.", max_tokens=60, summarizer=summarizer)
+        for i in range(6):
+            memory.add("user", f"Question number {i} about the quarterly pricing proposal?")
+            memory.add("assistant", f"Answer number {i}.")
+            memory.trim()
+        self.assertTrue(memory.wait_for_summary(timeout=5))
+
+        messages = memory.messages()
+        self.assertEqual(messages[0], {"role": "system", "content": "Be brief."})
+        self.assertIn("earlier messages", messages[1]["content"])
+        self.assertEqual(messages[2]["role"], "user")
+        self.assertEqual(messages[-1]["content"], "Answer number 5.")
+        self.assertLessEqual(memory.token_count(), 60)
+        self.assertTrue(summarizer.called)
+
+    def test_fallback_summary_stays_within_budget(self):
+        memory = ConversationMemory("Be brief.", max_tokens=30, summary_max_tokens=10)
+        memory.add("user", "word " * 50)
+        memory.add("assistant", "Noted.")
+        memory.add("user", "Next?")
+        memory.trim()
+        self.assertLessEqual(count_tokens(memory.summary), 10)
+        self.assertEqual(memory.turns[-1]["content"], "Next?")
+
+    def test_trim_does_not_wait_for_the_summarizer(self):
+        release = threading.Event()
+
+        def summarizer(summary, dropped):
+            release.wait(5)
+            return "They asked about pricing."
+
+        memory = ConversationMemory("Be brief.", max_tokens=30, summarizer=summarizer)
+        memory.add("user", "What does the premium plan cost for a team of twenty people?")
+        memory.add("assistant", "It is forty dollars per seat each month.")
+        memory.add("user", "Next?")
+        started = time.monotonic()
+        self.assertEqual(memory.trim(), 2)
+        self.assertLess(time.monotonic() - started, 1)
+        # Until the summary arrives the dropped turns stand in for it
+        self.assertIn("forty dollars", memory.summary)
+
+        release.set()
+        self.assertTrue(memory.wait_for_summary(timeout=5))
+        self.assertEqual(memory.summary, "They asked about pricing.")
+        self.assertEqual(memory.turns[-1]["content"], "Next?")
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def _write_records(self, path, count):
+        with open(path, 'w') as f:
+            for i in range(count):
+                f.write(json.dumps({"id": f"r{i}", "type": "generate", "prompt": f"prompt {i}"}) + "\n")
+            f.write("not json\n")
+
+    def test_results_streamed_and_errors_recorded(self):
+        llm = MagicMock()
+        llm.generate.side_effect = lambda prompt, **kwargs: prompt.upper()
+        with tempfile.TemporaryDirectory() as work_dir:
+            source, results = os.path.join(work_dir, "in.jsonl"), os.path.join(work_dir, "out.jsonl")
+            self._write_records(source, 20)
+
+            counters = BatchRunner(llm=llm, concurrency=4).run(source, results)
+
+            with open(results) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual((counters["processed"], counters["failed"]), (20, 1))
+            by_id = {row.get("id"): row for row in rows}
+            self.assertEqual(by_id["r7"]["result"], {"text": "PROMPT 7"})
+            self.assertFalse(by_id[21]["ok"])
+
+    def test_resumes_from_checkpoint(self):
+        llm = MagicMock()
+        llm.generate.return_value = "ok"
+        with tempfile.TemporaryDirectory() as work_dir:
+            source, results = os.path.join(work_dir, "in.jsonl"), os.path.join(work_dir, "out.jsonl")
+            self._write_records(source, 10)
+            with open(results + ".checkpoint", 'w') as f:
+                json.dump({"high_water": 6, "done": [8]}, f)
+
+            counters = BatchRunner(llm=llm, concurrency=2).run(source, results)
+
+            with open(results) as f:
+                lines = sorted(json.loads(line)["line"] for line in f)
+            self.assertEqual(lines, [7, 9, 10, 11])
+            self.assertEqual(counters["skipped"], 7)
+            with open(results + ".checkpoint") as f:
+                self.assertEqual(json.load(f), {"high_water": 11, "done": [], "retry": []})
+
+    @patch('llm.OpenAI')
+    def test_api_errors_are_recorded_as_failures(self, mock_openai):
+        mock_openai.return_value.chat.completions.create.side_effect = openai.APIConnectionError(
+            request=httpx.Request("POST", "https://x"))
+        llm = LLM("test_key", resilience=Resilience(max_attempts=1))
+        with tempfile.TemporaryDirectory() as work_dir:
+            source, results = os.path.join(work_dir, "in.jsonl"), os.path.join(work_dir, "out.jsonl")
+            with open(source, 'w') as f:
+                f.write(json.dumps({"id": "r0", "type": "generate", "prompt": "hello"}) + "\n")
+                f.write("not json\n")
+
+            counters = BatchRunner(llm=llm, concurrency=1).run(source, results)
+
+            with open(results) as f:
+                row = json.loads(f.readline())
+            self.assertFalse(row["ok"])
+            self.assertNotIn("result", row)
+            self.assertEqual((counters["processed"], counters["failed"]), (0, 2))
+            # The API failure is listed for retry so a rerun runs it again; the bad line is not
+            with open(results + ".checkpoint") as f:
+                self.assertEqual(json.load(f), {"high_water": 2, "done": [], "retry": [1]})
+
+    def test_transient_failure_does_not_hold_back_the_checkpoint(self):
+        def generate(prompt, **kwargs):
+            if prompt == "prompt 1":
+                raise openai.APIConnectionError(request=httpx.Request("POST", "https://x"))
+            return prompt.upper()
+        llm = MagicMock()
+        llm.generate.side_effect = generate
+        with tempfile.TemporaryDirectory() as work_dir:
+            source, results = os.path.join(work_dir, "in.jsonl"), os.path.join(work_dir, "out.jsonl")
+            self._write_records(source, 200)
+
+            BatchRunner(llm=llm, concurrency=4).run(source, results)
+            with open(results + ".checkpoint") as f:
+                self.assertEqual(json.load(f), {"high_water": 201, "done": [], "retry": [2]})
+
+            llm.generate.side_effect = lambda prompt, **kwargs: prompt.upper()
+            counters = BatchRunner(llm=llm, concurrency=4).run(source, results)
+            self.assertEqual((counters["processed"], counters["skipped"]), (1, 200))
+            with open(results + ".checkpoint") as f:
+                self.assertEqual(json.load(f), {"high_water": 201, "done": [], "retry": []})
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_interactive_requests_go_ahead_of_batch(self):
+        limiter = EndpointLimiter("chat", requests_per_minute=6000, max_concurrency=2)
+        batch_permit = limiter.acquire(priority=BATCH)
+        started = threading.Event()
+
+        def batch_worker():
+            with limiter.acquire(priority=BATCH):
+                started.set()
+
+        worker = threading.Thread(target=batch_worker, daemon=True)
+        worker.start()
+        # The last slot is kept for interactive traffic
+        interactive_permit = limiter.acquire(priority=INTERACTIVE)
+        with batch_permit:
+            pass
+        self.assertFalse(started.wait(0.2))
+        with interactive_permit:
+            pass
+        self.assertTrue(started.wait(2))
+
+    @patch('llm.OpenAI')
+    def test_rate_limit_response_halves_concurrency(self, mock_openai):
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        response = httpx.Response(429, headers={"retry-after": "0"},
+                                  request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        mock_client.chat.completions.create.side_effect = openai.RateLimitError("slow down", response=response,
+                                                                                body=None)
+        limiter = RateLimiter({"chat": {"max_concurrency": 8}})
+
+        llm = LLM("fake_api_key", rate_limiter=limiter, resilience=Resilience(max_attempts=1))
+        llm.generate("Hello")
+
+        stats = limiter.stats()["chat"]
+        self.assertEqual((stats["rate_limited"], stats["concurrency_limit"], stats["active"]), (1, 4, 0))
+
+    @patch('llm.OpenAI')
+    def test_stream_frees_its_slot_before_the_last_delta(self, mock_openai):
+        def chunk(text, finish_reason=None):
+            return MagicMock(choices=[MagicMock(delta=MagicMock(content=text), finish_reason=finish_reason)])
+        mock_openai.return_value.chat.completions.create.return_value = iter(
+            [chunk("Hi"), chunk(" there"), chunk(" friend."), chunk(None, "stop")])
+        limiter = RateLimiter({"chat": {"max_concurrency": 8}})
+
+        llm = LLM("fake_api_key", rate_limiter=limiter)
+        active = []
+        for delta in llm.generate_stream("Hello"):
+            active.append((delta, limiter.stats()["chat"]["active"]))
+
+        self.assertEqual(active, [("Hi", 1), (" there", 1), (" friend.", 0)])
+
+
+class TestResilience(unittest.TestCase):
+
+    def _timeout(self):
+        return openai.APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/audio/speech"))
+
+    def test_retries_transient_errors_and_opens_circuit(self):
+        resilience = Resilience(max_attempts=3, base_delay=0.001, failure_threshold=3, reset_timeout=60)
+        fn = MagicMock(side_effect=[self._timeout(), "ok"])
+        self.assertEqual(resilience.call("speech", fn), "ok")
+        self.assertEqual(fn.call_count, 2)
+
+        fatal = MagicMock(side_effect=ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            resilience.call("speech", fatal)
+        self.assertEqual(fatal.call_count, 1)
+
+        failing = MagicMock(side_effect=self._timeout())
+        with self.assertRaises(openai.APITimeoutError):
+            resilience.call("speech", failing)
+        with self.assertRaises(CircuitOpenError):
+            resilience.call("speech", failing)
+        self.assertEqual(failing.call_count, 3)
+
+    def test_rate_limits_do_not_open_the_circuit(self):
+        resilience = Resilience(max_attempts=4, base_delay=0.001, failure_threshold=2, reset_timeout=60)
+        response = httpx.Response(429, headers={"retry-after": "0"},
+                                  request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        limited = openai.RateLimitError("slow down", response=response, body=None)
+        fn = MagicMock(side_effect=[limited, limited, limited, "ok"])
+
+        self.assertEqual(resilience.call("chat", fn), "ok")
+        self.assertEqual(resilience.breaker("chat").state, "closed")
+        self.assertEqual(resilience.breaker("chat").failures, 0)
+
+    def test_slow_request_is_hedged(self):
+        resilience = Resilience(hedge_percentile=50, hedge_min_samples=5)
+        for _ in range(5):
+            resilience.latencies("chat").add(0.01)
+        calls = []
+        discarded = []
+
+        def fn(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "slow"
+            return "fast"
+
+        self.assertEqual(resilience.call("chat", fn, hedge=True, on_discard=discarded.append), "fast")
+        self.assertEqual(resilience.stats()["hedge_wins"], 1)
+        time.sleep(0.6)
+        self.assertEqual(discarded, ["slow"])
+
+    def test_hedges_past_the_deadline_are_discarded(self):
+        resilience = Resilience(max_attempts=1, hedge_percentile=50, hedge_min_samples=5)
+        for _ in range(5):
+            resilience.latencies("chat").add(0.01)
+        discarded = []
+
+        def fn(timeout):
+            time.sleep(0.3)
+            return "late"
+
+        with self.assertRaises(DeadlineExceeded):
+            resilience.call("chat", fn, deadline=time.monotonic() + 0.1, hedge=True, on_discard=discarded.append)
+        time.sleep(0.5)
+        self.assertEqual(discarded, ["late", "late"])
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_spans_are_tagged_and_summarized(self):
+        metrics = Metrics()
+        with turn_context("session-a", 3):
+            for ms in range(1, 101):
+                metrics.observe("transcription", ms / 1000)
+            with metrics.span("decode"):
+                pass
+
+        summary = metrics.snapshot()
+        self.assertEqual(summary["transcription"]["count"], 100)
+        self.assertEqual(summary["transcription"]["p50_ms"], 51.0)
+        self.assertEqual(summary["transcription"]["p99_ms"], 100.0)
+        self.assertEqual(metrics.spans[-1]["stage"], "decode")
+        self.assertEqual((metrics.spans[-1]["session"], metrics.spans[-1]["turn"]), ("session-a", 3))
+
+    def test_prometheus_text_is_served_over_http(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.observe("llm_total", 0.5, task="chat")
+        metrics.observe("llm_total", 2.0, task="chat")
+
+        text = metrics.render_prometheus()
+        self.assertIn('vocaiyze_stage_duration_seconds_bucket{le="0.1",stage="llm_total",task="chat"} 0', text)
+        self.assertIn('vocaiyze_stage_duration_seconds_bucket{le="1.0",stage="llm_total",task="chat"} 1', text)
+        self.assertIn('vocaiyze_stage_duration_seconds_bucket{le="+Inf",stage="llm_total",task="chat"} 2', text)
+        self.assertIn('vocaiyze_stage_duration_seconds_count{stage="llm_total",task="chat"} 2', text)
+
+        exporter = MetricsExporter(metrics, port=0).start()
+        try:
+            response = httpx.get(f"http://127.0.0.1:{exporter.port}/metrics")
+        finally:
+            exporter.stop()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, text)
+
+    @patch('llm.OpenAI')
+    def test_stream_records_time_to_first_token(self, mock_openai):
+        def chunk(text):
+            return MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+        mock_openai.return_value.chat.completions.create.return_value = iter([chunk("Hi"), chunk(" there")])
+        metrics = Metrics()
+
+        llm = LLM("test_key", metrics=metrics)
+        self.assertEqual("".join(llm.generate_stream("Hello")), "Hi there")
+
+        stages = [span["stage"] for span in metrics.spans]
+        self.assertEqual(stages, [LLM_FIRST_TOKEN, LLM_TOTAL])
+        self.assertEqual(metrics.spans[0]["task"], "chat")
+
+    @patch('llm.OpenAI')
+    def test_stream_total_leaves_out_consumer_time(self, mock_openai):
+        def chunk(text):
+            return MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+        mock_openai.return_value.chat.completions.create.return_value = iter([chunk("Hi"), chunk(" there")])
+        metrics = Metrics()
+
+        llm = LLM("test_key", metrics=metrics)
+        for _ in llm.generate_stream("Hello"):
+            time.sleep(0.2)  # Playing the sentence back
+
+        self.assertLess(metrics.spans[-1]["seconds"], 0.2)
+
+    def test_prometheus_file_is_world_readable_and_temp_files_are_cleaned_up(self):
+        metrics = Metrics()
+        metrics.observe("llm_total", 0.5, task="chat")
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            path = os.path.join(metrics_dir, "vocaiyze.prom")
+            metrics.write_prometheus(path)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+            with patch('metrics.os.replace', side_effect=OSError("disk full")):
+                with self.assertRaises(OSError):
+                    metrics.write_prometheus(path)
+            self.assertEqual(os.listdir(metrics_dir), ["vocaiyze.prom"])
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_turns_run_against_the_fake_server(self):
+        instant = {"chat": EndpointProfile(), "speech": EndpointProfile(),
+                   "transcription": EndpointProfile(latency=Latency(0.01), error_rate=0.2)}
+
+        report = run_benchmark(turns=6, concurrency=3, profiles=instant, seed=7, utterance_seconds=0.5,
+                               max_attempts=10)
+
+        self.assertEqual(report["completed"], 6)
+        self.assertGreater(report["turns_per_second"], 0)
+        self.assertEqual(report["stages"][SPEECH_TO_FIRST_AUDIO]["count"], 6)
+        self.assertEqual(report["stages"]["llm_first_token[task=chat]"]["count"], 6)
+        transcription = report["server"]["transcription"]
+        self.assertEqual(transcription["requests"] - transcription["errors"], 6)
+        self.assertEqual(report["resilience"]["retries"], transcription["errors"])
+
+
+def pcm_tone(seconds, rate=16000, amplitude=8000):
+    return array('h', (int(amplitude * math.sin(2 * math.pi * 220 * i / rate))
+                       for i in range(int(seconds * rate)))).tobytes()
+
+
+class FakeWebSocket:
+    """Delivers the given messages, then stays connected until the server closes"""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.sent = []
+        self.close_code = None
+        self.closed = asyncio.Event()
+
+    async def _receive(self):
+        for message in self.messages:
+            yield message
+        await self.closed.wait()
+
+    def __aiter__(self):
+        return self._receive()
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000, reason=""):
+        self.close_code = code
+        self.closed.set()
+
+
+class TestVoiceServer(unittest.TestCase):
+
+    def _components(self, utterances):
+        stt = MagicMock(vad_silence_duration=0.3, vad_preroll_duration=0.1, vad_max_duration=15)
+        stt.speech_to_text.side_effect = utterances
+        llm = MagicMock()
+        llm.generate_sentences.side_effect = lambda prompt, **kwargs: iter(["Reply one.", "More."])
+        tts = MagicMock()
+        tts.iter_speech.side_effect = lambda text, **kwargs: iter([text[:2].encode(), text[2:].encode()])
+        return llm, tts, stt
+
+    def test_endpointer_splits_utterances_on_silence(self):
+        endpointer = Endpointer(16000, silence_duration=0.2, preroll_duration=0.1)
+        silence = bytes(16000 * 2 // 2)  # 0.5 s
+
+        utterances = endpointer.feed(silence + pcm_tone(0.4) + silence + pcm_tone(0.3))
+        self.assertEqual(len(utterances), 1)
+        # Pre-roll, the speech, and the trailing silence that ended it
+        self.assertEqual(len(utterances[0]), (1600 + 6400 + 3200) * 2)
+        self.assertEqual(len(endpointer.flush()), (1600 + 4800) * 2)
+        self.assertIsNone(endpointer.flush())
+
+    def test_session_streams_transcripts_replies_and_audio(self):
+        llm, tts, stt = self._components(["hello", "goodbye"])
+        server = VoiceServer(llm, tts, stt, farewell="Bye now.", metrics=Metrics())
+        speech = pcm_tone(0.4) + bytes(16000)
+        websocket = FakeWebSocket([json.dumps({"type": "start", "sample_rate": 16000}), speech, speech])
+
+        try:
+            asyncio.run(server.handle(websocket))
+        finally:
+            server.close()
+
+        sent = [m if isinstance(m, bytes) else tuple(json.loads(m).get(k) for k in ("type", "turn", "text"))
+                for m in websocket.sent]
+        self.assertEqual(sent[0][0], "session")
+        self.assertEqual(sent[1:], [
+            ("transcript", 1, "hello"), ("reply", 1, "Reply one."), b"Re", b"ply one.",
+            ("reply", 1, "More."), b"Mo", b"re.", ("audio_end", 1, None),
+            ("transcript", 2, "goodbye"), ("reply", 2, "Bye now."), b"By", b"e now.", ("audio_end", 2, None)])
+        self.assertEqual(llm.generate_sentences.call_args[0][0][-1], {"role": "user", "content": "hello"})
+        self.assertTrue(stt.speech_to_text.call_args[0][0].startswith(b"RIFF"))
+        self.assertEqual(server.stats(), {"accepted": 1, "rejected": 0, "completed": 1, "active": 0})
+
+    def test_callers_over_the_cap_are_turned_away(self):
+        llm, tts, stt = self._components([])
+        server = VoiceServer(llm, tts, stt, max_sessions=1)
+        server.sessions["busy"] = MagicMock()
+        websocket = FakeWebSocket([])
+
+        try:
+            asyncio.run(server.handle(websocket))
+        finally:
+            server.close()
+
+        self.assertEqual(websocket.close_code, 1013)
+        self.assertEqual(server.counters["rejected"], 1)
+        stt.speech_to_text.assert_not_called()
+
+    def test_bad_start_messages_are_refused(self):
+        llm, tts, stt = self._components(["goodbye"])
+        server = VoiceServer(llm, tts, stt, metrics=Metrics())
+        bad = [{"type": "start", "sample_rate": 0}, {"type": "start", "sample_rate": 10},
+               {"type": "start", "sample_rate": "fast"}]
+        websocket = FakeWebSocket([json.dumps(m) for m in bad] + [pcm_tone(0.4) + bytes(16000)])
+
+        try:
+            asyncio.run(server.handle(websocket))
+        finally:
+            server.close()
+
+        errors = [json.loads(m) for m in websocket.sent
+                  if isinstance(m, str) and json.loads(m)["type"] == "error"]
+        self.assertEqual(len(errors), 3)
+        # The session carries on at the default rate
+        stt.speech_to_text.assert_called_once()
+        with self.assertRaises(AssertionError):
+            Endpointer(sample_rate=10)
+
+
+class TestConversationPipeline(unittest.TestCase):
+
+    def _components(self, utterances):
+        stt = MagicMock()
+        stt.capture_audio.return_value = b'audio'
+        stt.speech_to_text.side_effect = utterances
+        llm = MagicMock()
+        llm.generate_sentences.side_effect = lambda prompt, **kwargs: iter(
+            [f"reply {llm.generate_sentences.call_count}.", "More detail."])
+        tts = MagicMock()
+        tts.streaming_playback = False
+        tts.synthesize.side_effect = lambda text, **kwargs: text.encode()
+        return llm, tts, stt
+
+    def test_turns_flow_through_all_stages_in_order(self):
+        llm, tts, stt = self._components(["hello", "how are you", "goodbye"])
+
+        pipeline = ConversationPipeline(llm, tts, stt)
+        pipeline.run(greeting="hi", farewell="bye now")
+
+        played = [c[0][0] for c in tts.play_audio.call_args_list]
+        self.assertEqual(played, [b"hi", b"reply 1.", b"More detail.", b"reply 2.",
+                                  b"More detail.", b"bye now"])
+        self.assertEqual(llm.generate_sentences.call_count, 2)
+        messages = llm.generate_sentences.call_args[0][0]
+        self.assertEqual(messages[0]["role"], "system")
+        self.assertEqual(messages[1:], [{"role": "user", "content": "hello"},
+                                        {"role": "assistant", "content": "reply 1. More detail."},
+                                        {"role": "user", "content": "how are you"}])
+
+    def test_microphone_is_paused_while_the_reply_plays(self):
+        llm, tts, stt = self._components(["hello", "bye"])
+        events = []
+        stt.capture_audio.side_effect = lambda **kwargs: events.append("capture") or b'audio'
+        tts.play_audio.side_effect = lambda audio: events.append(audio)
+
+        ConversationPipeline(llm, tts, stt).run(farewell="bye now")
+
+        self.assertEqual(events, ["capture", b"reply 1.", b"More detail.", "capture", b"bye now"])
+
+    def test_streaming_playback_receives_chunks_in_order(self):
+        llm, tts, stt = self._components(["hello", "bye"])
+        tts.streaming_playback = True
+        tts.iter_speech.side_effect = lambda text, **kwargs: iter([text[:3].encode(), text[3:].encode()])
+        played = []
+        tts.play_stream.side_effect = lambda chunks: played.append(b"".join(chunks))
+
+        pipeline = ConversationPipeline(llm, tts, stt)
+        pipeline.run(farewell="bye now")
+
+        self.assertEqual(played, [b"reply 1.", b"More detail.", b"bye now"])
+        tts.synthesize.assert_not_called()
+
+    def test_streaming_synthesis_failure_is_shown_but_not_spoken(self):
+        llm, tts, stt = self._components(["hello", "bye"])
+        tts.streaming_playback = True
+
+        def iter_speech(text, **kwargs):
+            if text == "reply 1.":
+                raise DeadlineExceeded("first byte too slow")
+            return iter([text.encode()])
+        tts.iter_speech.side_effect = iter_speech
+        played = []
+        tts.play_stream.side_effect = lambda chunks: played.append(b"".join(chunks))
+
+        pipeline = ConversationPipeline(llm, tts, stt)
+        pipeline.run(farewell="bye now")
+
+        self.assertIsNone(pipeline.error)
+        self.assertEqual(played, [b"", b"More detail.", b"bye now"])
+
+    def test_speech_past_its_deadline_is_spoken_late_and_recorded_missed(self):
+        llm, tts, stt = self._components(["hello", "bye"])
+        tts.streaming_playback = True
+        deadlines = []
+
+        def iter_speech(text, deadline=None):
+            deadlines.append(deadline)
+            if deadline is not None and text == "reply 1.":
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                raise DeadlineExceeded("first byte too slow")
+            return iter([text.encode()])
+        tts.iter_speech.side_effect = iter_speech
+        played = []
+        tts.play_stream.side_effect = lambda chunks: played.append(b"".join(chunks))
+
+        pipeline = ConversationPipeline(llm, tts, stt, turn_budget=0.3, tts_reserve=0.1)
+        pipeline.run(farewell="bye now")
+
+        self.assertIsNone(pipeline.error)
+        self.assertEqual(played, [b"reply 1.", b"More detail.", b"bye now"])
+        self.assertIsNotNone(deadlines[0])
+        self.assertIsNone(deadlines[1])  # The retry has no deadline
+        # The farewell, queued behind the late reply, may miss its budget too
+        self.assertGreaterEqual(pipeline.outcomes["missed"], 1)
+
+    def test_transient_generation_errors_end_the_turn_not_the_session(self):
+        llm, tts, stt = self._components(["hello", "again", "bye"])
+        timeout = openai.APITimeoutError(request=httpx.Request("POST", "https://x"))
+
+        def cut_short(prompt, **kwargs):
+            yield "Partial answer."
+            raise timeout
+
+        def generate(prompt, deadline=None, task="chat", **kwargs):
+            if llm.generate_sentences.call_count == 1:
+                return cut_short(prompt)
+            raise timeout  # Main model and fallback both fail
+        llm.generate_sentences.side_effect = generate
+
+        pipeline = ConversationPipeline(llm, tts, stt, turn_budget=5)
+        pipeline.run(farewell="bye now")
+
+        played = [c[0][0] for c in tts.play_audio.call_args_list]
+        self.assertEqual(played, [b"Partial answer.", FILLER_PHRASE.encode(), RETRY_PROMPT.encode(), b"bye now"])
+        self.assertEqual(pipeline.memory.turns[1]["content"], "Partial answer.")
+
+    def test_transient_transcription_failure_asks_again(self):
+        llm, tts, stt = self._components([openai.APITimeoutError(request=httpx.Request("POST", "https://x")),
+                                          "hello", "bye"])
+
+        pipeline = ConversationPipeline(llm, tts, stt)
+        pipeline.run(farewell="bye now")
+
+        played = [c[0][0] for c in tts.play_audio.call_args_list]
+        self.assertEqual(played[0], RETRY_PROMPT.encode())
+        self.assertEqual(played[1:], [b"reply 1.", b"More detail.", b"bye now"])
+
+    def test_slow_model_falls_back_and_turn_is_degraded(self):
+        llm, tts, stt = self._components(["hello", "bye"])
+
+        def generate(prompt, deadline=None, task="chat", **kwargs):
+            if task == "chat":
+                raise DeadlineExceeded("first token too slow")
+            return iter(["Quick answer."])
+        llm.generate_sentences.side_effect = generate
+
+        pipeline = ConversationPipeline(llm, tts, stt, turn_budget=5)
+        pipeline.run(farewell="bye now")
+
+        played = [c[0][0] for c in tts.play_audio.call_args_list]
+        self.assertEqual(played, [FILLER_PHRASE.encode(), b"Quick answer.", b"bye now"])
+        self.assertIsNotNone(llm.generate_sentences.call_args_list[0][1]["deadline"])
+        self.assertEqual(pipeline.outcomes, {"met": 1, "degraded": 1, "missed": 0})
+        self.assertEqual(pipeline.memory.turns[-1]["content"], "Quick answer.")
+
+    @patch('llm.OpenAI')
+    def test_slow_turns_in_a_row_keep_falling_back(self, mock_openai):
+        def create(model, stream=False, **kwargs):
+            if model == "gpt-4":
+                raise openai.APITimeoutError(request=httpx.Request("POST", "https://x"))
+            return iter([MagicMock(choices=[MagicMock(delta=MagicMock(content="Quick answer."))])])
+        mock_openai.return_value.chat.completions.create.side_effect = create
+        llm = LLM("test_key", resilience=Resilience(max_attempts=1, failure_threshold=3))
+        _, tts, stt = self._components(["hello"] * 6 + ["bye"])
+
+        pipeline = ConversationPipeline(llm, tts, stt, turn_budget=5)
+        pipeline.run(farewell="bye now")
+
+        played = [c[0][0] for c in tts.play_audio.call_args_list]
+        self.assertEqual(played, [FILLER_PHRASE.encode(), b"Quick answer."] * 6 + [b"bye now"])
+        self.assertEqual(pipeline.outcomes["degraded"], 6)
+        self.assertEqual(llm.resilience.breaker("chat:gpt-4").state, "closed")
+
+    @patch('llm.OpenAI')
+    def test_budget_timeouts_do_not_open_the_circuit(self, mock_openai):
+        def create(model, stream=False, **kwargs):
+            if model == "gpt-4":
+                raise openai.APITimeoutError(request=httpx.Request("POST", "https://x"))
+            return iter([MagicMock(choices=[MagicMock(delta=MagicMock(content="Quick answer."))])])
+        mock_openai.return_value.chat.completions.create.side_effect = create
+        llm = LLM("test_key", resilience=Resilience(max_attempts=1, failure_threshold=3))
+
+        # Several sessions' turns miss their budget back to back
+        for _ in range(5):
+            with self.assertRaises(openai.APITimeoutError):
+                list(llm.generate_sentences("hello", deadline=time.monotonic() + 3, strict=True))
+        self.assertEqual(llm.resilience.breaker("chat:gpt-4").state, "closed")
+        self.assertEqual(list(llm.generate_sentences("hello", task="fast_chat")), ["Quick answer."])
+
+        # Real failures still open the main model's circuit, but not the fallback's
+        for _ in range(3):
+            list(llm.generate_sentences("hello"))
+        self.assertEqual(llm.resilience.breaker("chat:gpt-4").state, "open")
+        self.assertEqual(list(llm.generate_sentences("hello", task="fast_chat")), ["Quick answer."])
+
+    def test_stage_error_is_raised(self):
+        llm, tts, stt = self._components(["hello"] * 100)
+        llm.generate_sentences.side_effect = RuntimeError("boom")
+
+        pipeline = ConversationPipeline(llm, tts, stt)
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,35 +1,111 @@
 from pathlib import Path
+import io
+import itertools
 import os
 from openai import OpenAI
 from pydub import AudioSegment
 from pydub.playback import play
+import pyaudio
 import logging
 import tempfile
 import sys
+import time
+from contextlib import ExitStack
+from typing import Iterable, Iterator, List
+from tts_cache import TTSCache
+from rate_limit import RateLimiter, get_rate_limiter
+from resilience import Resilience, get_resilience
+from metrics import DECODE, PLAYBACK, TTS_FIRST_BYTE, TTS_TOTAL, Metrics, get_metrics
 sys.path.append('/usr/bin/ffmpeg')  # Ensure ffmpeg is in path
 
 logger = logging.getLogger("vocAIyze.TTS")
 
+# Raw PCM returned by the speech endpoint: 24 kHz, 16-bit signed, mono
+PCM_SAMPLE_RATE = 24000
+PCM_SAMPLE_WIDTH = 2
+
 class TextToSpeech:
-    def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key: str, cache: TTSCache = None, client: OpenAI = None,
+                 rate_limiter: RateLimiter = None, resilience: Resilience = None, metrics: Metrics = None):
+        self.client = client or OpenAI(api_key=api_key)
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.resilience = resilience or get_resilience()
+        self.hedge_requests = False  # Hedge slow first bytes of streamed speech
+        self.metrics = metrics or get_metrics()
+        self.model = "tts-1"
+        self.cache = cache  # Optional TTSCache for repeated phrases
         self.speech_file_path = Path(__file__).parent / "speech.mp3"
         self.available_voices = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
         self.current_voice = "alloy"  # Default voice
+        # Play replies by streaming raw PCM straight to the sound card instead of
+        # writing an mp3 and decoding it with ffmpeg
+        self.streaming_playback = True
+        self.stream_chunk_size = 4096
+        self._audio = None
+        self._output_stream = None
         logger.info("TextToSpeech initialized")
 
+    def _create_speech(self, text: str, response_format: str = None, deadline: float = None):
+        """One speech request, rate limited and retried on transient errors"""
+        options = {"response_format": response_format} if response_format else {}
+
+        def attempt(timeout: float):
+            with self.rate_limiter.acquire("speech"):
+                return self.client.audio.speech.create(
+                    model=self.model,
+                    voice=self.current_voice,
+                    input=text,
+                    timeout=timeout,
+                    **options
+                )
+
+        with self.metrics.span(TTS_TOTAL):
+            return self.resilience.call("speech", attempt, deadline=deadline)
+
+    def _open_speech_stream(self, text: str, timeout: float):
+        """
+        Start a streamed PCM speech request and wait for its first chunk
+
+        Returns:
+            (resources, first chunk, remaining chunks)
+        """
+        resources = ExitStack()
+        try:
+            resources.enter_context(self.rate_limiter.acquire("speech"))
+            response = resources.enter_context(self.client.audio.speech.with_streaming_response.create(
+                model=self.model,
+                voice=self.current_voice,
+                input=text,
+                response_format="pcm",
+                timeout=timeout
+            ))
+            chunks = iter(response.iter_bytes(self.stream_chunk_size))
+            first = next(chunks, b"")
+        except BaseException as e:
+            resources.__exit__(type(e), e, e.__traceback__)
+            raise
+        return resources, first, chunks
+
     def text_to_speech(self, text: str, output_path: str = None):
         """
         Convert text to speech using OpenAI's TTS API
         
         Args:
             text: The text to convert to speech
-            output_path: Path to save the audio file (optional)
+            output_path: Path to save the audio file (optional). Without it the
+                speech is played, streamed as PCM when streaming_playback is set
+
+        Returns:
+            Path of the saved audio file, or None when streamed
         """
         if not text:
             logger.warning("Empty text provided to text_to_speech")
             return
             
+        if not output_path and self.streaming_playback:
+            self.speak(text)
+            return None
+
         try:
             # Use provided output path or default
             file_path = output_path if output_path else self.speech_file_path
@@ -40,11 +116,7 @@ class TextToSpeech:
                 text = text[:4000]
             
             logger.info(f"Converting text to speech, length: {len(text)} chars")
-            response = self.client.audio.speech.create(
-                model="tts-1",
-                voice=self.current_voice,
-                input=text
-            )
+            response = self._create_speech(text)
             
             # Ensure directory exists
             os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
@@ -55,8 +127,10 @@ class TextToSpeech:
             
             # Play audio if no output path specified (interactive mode)
             if not output_path:
-                sound = AudioSegment.from_file(file_path)
-                play(sound)
+                with self.metrics.span(DECODE):
+                    sound = AudioSegment.from_file(file_path)
+                with self.metrics.span(PLAYBACK):
+                    play(sound)
                 
             return str(file_path)
                 
@@ -64,6 +138,199 @@ class TextToSpeech:
             logger.error(f"Error in text_to_speech: {str(e)}")
             raise
             
+    def synthesize(self, text: str, response_format: str = "mp3", deadline: float = None) -> bytes:
+        """
+        Convert text to speech and return the encoded audio without playing it
+
+        Args:
+            text: The text to convert to speech
+            response_format: Audio format to request ("mp3" or "pcm")
+            deadline: time.monotonic() value by which the audio is needed (optional)
+
+        Returns:
+            Audio bytes in the requested format (empty if text is empty)
+        """
+        if not text:
+            logger.warning("Empty text provided to synthesize")
+            return b""
+
+        try:
+            if len(text) > 4000:
+                logger.warning(f"Text too long ({len(text)} chars), truncating to 4000 chars")
+                text = text[:4000]
+
+            key = None
+            if self.cache is not None:
+                key = self.cache.key(self.model, self.current_voice, text, response_format)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    logger.info("Speech served from cache")
+                    return cached
+
+            logger.info(f"Synthesizing speech, length: {len(text)} chars")
+            response = self._create_speech(text, response_format, deadline=deadline)
+            if key is not None:
+                self.cache.put(key, response.content)
+            return response.content
+
+        except Exception as e:
+            logger.error(f"Error in synthesize: {str(e)}")
+            raise
+
+    def iter_speech(self, text: str, deadline: float = None) -> Iterator[bytes]:
+        """
+        Convert text to speech, yielding raw PCM chunks as they arrive
+
+        Args:
+            text: The text to convert to speech
+            deadline: time.monotonic() value by which the first chunk is needed (optional)
+
+        Yields:
+            24 kHz 16-bit mono PCM chunks
+        """
+        if not text:
+            logger.warning("Empty text provided to iter_speech")
+            return
+
+        try:
+            if len(text) > 4000:
+                logger.warning(f"Text too long ({len(text)} chars), truncating to 4000 chars")
+                text = text[:4000]
+
+            key = None
+            if self.cache is not None:
+                key = self.cache.key(self.model, self.current_voice, text, "pcm")
+                cached = self.cache.get(key)
+                if cached is not None:
+                    logger.info("Speech served from cache")
+                    for start in range(0, len(cached), self.stream_chunk_size):
+                        yield cached[start:start + self.stream_chunk_size]
+                    return
+
+            logger.info(f"Streaming speech, length: {len(text)} chars")
+            received = []
+            started = time.monotonic()
+            # Failures before the first chunk are retried; a broken stream is not restarted
+            resources, first, chunks = self.resilience.call(
+                "speech", lambda timeout: self._open_speech_stream(text, timeout), deadline=deadline,
+                hedge=self.hedge_requests, on_discard=lambda opened: opened[0].close())
+            self.metrics.observe(TTS_FIRST_BYTE, time.monotonic() - started)
+            paused = 0.0  # Time the consumer (playback, a slow socket) held us at a yield
+            with resources:
+                for chunk in itertools.chain([first], chunks):
+                    if not chunk:
+                        continue
+                    if key is not None:
+                        received.append(chunk)
+                    yielded_at = time.monotonic()
+                    yield chunk
+                    paused += time.monotonic() - yielded_at
+            self.metrics.observe(TTS_TOTAL, time.monotonic() - started - paused)
+            # Only complete responses are cached
+            if key is not None:
+                self.cache.put(key, b"".join(received))
+
+        except Exception as e:
+            logger.error(f"Error in iter_speech: {str(e)}")
+            raise
+
+    def _get_output_stream(self):
+        """Open the PCM output stream once and reuse it for every reply"""
+        if self._output_stream is None:
+            self._audio = pyaudio.PyAudio()
+            self._output_stream = self._audio.open(format=pyaudio.paInt16,
+                                                   channels=1,
+                                                   rate=PCM_SAMPLE_RATE,
+                                                   output=True)
+        return self._output_stream
+
+    def play_stream(self, chunks: Iterable[bytes]):
+        """
+        Write raw PCM chunks to the sound card as they become available
+
+        Args:
+            chunks: 24 kHz 16-bit mono PCM chunks
+        """
+        stream = self._get_output_stream()
+        carry = b""
+        with self.metrics.span(PLAYBACK):
+            for chunk in chunks:
+                # Only whole samples can be written
+                data = carry + chunk
+                usable = len(data) - len(data) % PCM_SAMPLE_WIDTH
+                if usable:
+                    stream.write(data[:usable])
+                carry = data[usable:]
+
+    def speak(self, text: str):
+        """
+        Speak text, starting playback with the first chunk received
+
+        Args:
+            text: The text to speak
+        """
+        self.play_stream(self.iter_speech(text))
+
+    def play_audio(self, audio: bytes, response_format: str = "mp3"):
+        """
+        Play audio returned by synthesize
+
+        Args:
+            audio: Audio bytes
+            response_format: Format of the audio ("mp3" or "pcm")
+        """
+        if not audio:
+            return
+        if response_format == "pcm":
+            self.play_stream([audio])
+            return
+        with self.metrics.span(DECODE):
+            sound = AudioSegment.from_file(io.BytesIO(audio), format=response_format)
+        with self.metrics.span(PLAYBACK):
+            play(sound)
+
+    def prewarm(self, phrases: List[str]) -> int:
+        """
+        Synthesize phrases into the cache ahead of time
+
+        Phrases are stored in the format used for playback, so later calls play
+        them without any API request.
+
+        Args:
+            phrases: Texts likely to be spoken (greetings, canned replies)
+
+        Returns:
+            Number of phrases that had to be synthesized
+        """
+        if self.cache is None:
+            logger.warning("prewarm called without a cache configured")
+            return 0
+
+        response_format = "pcm" if self.streaming_playback else "mp3"
+        synthesized = 0
+        for phrase in phrases:
+            key = self.cache.key(self.model, self.current_voice, phrase[:4000], response_format)
+            if key in self.cache:
+                continue
+            try:
+                response = self._create_speech(phrase[:4000], response_format)
+                self.cache.put(key, response.content)
+                synthesized += 1
+            except Exception as e:
+                logger.error(f"Error prewarming phrase '{phrase[:40]}': {str(e)}")
+        logger.info(f"TTS cache prewarmed: {synthesized} of {len(phrases)} phrases synthesized")
+        return synthesized
+
+    def close(self):
+        """Release the audio output device"""
+        if self._output_stream is not None:
+            self._output_stream.stop_stream()
+            self._output_stream.close()
+            self._output_stream = None
+        if self._audio is not None:
+            self._audio.terminate()
+            self._audio = None
+
     def set_voice(self, voice_name: str) -> bool:
         """
         Set the voice to use for TTS